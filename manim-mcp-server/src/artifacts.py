@@ -0,0 +1,140 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+import mimetypes
+
+# 渲染结果的存放目录
+ARTIFACT_DIR = os.environ.get(
+    "ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+)
+# 渲染结果的保留时间（秒）
+ARTIFACT_TTL = int(os.environ.get("ARTIFACT_TTL", 24 * 3600))
+# 分块读取时每块的最大字节数
+ARTIFACT_CHUNK_SIZE = int(os.environ.get("ARTIFACT_CHUNK_SIZE", 1024 * 1024))
+# 清理过期结果的最小间隔（秒）
+CLEANUP_INTERVAL = 60
+
+
+class ArtifactNotFound(Exception):
+    pass
+
+
+class ArtifactStore:
+    """本地的渲染结果存储
+
+    每个结果保存在 <目录>/<artifact_id>/<文件名>，响应中只返回ID和路径，
+    客户端直接读取文件，或者用read_chunk分块获取内容，不需要把整个视频放进一条消息。
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, ttl=ARTIFACT_TTL):
+        """初始化存储
+
+        Args:
+            root: 存放目录
+            ttl: 保留时间（秒），0表示不过期
+        """
+        self.root = root
+        self.ttl = ttl
+        self._last_cleanup = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, path, move=False):
+        """保存文件
+
+        Args:
+            path: 文件路径
+            move: 是否移动文件（否则优先使用硬链接，不能链接时复制）
+
+        Returns:
+            dict: 结果信息，见info
+        """
+        self.cleanup()
+        artifact_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, artifact_id)
+        os.makedirs(directory)
+        target = os.path.join(directory, os.path.basename(path))
+        try:
+            if move:
+                shutil.move(path, target)
+            else:
+                try:
+                    # 缓存中的文件不会被修改，硬链接不占用额外空间，缓存淘汰后依然有效
+                    os.link(path, target)
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    shutil.copyfile(path, target)
+        except BaseException:
+            # 源文件不存在（如缓存结果刚被淘汰）时不留下空的结果目录
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        return self.info(artifact_id)
+
+    def path(self, artifact_id):
+        """结果文件的路径，不存在时抛出ArtifactNotFound"""
+        # ID只能是add生成的十六进制字符串，防止访问目录之外的文件
+        if not artifact_id or not all(c in "0123456789abcdef" for c in artifact_id):
+            raise ArtifactNotFound(f"结果不存在: {artifact_id}")
+        directory = os.path.join(self.root, artifact_id)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        if not names:
+            raise ArtifactNotFound(f"结果不存在: {artifact_id}")
+        return os.path.join(directory, names[0])
+
+    def info(self, artifact_id):
+        """结果信息: artifact_id, filename, path, size, mime_type"""
+        path = self.path(artifact_id)
+        return {
+            "artifact_id": artifact_id,
+            "filename": os.path.basename(path),
+            "path": os.path.abspath(path),
+            "size": os.path.getsize(path),
+            "mime_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        }
+
+    def read_chunk(self, artifact_id, offset=0, length=ARTIFACT_CHUNK_SIZE):
+        """读取一块内容
+
+        Returns:
+            tuple: (数据, 文件总大小)
+        """
+        path = self.path(artifact_id)
+        length = max(0, min(length, ARTIFACT_CHUNK_SIZE))
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        return data, os.path.getsize(path)
+
+    def delete(self, artifact_id):
+        """删除结果，返回是否存在"""
+        try:
+            self.path(artifact_id)
+        except ArtifactNotFound:
+            return False
+        shutil.rmtree(os.path.join(self.root, artifact_id), ignore_errors=True)
+        return True
+
+    def cleanup(self, force=False):
+        """删除过期的结果（按间隔执行）"""
+        now = time.time()
+        with self._lock:
+            if not self.ttl or (not force and now - self._last_cleanup < CLEANUP_INTERVAL):
+                return
+            self._last_cleanup = now
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+
+# 全局存储
+artifact_store = ArtifactStore()
@@ -1,17 +1,189 @@
 import os
+import re
 import json
-import subprocess
+import asyncio
 import tempfile
 import base64
 import shutil
 from pathlib import Path
 from mcp import stdio_server
 
+from render_cache import render_cache, cache_key, manim_version
+from render_pool import render_pool, RenderError
+from artifacts import artifact_store, ARTIFACT_CHUNK_SIZE
+
 # 配置
 MANIM_EXECUTABLE = os.environ.get("MANIM_EXECUTABLE", "manim")
 PORT = int(os.environ.get("PORT", 8090))
+# 默认的返回方式: base64（整个视频放在响应中，与之前的版本兼容）或 artifact（结果ID和本地文件路径，可以分块读取），
+# 请求中的 response 字段可以单独指定
+RESPONSE_MODE = os.environ.get("RESPONSE_MODE", "base64")
+RESPONSE_MODES = ("artifact", "base64")
+# 默认的渲染质量
+RENDER_QUALITY = os.environ.get("RENDER_QUALITY", "medium")
+
+# 渲染质量 -> manim参数（draft用于快速预览，production用于最终输出）
+QUALITY_PROFILES = {
+    "draft": ["-ql"],        # 854x480 15fps
+    "medium": ["-qm"],       # 1280x720 30fps
+    "high": ["-qh"],         # 1920x1080 60fps
+    "production": ["-qp"],   # 2560x1440 60fps
+    "4k": ["-qk"],           # 3840x2160 60fps
+}
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".gif")
+# 只保存最后一帧时图片文件名带有版本后缀，如 Scene_ManimCE_v0.18.0.png
+IMAGE_SUFFIX_RE = re.compile(r'_ManimCE_v[\w.]+$')
+SCENE_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def render_flags(quality=None, preview=False, scenes=None):
+    """根据请求生成manim参数
+
+    Args:
+        quality: 渲染质量，见QUALITY_PROFILES，预览默认使用draft
+        preview: 只渲染最后一帧的PNG，用于快速检查布局
+        scenes: 要渲染的场景类名列表，为空时渲染文件中的所有场景
+
+    Returns:
+        list: 场景名和参数，无效时抛出ValueError
+    """
+    quality = quality or ("draft" if preview else RENDER_QUALITY)
+    if quality not in QUALITY_PROFILES:
+        raise ValueError(f"不支持的渲染质量: {quality}，可选 {', '.join(QUALITY_PROFILES)}")
+    if isinstance(scenes, str):
+        scenes = [scenes]
+    scenes = list(scenes or [])
+    for scene in scenes:
+        if not isinstance(scene, str) or not SCENE_NAME_RE.match(scene):
+            raise ValueError(f"无效的场景名: {scene}")
+    # 不指定场景时manim会交互式询问，改为渲染全部场景
+    flags = scenes + QUALITY_PROFILES[quality] + (["-s"] if preview else []) + ([] if scenes else ["-a"])
+    return flags
+
+def find_outputs(media_dir, preview=False):
+    """在媒体目录中查找渲染结果（不依赖分辨率目录名），返回 [{"scene", "kind", "path"}]
+
+    一次渲染只使用一种质量，场景名在文件中唯一，所以文件名不会重复。
+    """
+    outputs = []
+    root = os.path.join(media_dir, "images" if preview else "videos")
+    for dirpath, dirnames, filenames in os.walk(root):
+        # 分段视频是合成前的中间文件
+        dirnames[:] = sorted(d for d in dirnames if d != "partial_movie_files")
+        for file in sorted(filenames):
+            stem, ext = os.path.splitext(file)
+            if preview and ext.lower() == ".png":
+                outputs.append({"scene": IMAGE_SUFFIX_RE.sub("", stem), "kind": "image",
+                                "path": os.path.join(dirpath, file)})
+            elif not preview and ext.lower() in VIDEO_EXTENSIONS:
+                outputs.append({"scene": stem, "kind": "video", "path": os.path.join(dirpath, file)})
+    return outputs
+
+def attach_outputs(response, outputs, mode, move=False):
+    """按返回方式把渲染结果加入响应
 
-def run_manim(code):
+    outputs列出所有结果；第一个结果同时放在 artifact（或 video / image）中，兼容只渲染一个场景的调用方。
+    文件不存在时抛出FileNotFoundError，已经保存的结果会被删除。
+    """
+    items = []
+    try:
+        for output in outputs:
+            item = {"scene": output["scene"], "kind": output["kind"]}
+            if mode == "base64":
+                with open(output["path"], "rb") as f:
+                    item["data"] = base64.b64encode(f.read()).decode('utf-8')
+            else:
+                item.update(artifact_store.add(output["path"], move=move))
+            items.append(item)
+    except FileNotFoundError:
+        for item in items:
+            if "artifact_id" in item:
+                artifact_store.delete(item["artifact_id"])
+        raise
+    response["outputs"] = items
+    if items:
+        first = items[0]
+        if mode == "base64":
+            response[first["kind"]] = first["data"]
+        else:
+            response["artifact"] = {key: value for key, value in first.items() if key not in ("scene", "kind")}
+    return response
+
+def cached_response(key, mode):
+    """从缓存中读取渲染结果，未命中时返回None"""
+    cached = render_cache.get(key)
+    if not cached:
+        return None
+    entry_dir, meta = cached
+    response = {"success": True, "stdout": meta["stdout"], "stderr": meta["stderr"], "cached": True}
+    outputs = [dict(output, path=os.path.join(entry_dir, output["file"])) for output in meta["outputs"]]
+    try:
+        return attach_outputs(response, outputs, mode)
+    except FileNotFoundError:
+        # 结果在读取前被并发的写入淘汰，按未命中重新渲染
+        return None
+
+def collect_output(temp_dir, key, returncode, stdout, stderr, mode, preview=False):
+    """读取渲染输出，成功时保存到缓存，然后删除临时目录"""
+    outputs = find_outputs(os.path.join(temp_dir, "media"), preview)
+    
+    response = {
+        "success": returncode == 0,
+        "stdout": stdout,
+        "stderr": stderr,
+        "cached": False
+    }
+    
+    # 如果成功，添加渲染结果
+    if outputs:
+        entry_dir = None
+        if returncode == 0:
+            meta_outputs = [{"scene": output["scene"], "kind": output["kind"],
+                             "file": os.path.basename(output["path"])} for output in outputs]
+            entry_dir = render_cache.put(key, [output["path"] for output in outputs],
+                                         {"stdout": stdout, "stderr": stderr, "outputs": meta_outputs})
+        if entry_dir:
+            # 结果从缓存中链接，不再复制一份
+            try:
+                attach_outputs(response, [dict(output, path=os.path.join(entry_dir, os.path.basename(output["path"])))
+                                          for output in outputs], mode)
+            except FileNotFoundError:
+                # 缓存的结果已被并发的写入淘汰，改为使用临时目录中的文件
+                entry_dir = None
+        if not entry_dir:
+            attach_outputs(response, outputs, mode, move=True)
+    
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return response
+
+def read_artifact(artifact_id, offset=0, length=ARTIFACT_CHUNK_SIZE):
+    """分块读取渲染结果，客户端按offset依次请求直到eof"""
+    data, size = artifact_store.read_chunk(artifact_id, offset, length)
+    return {
+        "artifact_id": artifact_id,
+        "offset": offset,
+        "size": size,
+        "data": base64.b64encode(data).decode('utf-8'),
+        "eof": offset + len(data) >= size
+    }
+
+async def render_version():
+    """执行渲染的manim的版本：使用预热工作进程时是工作进程中导入的manim，否则是MANIM_EXECUTABLE"""
+    warm_pool = render_pool.warm_pool
+    if warm_pool is not None and warm_pool.enabled:
+        version = await warm_pool.wait_version()
+        if version is not None:
+            return version
+    return await asyncio.to_thread(manim_version, MANIM_EXECUTABLE)
+
+async def run_manim(code, job_id=None, mode=RESPONSE_MODE, quality=None, preview=False, scenes=None):
+    # 服务端不需要 -p 打开播放器
+    flags = render_flags(quality, preview, scenes)
+    # 相同的代码、参数和manim版本直接返回之前的渲染结果（文件读写放到线程中，不阻塞事件循环）
+    key = cache_key(code, flags, await render_version())
+    response = await asyncio.to_thread(cached_response, key, mode)
+    if response:
+        return response
+    
     # 创建临时文件夹和Python文件
     temp_dir = tempfile.mkdtemp()
     script_path = os.path.join(temp_dir, "animation.py")
@@ -20,42 +192,49 @@ def run_manim(code):
     with open(script_path, "w", encoding="utf-8") as f:
         f.write(code)
     
-    # 运行manim命令
-    cmd = [MANIM_EXECUTABLE, script_path, "-pqm"]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    
-    # 检查输出文件
-    media_dir = os.path.join(temp_dir, "media", "videos", "animation", "480p15")
-    video_path = ""
-    
-    if os.path.exists(media_dir):
-        for file in os.listdir(media_dir):
-            if file.endswith(".mp4"):
-                video_path = os.path.join(media_dir, file)
-                break
+    # 在进程池中运行manim命令，排队已满、超时或取消时返回错误
+    cmd = [MANIM_EXECUTABLE, script_path] + flags + ["--media_dir", os.path.join(temp_dir, "media")]
+    try:
+        returncode, stdout, stderr = await render_pool.run(cmd, cwd=temp_dir, job_id=job_id, warm=True)
+    except RenderError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return {"success": False, "error": str(e)}
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
     
-    response = {
-        "success": result.returncode == 0,
-        "stdout": result.stdout,
-        "stderr": result.stderr
-    }
-    
-    # 如果成功，添加视频数据
-    if video_path and os.path.exists(video_path):
-        with open(video_path, "rb") as f:
-            video_data = f.read()
-            response["video"] = base64.b64encode(video_data).decode('utf-8')
-    
-    return response
+    return await asyncio.to_thread(collect_output, temp_dir, key, returncode, stdout, stderr, mode, preview)
 
 def main():
     async def handle_request(request):
         try:
+            action = request.get("action")
+            if action == "cache_stats":
+                return render_cache.stats()
+            if action == "pool_stats":
+                return render_pool.stats()
+            if action == "cancel":
+                return {"cancelled": render_pool.cancel(request.get("job_id", ""))}
+            if action == "read_artifact":
+                return await asyncio.to_thread(
+                    read_artifact, request.get("artifact_id", ""), int(request.get("offset", 0)),
+                    int(request.get("length", ARTIFACT_CHUNK_SIZE))
+                )
+            if action == "delete_artifact":
+                return {"deleted": artifact_store.delete(request.get("artifact_id", ""))}
+            
             code = request.get("code", "")
             if not code:
                 return {"error": "没有提供代码"}
             
-            result = run_manim(code)
+            mode = request.get("response", RESPONSE_MODE)
+            if mode not in RESPONSE_MODES:
+                return {"error": f"不支持的返回方式: {mode}"}
+            
+            # job_id由调用方指定时可以用 {"action": "cancel", "job_id": ...} 取消
+            # preview只渲染最后一帧用于检查布局，确认后再用需要的quality渲染视频
+            result = await run_manim(code, request.get("job_id"), mode, request.get("quality"),
+                                     bool(request.get("preview")), request.get("scenes") or request.get("scene"))
             return result
         except Exception as e:
             return {"error": str(e)}
@@ -63,4 +242,4 @@ def main():
     stdio_server(handle_request)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,99 @@
+"""预热的manim工作进程，由warm_pool启动
+
+启动时导入manim，然后逐行从stdin读取任务（JSON），在本进程中执行与命令行相同的渲染，
+结果作为一行JSON写到stdout：
+
+    -> {"args": ["animation.py", "-qm", "-a", "--media_dir", "..."], "cwd": "..."}
+    <- {"returncode": 0, "stdout": "...", "stderr": "...", "rss": 123456789}
+
+启动完成时先输出 {"ready": true, "version": "..."}，导入失败时输出 {"ready": false, "error": "..."} 并退出。
+"""
+import os
+import io
+import sys
+import json
+import contextlib
+import traceback
+
+# 返回的stdout/stderr各自保留的最大字符数（只保留末尾），由warm_pool设置
+LOG_LIMIT = int(os.environ.get("WARM_WORKER_LOG_LIMIT", 1024 * 1024))
+
+
+def current_rss():
+    """当前进程占用的内存（字节）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    # 非Linux系统只能取得峰值，macOS的单位是字节，其他系统是KB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def tail(text, limit=LOG_LIMIT):
+    """只保留日志的末尾，错误信息通常在最后"""
+    if len(text) <= limit:
+        return text
+    return f"...（省略了前 {len(text) - limit} 个字符）\n" + text[-limit:]
+
+
+def render(job):
+    """执行一次渲染，每次使用独立的配置副本，结束后卸载场景模块"""
+    from manim import tempconfig
+    from manim.__main__ import main as manim_main
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    returncode = 0
+    cwd = os.getcwd()
+    job_dir = os.path.abspath(job["cwd"])
+    try:
+        os.chdir(job_dir)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr), tempconfig({}):
+            try:
+                manim_main(args=["render"] + job["args"], standalone_mode=False, prog_name="manim")
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                returncode = 1
+                traceback.print_exc()
+    finally:
+        os.chdir(cwd)
+        # 场景代码在各自的模块中执行，不影响之后的任务
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, "__file__", None) or ""
+            if path.startswith(job_dir + os.sep):
+                del sys.modules[name]
+    return {"returncode": returncode, "stdout": tail(stdout.getvalue()), "stderr": tail(stderr.getvalue())}
+
+
+def main():
+    # 协议使用原来的stdout，渲染过程中直接写文件描述符的输出（如ffmpeg）改到stderr
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+
+    def send(message):
+        protocol.write(json.dumps(message, ensure_ascii=False) + "\n")
+        protocol.flush()
+
+    try:
+        import manim
+    except Exception as e:
+        send({"ready": False, "error": f"导入manim失败: {e}"})
+        return 1
+    send({"ready": True, "version": getattr(manim, "__version__", "unknown"), "pid": os.getpid()})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        result = render(json.loads(line))
+        result["rss"] = current_rss()
+        send(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+# 渲染缓存目录
+RENDER_CACHE_DIR = os.environ.get(
+    "RENDER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_cache")
+)
+# 缓存的总大小上限（字节），超过时删除最久未使用的结果，0表示不缓存
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+META_FILE = "meta.json"
+# manim --version 的输出，如 "Manim Community v0.18.0"
+VERSION_RE = re.compile(r'v?(\d+\.\d+[\w.]*)')
+
+_version = None
+
+
+def manim_version(executable):
+    """manim的版本号（只查询一次），升级manim后旧的缓存自然失效
+
+    只保留版本号（如 0.18.0），与预热工作进程报告的 manim.__version__ 格式相同。
+    """
+    global _version
+    if _version is None:
+        try:
+            result = subprocess.run([executable, "--version"], capture_output=True, text=True, timeout=60)
+            match = VERSION_RE.search(result.stdout)
+            _version = match.group(1) if match else result.stdout.strip() or "unknown"
+        except (OSError, subprocess.SubprocessError):
+            _version = "unknown"
+    return _version
+
+
+def cache_key(code, flags, version):
+    """代码、渲染参数和manim版本的哈希"""
+    payload = json.dumps({"code": code, "flags": list(flags), "version": version}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """按内容寻址的渲染结果缓存
+
+    每个结果是缓存目录下以哈希命名的子目录，包含输出文件和meta.json（渲染日志等）。
+    总大小超过上限时按最近使用时间淘汰，最近使用时间记录在子目录的修改时间上，重启后依然有效。
+    多个进程共用缓存目录时，每个进程只统计启动时已有的和自己写入的结果，
+    大小上限由各进程分别执行，目录的总大小最多可能达到上限的进程数倍。
+    """
+
+    def __init__(self, cache_dir=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_BYTES):
+        """初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 总大小上限（字节），0表示不缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # 哈希 -> 大小，按最近使用排序
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load(self):
+        """扫描已有的缓存，按修改时间恢复使用顺序"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                # 写入一半的临时目录
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not os.path.exists(os.path.join(path, META_FILE)):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((os.path.getmtime(path), name, self._dir_size(path)))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def _dir_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def get(self, key):
+        """查找缓存
+
+        Returns:
+            tuple: (结果目录, meta)，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+        path = os.path.join(self.cache_dir, key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+                    meta = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                # 缓存文件被外部删除或损坏
+                self._size -= self._entries.pop(key)
+                shutil.rmtree(path, ignore_errors=True)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return path, meta
+
+    def put(self, key, files, meta):
+        """保存渲染结果，文件被复制到缓存中
+
+        Args:
+            key: cache_key的结果
+            files: 要保存的输出文件路径列表
+            meta: 随结果保存的信息（可JSON序列化）
+
+        Returns:
+            str: 结果目录，不缓存时返回None
+        """
+        if not self.enabled:
+            return None
+        path = os.path.join(self.cache_dir, key)
+        # 先写入临时目录再改名，其他请求不会读到写了一半的结果
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            for file in files:
+                shutil.copyfile(file, os.path.join(tmp_path, os.path.basename(file)))
+            with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(dict(meta, created_at=time.time()), f, ensure_ascii=False)
+            size = self._dir_size(tmp_path)
+            if size > self.max_bytes:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return None
+            with self._lock:
+                if key in self._entries:
+                    # 相同的代码同时渲染了两次，保留先完成的
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    return path
+                try:
+                    os.replace(tmp_path, path)
+                except OSError:
+                    if not os.path.exists(os.path.join(path, META_FILE)):
+                        raise
+                    # 共用缓存目录的其他进程已经保存了相同的结果，直接使用
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    size = self._dir_size(path)
+                self._entries[key] = size
+                self._size += size
+                self._evict()
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return path
+
+    def _evict(self):
+        """删除最久未使用的结果直到不超过上限，调用方需持有锁（或在初始化中）"""
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for key in self._entries:
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """命中统计和占用空间"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "evictions": self.evictions,
+            }
+
+
+# 全局缓存
+render_cache = RenderCache()
@@ -0,0 +1,179 @@
+import os
+import uuid
+import asyncio
+
+from warm_pool import WarmPool
+
+# 同时运行的manim进程数量，默认为CPU核心数
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 0)) or os.cpu_count() or 1
+# 排队等待的渲染数量上限，超过时直接拒绝新的请求
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", 32))
+# 单个渲染的超时时间（秒）
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 600))
+# 是否使用预热的manim工作进程（不可用时自动改为启动manim命令）
+WARM_WORKERS = os.environ.get("WARM_WORKERS", "1") == "1"
+
+
+class RenderError(Exception):
+    """渲染没有完成（排队已满、超时或被取消）"""
+
+
+class QueueFull(RenderError):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+class RenderCancelled(RenderError):
+    pass
+
+
+class RenderJob:
+    """一个渲染任务"""
+
+    def __init__(self, job_id, cmd):
+        self.job_id = job_id
+        self.cmd = cmd
+        self.status = "queued"  # queued, running
+        self.task = None
+        self.proc = None
+        self.cancel_requested = False
+        self.created_at = asyncio.get_running_loop().time()
+
+    def to_dict(self):
+        return {"job_id": self.job_id, "status": self.status,
+                "elapsed": round(asyncio.get_running_loop().time() - self.created_at, 1)}
+
+
+class RenderPool:
+    """渲染进程池
+
+    每个渲染是一个 asyncio.create_subprocess_exec 启动的子进程，不会阻塞事件循环；
+    同时运行的进程数量不超过max_workers，其余的排队，排队数量超过queue_size时拒绝新的请求。
+    """
+
+    def __init__(self, max_workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE, timeout=RENDER_TIMEOUT,
+                 warm=WARM_WORKERS):
+        """初始化进程池
+
+        Args:
+            max_workers: 同时运行的进程数量
+            queue_size: 排队等待的数量上限
+            timeout: 默认的单个渲染超时时间（秒）
+            warm: 是否使用预热的manim工作进程
+        """
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.warm_pool = WarmPool(max_workers) if warm else None
+        self.jobs = {}  # job_id -> RenderJob
+        self._semaphore = None
+        self._waiting = 0
+        self._running = 0
+
+    async def run(self, cmd, cwd=None, job_id=None, timeout=None, warm=False):
+        """排队并运行命令
+
+        Args:
+            cmd: 命令及参数
+            cwd: 工作目录
+            job_id: 任务ID，用于取消，默认自动生成
+            timeout: 超时时间（秒），默认使用进程池的设置
+            warm: cmd是manim命令，可以交给预热的工作进程执行
+
+        Returns:
+            tuple: (退出码, stdout, stderr)，排队已满、超时或被取消时抛出RenderError
+        """
+        if self._semaphore is None:
+            # 在事件循环中创建，兼容旧版本Python
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        if self._waiting >= self.queue_size:
+            raise QueueFull(f"渲染队列已满（{self.queue_size}个任务在排队），请稍后重试")
+
+        job_id = job_id or uuid.uuid4().hex
+        if job_id in self.jobs:
+            raise RenderError(f"任务ID重复: {job_id}")
+        job = RenderJob(job_id, cmd)
+        job.task = asyncio.current_task()
+        self.jobs[job_id] = job
+        try:
+            self._waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+            try:
+                self._running += 1
+                job.status = "running"
+                return await self._execute(job, cwd, timeout or self.timeout, warm)
+            finally:
+                self._running -= 1
+                self._semaphore.release()
+        except asyncio.CancelledError:
+            if not job.cancel_requested:
+                raise
+            # 通过cancel()取消的任务作为普通错误返回给请求方
+            task = asyncio.current_task()
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            raise RenderCancelled("渲染已取消") from None
+        finally:
+            self.jobs.pop(job_id, None)
+
+    async def _execute(self, job, cwd, timeout, warm=False):
+        if warm and self.warm_pool is not None and self.warm_pool.enabled:
+            try:
+                result = await asyncio.wait_for(self.warm_pool.execute(job.cmd[1:], cwd, job), timeout)
+            except asyncio.TimeoutError:
+                raise RenderTimeout(f"渲染超时（{timeout:g}秒）") from None
+            if result is not None:
+                return result
+        # stdin是MCP的消息通道，不能让子进程继承（manim在有多个场景时会等待输入）
+        proc = await asyncio.create_subprocess_exec(*job.cmd, cwd=cwd, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        job.proc = proc
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await self._kill(proc)
+            raise RenderTimeout(f"渲染超时（{timeout:g}秒）") from None
+        except BaseException:
+            # 请求被取消时结束进程，不留下孤儿进程
+            await self._kill(proc)
+            raise
+        return proc.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+    @staticmethod
+    async def _kill(proc):
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    def cancel(self, job_id):
+        """取消排队中或正在运行的渲染，返回是否找到该任务"""
+        job = self.jobs.get(job_id)
+        if job is None or job.task is None:
+            return False
+        job.cancel_requested = True
+        job.task.cancel()
+        return True
+
+    def stats(self):
+        """进程池状态"""
+        return {
+            "max_workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "running": self._running,
+            "queued": self._waiting,
+            "jobs": [job.to_dict() for job in self.jobs.values()],
+            "warm": self.warm_pool.stats() if self.warm_pool is not None else None,
+        }
+
+
+# 全局进程池
+render_pool = RenderPool()
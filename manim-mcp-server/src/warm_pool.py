@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import asyncio
+
+# 运行预热工作进程的Python，需要能导入manim
+WARM_WORKER_PYTHON = os.environ.get("WARM_WORKER_PYTHON", sys.executable)
+# 每个工作进程执行多少个任务后重启
+WARM_WORKER_MAX_JOBS = int(os.environ.get("WARM_WORKER_MAX_JOBS", 20))
+# 工作进程内存超过该值（MB）时重启
+WARM_WORKER_MAX_RSS = int(os.environ.get("WARM_WORKER_MAX_RSS", 1024))
+# 等待工作进程导入manim的最长时间（秒）
+WARM_WORKER_START_TIMEOUT = float(os.environ.get("WARM_WORKER_START_TIMEOUT", 120))
+# 替换工作进程失败后的重试间隔（秒），每次失败后加倍，不超过WARM_WORKER_RETRY_MAX
+WARM_WORKER_RETRY_DELAY = float(os.environ.get("WARM_WORKER_RETRY_DELAY", 1))
+WARM_WORKER_RETRY_MAX = float(os.environ.get("WARM_WORKER_RETRY_MAX", 60))
+# 工作进程返回的stdout/stderr各自保留的最大字符数（只保留末尾），由manim_worker读取
+WARM_WORKER_LOG_LIMIT = int(os.environ.get("WARM_WORKER_LOG_LIMIT", 1024 * 1024))
+# 读取工作进程一行回复的缓冲上限（字节），JSON转义后的日志最多是原来的数倍
+WARM_WORKER_LINE_LIMIT = 8 * WARM_WORKER_LOG_LIMIT + 64 * 1024
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manim_worker.py")
+
+
+class WorkerStartError(Exception):
+    pass
+
+
+class WarmWorker:
+    """一个已经导入manim的工作进程"""
+
+    def __init__(self, proc, version):
+        self.proc = proc
+        self.version = version
+        self.jobs = 0
+        self.alive = True
+
+    @classmethod
+    async def spawn(cls, python=WARM_WORKER_PYTHON, timeout=WARM_WORKER_START_TIMEOUT):
+        """启动工作进程并等待导入完成，失败时抛出WorkerStartError"""
+        # 每个回复是一行JSON，包含渲染日志，超过默认的64KB时readline会失败
+        proc = await asyncio.create_subprocess_exec(
+            python, WORKER_SCRIPT, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, limit=WARM_WORKER_LINE_LIMIT,
+            env=dict(os.environ, WARM_WORKER_LOG_LIMIT=str(WARM_WORKER_LOG_LIMIT))
+        )
+        try:
+            line = await asyncio.wait_for(proc.stdout.readline(), timeout)
+            message = json.loads(line) if line else {"error": "工作进程启动后退出"}
+        except (asyncio.TimeoutError, ValueError) as e:
+            message = {"error": f"工作进程没有正常启动: {e or '超时'}"}
+        except BaseException:
+            await cls._kill(proc)
+            raise
+        if not message.get("ready"):
+            await cls._kill(proc)
+            raise WorkerStartError(message.get("error", "未知错误"))
+        return cls(proc, message.get("version"))
+
+    @staticmethod
+    async def _kill(proc):
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def render(self, args, cwd):
+        """执行渲染
+
+        Returns:
+            dict: returncode, stdout, stderr, rss
+        """
+        self.jobs += 1
+        self.proc.stdin.write((json.dumps({"args": args, "cwd": cwd}) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+        try:
+            line = await self.proc.stdout.readline()
+        except ValueError:
+            # 回复超过了缓冲上限，进程的输出已无法对齐，只能替换
+            self.alive = False
+            await self._kill(self.proc)
+            return {"returncode": -1, "stdout": "", "stderr": "渲染进程的回复过大，无法读取", "rss": 0}
+        if not line:
+            # 场景代码导致进程崩溃（如段错误或调用了os._exit）
+            self.alive = False
+            returncode = await self.proc.wait()
+            return {"returncode": returncode or -1, "stdout": "",
+                    "stderr": f"渲染进程意外退出（退出码 {returncode}）", "rss": 0}
+        return json.loads(line)
+
+    async def close(self):
+        self.alive = False
+        await self._kill(self.proc)
+
+
+class WarmPool:
+    """预热的manim工作进程池
+
+    每个工作进程启动时导入manim，之后在进程内执行渲染，省去每次启动Python和导入manim（numpy、cairo等）的时间。
+    场景代码可能修改全局状态或泄漏内存，工作进程执行max_jobs个任务或内存超过max_rss后会被替换。
+    工作进程无法启动（如当前Python没有安装manim）时不再使用进程池，由调用方改为启动manim命令；
+    还有其他工作进程时，替换失败的进程按间隔重试，进程池不会悄悄变小。
+    """
+
+    def __init__(self, size, python=WARM_WORKER_PYTHON, max_jobs=WARM_WORKER_MAX_JOBS,
+                 max_rss=WARM_WORKER_MAX_RSS):
+        """初始化进程池
+
+        Args:
+            size: 工作进程数量，与渲染并发数相同
+            python: 运行工作进程的Python
+            max_jobs: 每个工作进程执行的任务数上限
+            max_rss: 工作进程的内存上限（MB）
+        """
+        self.size = size
+        self.python = python
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss * 1024 * 1024
+        self.disabled_reason = None
+        self.version = None  # 工作进程中导入的manim版本
+        self.started = 0
+        self.recycled = 0
+        self.spawn_failures = 0
+        self._idle = None
+        self._ready = None  # 第一个工作进程启动或进程池停用时设置
+        self._alive = 0
+        self._spawning = 0
+        self._background = set()
+
+    @property
+    def enabled(self):
+        return self.disabled_reason is None
+
+    def _start(self):
+        """第一次使用时在后台启动所有工作进程，请求被取消也不影响启动"""
+        self._idle = asyncio.Queue()
+        self._ready = asyncio.Event()
+        for _ in range(self.size):
+            self._in_background(self._replenish())
+
+    async def _spawn(self):
+        worker = await WarmWorker.spawn(self.python)
+        self.started += 1
+        self._alive += 1
+        if self.version is None:
+            self.version = worker.version
+        self._ready.set()
+        return worker
+
+    def _in_background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _replenish(self, old=None):
+        """关闭旧的工作进程（如果有）并启动一个新的"""
+        if old is not None:
+            self._alive -= 1
+            await old.close()
+        delay = WARM_WORKER_RETRY_DELAY
+        while self.enabled:
+            self._spawning += 1
+            try:
+                worker = await self._spawn()
+            except (WorkerStartError, OSError) as e:
+                error = e
+            else:
+                self._idle.put_nowait(worker)
+                return
+            finally:
+                self._spawning -= 1
+            self.spawn_failures += 1
+            if self._alive == 0 and self._spawning == 0:
+                # 没有可用的工作进程，也没有其他正在启动的
+                self._disable(str(error))
+                return
+            print(f"预热的manim工作进程启动失败，{delay:g}秒后重试: {error}", file=sys.stderr)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_WORKER_RETRY_MAX)
+
+    def _disable(self, reason):
+        if not self.enabled:
+            return
+        self.disabled_reason = reason
+        print(f"预热的manim工作进程不可用，改为每次启动manim命令: {reason}", file=sys.stderr)
+        self._ready.set()
+        # 唤醒正在等待工作进程的请求
+        for _ in range(self.size):
+            self._idle.put_nowait(None)
+
+    async def wait_version(self):
+        """等待第一个工作进程启动，返回其中导入的manim版本，进程池不可用时返回None"""
+        if not self.enabled:
+            return None
+        if self._idle is None:
+            self._start()
+        await self._ready.wait()
+        return self.version if self.enabled else None
+
+    async def execute(self, args, cwd, job=None):
+        """在工作进程中渲染
+
+        Args:
+            args: manim命令行参数（不含 manim 本身）
+            cwd: 工作目录
+            job: RenderJob，记录使用的进程以便查看状态
+
+        Returns:
+            tuple: (退出码, stdout, stderr)，进程池不可用时返回None
+        """
+        if not self.enabled:
+            return None
+        if self._idle is None:
+            self._start()
+        worker = await self._idle.get()
+        if worker is None:
+            self._idle.put_nowait(None)
+            return None
+        if job is not None:
+            job.proc = worker.proc
+        try:
+            result = await worker.render(args, cwd)
+        except BaseException:
+            # 超时或被取消时无法中断进程内的渲染，直接替换工作进程
+            self._in_background(self._replenish(worker))
+            raise
+        if not worker.alive or worker.jobs >= self.max_jobs or result.get("rss", 0) > self.max_rss:
+            self.recycled += 1
+            self._in_background(self._replenish(worker))
+        else:
+            self._idle.put_nowait(worker)
+        return result["returncode"], result["stdout"], result["stderr"]
+
+    def stats(self):
+        """进程池状态"""
+        return {
+            "enabled": self.enabled,
+            "disabled_reason": self.disabled_reason,
+            "version": self.version,
+            "size": self.size,
+            "alive": self._alive,
+            "idle": self._idle.qsize() if self._idle is not None and self.enabled else 0,
+            "started": self.started,
+            "recycled": self.recycled,
+            "spawn_failures": self.spawn_failures,
+        }
@@ -1,234 +1,48 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, abort
+from werkzeug.security import safe_join
+from urllib.parse import quote
 import os
-import yt_dlp
-import uuid
-import threading
+import json
 import time
-import subprocess
-import re
-import sys
-import importlib.util
+import mimetypes
+
+from service import DownloadService
+from task_store import FINISHED_STATES
+from bandwidth import limiter, parse_rate
+from metrics import registry
+from postprocess import parse_steps
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 
-# 存储下载任务状态
-download_tasks = {}
-# 下载目录
+# SSE连接的心跳间隔（秒）
+EVENTS_KEEPALIVE = 15
+# 文件列表默认每页数量
+DOWNLOADS_PAGE_SIZE = 100
+# 媒体文件的发送方式:
+#   空       由Python发送：完整文件交给wsgi.file_wrapper（gunicorn会使用sendfile），
+#            Range请求的206响应由werkzeug在Python中分块读取，拖动进度较多时建议使用sendfile或accel
+#   sendfile 返回X-Sendfile头，由Apache/lighttpd发送文件
+#   accel    返回X-Accel-Redirect头，由nginx发送文件，需配置MEDIA_ACCEL_PREFIX对应的internal location
+MEDIA_OFFLOAD = os.environ.get("MEDIA_OFFLOAD", "")
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-downloads/")
+# 媒体文件的浏览器缓存时间（秒），配合ETag做条件请求
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", 3600))
+app.config['USE_X_SENDFILE'] = MEDIA_OFFLOAD == "sendfile"
+# 管理接口的访问令牌（请求头 X-Admin-Token），为空时只允许本机访问
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# 下载目录（压测时指向临时目录）
 # DOWNLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "downloads")
-DOWNLOAD_DIR = r"F:\下载的视频"
+DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", r"F:\下载的视频")
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
-class DownloadTask:
-    def __init__(self, url, format_id=None):
-        self.task_id = str(uuid.uuid4())
-        self.url = url
-        self.format_id = format_id
-        self.progress = 0
-        self.status = "pending"  # pending, downloading, completed, error
-        self.filename = None
-        self.error_message = None
-        
-    def progress_hook(self, d):
-        """下载进度回调函数"""
-        if d['status'] == 'downloading':
-            p = d.get('_percent_str', 'unknown')
-            p = p.replace('%', '').strip()
-            try:
-                self.progress = float(p)
-                self.filename = d.get('filename', '').split('/')[-1]
-            except (ValueError, TypeError):
-                pass
-        elif d['status'] == 'finished':
-            self.progress = 100
-            self.status = "completed"
-            self.filename = d.get('filename', '').split('/')[-1]
-
-def install_package(package):
-    """安装Python包"""
-    try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-        return True
-    except Exception as e:
-        print(f"安装{package}失败: {str(e)}")
-        return False
-
-def download_video(task):
-    """下载视频的函数"""
-    task.status = "downloading"
-    
-    # 检查是否是爱奇艺、优酷或其他国内视频平台
-    chinese_video_sites = [
-        'iqiyi.com', 'youku.com', 'le.com', 'mgtv.com', 
-        'sohu.com', 'pptv.com', 'bilibili.com', '1905.com'
-    ]
-    
-    is_chinese_site = any(site in task.url for site in chinese_video_sites)
-    
-    # 尝试使用yt-dlp下载
-    try:
-        ydl_opts = {
-            'format': task.format_id if task.format_id else 'best',
-            'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
-            'progress_hooks': [task.progress_hook],
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([task.url])
-        
-        # 如果到这里没有报错，说明下载成功
-        return
-    except Exception as e:
-        # 如果是中国视频网站且yt-dlp失败，尝试使用备选方法
-        if is_chinese_site:
-            try:
-                task.error_message = f"yt-dlp失败，尝试备选方法: {str(e)}"
-                
-                # 安装you-get
-                if not install_package("you-get"):
-                    raise Exception("无法安装you-get包")
-                
-                task.progress = 20
-                
-                # 方法1: 尝试使用Python API方式调用you-get
-                try:
-                    # 动态导入you-get
-                    import you_get.common as you_get
-                    
-                    # 设置命令行参数
-                    sys.argv = ['you-get', '--output-dir', DOWNLOAD_DIR, task.url]
-                    
-                    # 记录原始sys.stdout
-                    original_stdout = sys.stdout
-                    original_stderr = sys.stderr
-                    
-                    try:
-                        # 重定向输出
-                        sys.stdout = open(os.devnull, 'w')
-                        sys.stderr = open(os.devnull, 'w')
-                        
-                        # 执行下载
-                        task.progress = 30
-                        you_get.main()
-                        task.progress = 100
-                        
-                        # 搜索下载目录获取最新文件
-                        files = os.listdir(DOWNLOAD_DIR)
-                        if files:
-                            files.sort(key=lambda x: os.path.getmtime(os.path.join(DOWNLOAD_DIR, x)), reverse=True)
-                            task.filename = files[0]
-                            task.status = "completed"
-                            return
-                        
-                    finally:
-                        # 恢复stdout和stderr
-                        sys.stdout = original_stdout
-                        sys.stderr = original_stderr
-                        
-                except (ImportError, Exception) as api_e:
-                    # 方法2: 尝试使用子进程方式
-                    task.progress = 40
-                    
-                    # 找到you-get可执行文件路径
-                    you_get_path = None
-                    for path in sys.path:
-                        possible_path = os.path.join(path, 'Scripts', 'you-get.exe')
-                        if os.path.exists(possible_path):
-                            you_get_path = possible_path
-                            break
-                    
-                    if not you_get_path:
-                        # 尝试使用sys.executable的父目录
-                        python_dir = os.path.dirname(sys.executable)
-                        possible_path = os.path.join(python_dir, 'Scripts', 'you-get.exe')
-                        if os.path.exists(possible_path):
-                            you_get_path = possible_path
-                    
-                    if you_get_path:
-                        # 使用找到的you-get路径
-                        cmd = [
-                            you_get_path, "--output-dir", DOWNLOAD_DIR, task.url
-                        ]
-                    else:
-                        # 使用python -m方式调用
-                        cmd = [
-                            sys.executable, "-m", "you_get", "--output-dir", DOWNLOAD_DIR, task.url
-                        ]
-                    
-                    task.error_message = f"尝试使用命令: {' '.join(cmd)}"
-                    task.progress = 50
-                    
-                    try:
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        
-                        if result.returncode == 0:
-                            # 下载成功，查找最近修改的文件
-                            task.progress = 100
-                            files = os.listdir(DOWNLOAD_DIR)
-                            if files:
-                                files.sort(key=lambda x: os.path.getmtime(os.path.join(DOWNLOAD_DIR, x)), reverse=True)
-                                task.filename = files[0]
-                                task.status = "completed"
-                                return
-                            else:
-                                raise Exception("下载似乎成功但找不到文件")
-                        else:
-                            raise Exception(f"命令失败: {result.stderr}")
-                    except Exception as cmd_e:
-                        raise Exception(f"命令执行失败: {str(cmd_e)}")
-                
-            except Exception as youget_e:
-                # 如果备选方法也失败，尝试直接ffmpeg录制爱奇艺视频
-                task.error_message = f"备选下载失败: {str(youget_e)}"
-                
-                # 告知用户使用录屏方法
-                task.status = "error"
-                task.error_message += "。请尝试使用浏览器录屏功能或OBS录制此视频。"
-                return
-        else:
-            # 不是中国视频网站，直接报错
-            task.status = "error"
-            task.error_message = str(e)
-            return
-
-def get_available_formats(url):
-    """获取视频可用的格式"""
-    # 检查是否是爱奇艺或其他中国视频网站
-    chinese_video_sites = [
-        'iqiyi.com', 'youku.com', 'le.com', 'mgtv.com', 
-        'sohu.com', 'pptv.com', 'bilibili.com', '1905.com'
-    ]
-    
-    is_chinese_site = any(site in url for site in chinese_video_sites)
-    
-    # 对于中国视频网站，提供简化选项
-    if is_chinese_site:
-        return [
-            {"format_id": "best", "description": "最佳质量 (自动)"},
-            {"format_id": "worst", "description": "最低质量 (更快)"}
-        ]
-    
-    # 对于其他网站使用原有的格式获取方法
-    ydl_opts = {
-        'listformats': True,
-        'quiet': True,
-    }
-    
-    formats = []
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if 'formats' in info:
-                for f in info['formats']:
-                    format_note = f.get('format_note', '')
-                    resolution = f.get('resolution', 'unknown')
-                    format_id = f.get('format_id', '')
-                    ext = f.get('ext', 'unknown')
-                    desc = f"{format_note} ({resolution}, {ext})"
-                    formats.append({"format_id": format_id, "description": desc})
-        return formats
-    except Exception as e:
-        return [{"format_id": "best", "description": "最佳质量 (自动)"}]
+# 下载服务（网页版和桌面版共用）
+service = DownloadService(DOWNLOAD_DIR)
 
 @app.route('/')
 def index():
@@ -242,7 +56,10 @@ def analyze():
     if not url:
         return jsonify({"error": "请输入视频URL"}), 400
     
-    formats = get_available_formats(url)
+    try:
+        formats = service.run(service.analyze(url))
+    except Exception:
+        formats = [{"format_id": "best", "description": "最佳质量 (自动)"}]
     return jsonify({"formats": formats})
 
 @app.route('/download', methods=['POST'])
@@ -254,45 +71,281 @@ def download():
     if not url:
         return jsonify({"error": "请输入视频URL"}), 400
     
-    # 创建下载任务
-    task = DownloadTask(url, format_id)
-    download_tasks[task.task_id] = task
+    try:
+        priority = int(request.json.get('priority', 0))
+        fragments = int(request.json.get('concurrent_fragments') or 0) or None
+    except (ValueError, TypeError):
+        return jsonify({"error": "priority和concurrent_fragments必须是整数"}), 400
+    try:
+        rate_limit = parse_rate(request.json.get('rate_limit'))
+        postprocess = parse_steps(request.json.get('postprocess'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # 创建下载任务，交给调度器排队执行
+    task = service.run(service.submit(url, format_id, priority, fragments=fragments, rate_limit=rate_limit,
+                                      postprocess=postprocess))
+    
+    return jsonify({"task_id": task.task_id, "status": task.status})
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """批量下载：接受多个链接（列表或按行分隔的文本），播放列表会被展开"""
+    urls = request.json.get('urls', [])
+    if isinstance(urls, str):
+        urls = urls.splitlines()
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    format_id = request.json.get('format_id')
+    expand_playlists = bool(request.json.get('expand_playlists', True))
+    
+    if not urls:
+        return jsonify({"error": "请输入视频URL"}), 400
+    
+    try:
+        priority = int(request.json.get('priority', 0))
+        fragments = int(request.json.get('concurrent_fragments') or 0) or None
+    except (ValueError, TypeError):
+        return jsonify({"error": "priority和concurrent_fragments必须是整数"}), 400
+    try:
+        rate_limit = parse_rate(request.json.get('rate_limit'))
+        postprocess = parse_steps(request.json.get('postprocess'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    job = service.run(service.submit_batch(
+        urls, format_id, priority, fragments=fragments, expand_playlists=expand_playlists,
+        rate_limit=rate_limit, postprocess=postprocess
+    ))
+    
+    return jsonify({
+        "job_id": job.job_id,
+        "task_ids": [task.task_id for task in job.tasks]
+    })
+
+@app.route('/batch/<job_id>', methods=['GET'])
+def batch_status(job_id):
+    """获取批量任务的汇总进度"""
+    job = service.get_job(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    
+    return jsonify(job.to_status())
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel(task_id):
+    """取消下载任务，已下载的部分会保留以便恢复"""
+    task = service.get_task(task_id)
+    if not task:
+        return jsonify({"error": "任务不存在"}), 404
     
-    # 在后台线程中开始下载
-    thread = threading.Thread(target=download_video, args=(task,))
-    thread.daemon = True
-    thread.start()
+    if not service.run(service.cancel(task_id)):
+        return jsonify({"error": "任务已结束，无法取消"}), 409
     
-    return jsonify({"task_id": task.task_id})
+    return jsonify(task.to_status())
+
+@app.route('/resume/<task_id>', methods=['POST'])
+def resume(task_id):
+    """恢复已取消、失败或被中断的任务，从断点继续下载"""
+    if not service.get_task(task_id):
+        return jsonify({"error": "任务不存在"}), 404
+    
+    task = service.run(service.resume(task_id))
+    if task is None:
+        return jsonify({"error": "任务当前状态无法恢复"}), 409
+    
+    return jsonify(task.to_status())
 
 @app.route('/status/<task_id>', methods=['GET'])
 def status(task_id):
     """获取下载任务状态"""
-    task = download_tasks.get(task_id)
+    task = service.get_task(task_id)
     if not task:
         return jsonify({"error": "任务不存在"}), 404
     
-    return jsonify({
-        "task_id": task.task_id,
-        "status": task.status,
-        "progress": task.progress,
-        "filename": task.filename,
-        "error_message": task.error_message
+    # 单个任务的查询附带阶段时间线，推送的进度中不包含
+    return jsonify(dict(task.to_status(), phases=task.phases))
+
+def parse_task_ids(value):
+    """解析逗号分隔的任务ID列表，为空时返回None（订阅全部任务）"""
+    task_ids = [t.strip() for t in (value or '').split(',') if t.strip()]
+    return task_ids or None
+
+def format_sse(state):
+    """格式化为一条SSE消息"""
+    return f"event: progress\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+
+@app.route('/events', methods=['GET'])
+def events():
+    """以SSE推送任务进度，一个连接可通过task_ids参数同时关注多个任务"""
+    task_ids = parse_task_ids(request.args.get('task_ids'))
+    
+    def stream():
+        sub = service.broker.subscribe(task_ids)
+        try:
+            # 先发送当前状态，避免订阅前的更新丢失
+            for task_id in task_ids or []:
+                task = service.get_task(task_id)
+                if task:
+                    yield format_sse(task.to_status())
+            
+            last_sent = time.time()
+            # 服务退出时结束长连接，客户端会自动重连到其他工作进程
+            while not service.draining:
+                updates = service.broker.listen(sub, EVENTS_KEEPALIVE)
+                if updates:
+                    for _, state in updates:
+                        yield format_sse(state)
+                    last_sent = time.time()
+                elif time.time() - last_sent >= EVENTS_KEEPALIVE:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.time()
+        finally:
+            service.broker.unsubscribe(sub)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
 
+if Sock is not None:
+    sock = Sock(app)
+    
+    @sock.route('/ws')
+    def ws_events(ws):
+        """WebSocket进度推送
+
+        客户端发送 {"subscribe": [...]} 或 {"unsubscribe": [...]} 调整关注的任务
+        """
+        sub = service.broker.subscribe(set())
+        try:
+            while not service.draining:
+                message = ws.receive(timeout=0)
+                if message:
+                    try:
+                        data = json.loads(message)
+                    except ValueError:
+                        continue
+                    added = data.get('subscribe') or []
+                    sub.add(added)
+                    sub.remove(data.get('unsubscribe') or [])
+                    for task_id in added:
+                        task = service.get_task(task_id)
+                        if task:
+                            ws.send(json.dumps(task.to_status(), ensure_ascii=False))
+                for _, state in service.broker.listen(sub, 0.25):
+                    ws.send(json.dumps(state, ensure_ascii=False))
+        finally:
+            service.broker.unsubscribe(sub)
+
+def is_admin():
+    """是否允许访问管理接口"""
+    if ADMIN_TOKEN:
+        # Prometheus等采集工具只能发送Authorization头
+        return ADMIN_TOKEN in (request.headers.get('X-Admin-Token'),
+                               request.headers.get('Authorization', '').replace('Bearer ', '', 1))
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的运行指标（多进程部署时为当前工作进程的指标）"""
+    if not is_admin():
+        return jsonify({"error": "无权访问"}), 403
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/bandwidth', methods=['GET', 'POST'])
+def admin_bandwidth():
+    """查看或修改带宽限制，修改立即生效（其他工作进程在一秒内生效）
+
+    POST参数: limit（全局上限）、hosts（域名 -> 上限）、schedule（时段配置）、
+    tasks（task_id -> 上限，0表示取消限制），带宽可以写成 "2M"、"512K" 或字节数
+    """
+    if not is_admin():
+        return jsonify({"error": "无权访问"}), 403
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            limiter.configure(
+                limit=data.get('limit'), hosts=data.get('hosts'),
+                schedule=data.get('schedule'), tasks=data.get('tasks')
+            )
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return jsonify({"error": f"无效的配置: {str(e)}"}), 400
+        # 顺带清除已结束任务的配置
+        finished = []
+        for task_id in list(limiter.config["tasks"]):
+            task = service.get_task(task_id)
+            if task is None or task.status in FINISHED_STATES:
+                finished.append(task_id)
+        limiter.remove_tasks(finished)
+    
+    return jsonify(limiter.status())
+
 @app.route('/downloads/<filename>', methods=['GET'])
 def download_file(filename):
-    """下载已完成的文件"""
-    return send_from_directory(DOWNLOAD_DIR, filename, as_attachment=True)
+    """下载或在线播放已完成的文件
+
+    支持Range请求（206）、ETag/If-None-Match/If-Range条件请求，
+    带 ?inline=1 参数时以inline方式返回，可以直接在浏览器中播放和拖动进度。
+    """
+    inline = request.args.get('inline') in ('1', 'true')
+    if MEDIA_OFFLOAD == "accel":
+        return accel_redirect(filename, inline)
+    # send_from_directory的conditional模式处理Range和条件请求；完整文件交给WSGI服务器的file_wrapper
+    # （支持时以sendfile发送），206响应则由werkzeug的_RangeWrapper在Python中读取，不是零拷贝
+    return send_from_directory(
+        DOWNLOAD_DIR, filename, as_attachment=not inline,
+        conditional=True, etag=True, max_age=MEDIA_MAX_AGE
+    )
+
+def accel_redirect(filename, inline):
+    """返回X-Accel-Redirect响应，由nginx发送文件（Range、ETag也由nginx处理）"""
+    path = safe_join(DOWNLOAD_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    disposition = "inline" if inline else "attachment"
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return Response(mimetype=mimetype, headers={
+        'X-Accel-Redirect': MEDIA_ACCEL_PREFIX + quote(filename),
+        'Content-Disposition': f"{disposition}; filename*=UTF-8''{quote(filename)}",
+    })
 
 @app.route('/downloads', methods=['GET'])
 def list_downloads():
-    """列出所有已下载的文件"""
-    files = []
-    for file in os.listdir(DOWNLOAD_DIR):
-        if os.path.isfile(os.path.join(DOWNLOAD_DIR, file)):
-            files.append(file)
-    return jsonify({"files": files})
+    """分页列出已下载的文件
+
+    参数: sort (mtime/size/name)、order (asc/desc)、prefix、ext (逗号分隔)、
+    cursor (上一页返回的next_cursor)、limit (0表示不分页)
+    """
+    sort = request.args.get('sort', 'mtime')
+    descending = request.args.get('order', 'desc' if sort != 'name' else 'asc') != 'asc'
+    exts = {ext.strip().lstrip('.').lower() for ext in request.args.get('ext', '').split(',') if ext.strip()}
+    try:
+        limit = int(request.args.get('limit', DOWNLOADS_PAGE_SIZE))
+        # 使用维护的文件索引，不必扫描目录或读取文件
+        options = dict(sort=sort, descending=descending, prefix=request.args.get('prefix'),
+                       exts=exts, cursor=request.args.get('cursor'))
+        if limit > 0:
+            files, next_cursor = service.library.query(limit=limit, **options)
+            batches = [files]
+        else:
+            # 不分页时按排序好的快照逐批输出，不拼出完整的响应
+            batches, next_cursor = service.library.scan(**options), None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def stream():
+        # 每批输出一次，大列表不需要先拼出完整的响应
+        yield '{"files": ['
+        first = True
+        for batch in batches:
+            if batch:
+                yield ('' if first else ',') + ','.join(json.dumps(entry, ensure_ascii=False) for entry in batch)
+                first = False
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+    
+    return Response(stream(), mimetype='application/json')
 
 if __name__ == "__main__":
+    # 开发服务器，生产环境请使用 python serve.py
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,231 @@
+import os
+import re
+import sys
+import shutil
+import threading
+import subprocess
+import importlib.util
+from collections import deque
+from urllib.parse import urlparse, unquote
+
+from yt_dlp.utils import DownloadCancelled
+
+from info_cache import cached_info
+from ydl_pool import ydl_pool
+
+# 同时运行的you-get子进程数量
+YOU_GET_WORKERS = int(os.environ.get("YOU_GET_WORKERS", 2))
+# 直接下载的媒体文件扩展名
+DIRECT_MEDIA_EXTS = ('.mp4', '.webm', '.mkv', '.flv', '.mov', '.m4a', '.mp3', '.aac', '.ts')
+# HTTP下载的读块大小
+HTTP_CHUNK_SIZE = 256 * 1024
+# 每个站点保留的keep-alive连接数量
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+
+# 国内视频平台，yt-dlp失败时使用you-get作为备选
+CHINESE_VIDEO_SITES = [
+    'iqiyi.com', 'youku.com', 'le.com', 'mgtv.com',
+    'sohu.com', 'pptv.com', 'bilibili.com', '1905.com'
+]
+
+
+def is_chinese_site(url):
+    """是否是爱奇艺、优酷或其他国内视频平台"""
+    return any(site in url for site in CHINESE_VIDEO_SITES)
+
+
+def report_progress(task, d):
+    """以yt-dlp进度回调的格式通知任务及其附加回调"""
+    for hook in [task.progress_hook] + task.hooks:
+        hook(d)
+
+
+class Backend:
+    """下载后端基类"""
+
+    name = ""
+
+    def available(self):
+        """后端依赖是否已安装"""
+        return True
+
+    def supports(self, url):
+        """是否处理该链接"""
+        return True
+
+    def download(self, task):
+        """下载到task.staging_dir，失败时抛出异常，取消时抛出DownloadCancelled"""
+        raise NotImplementedError
+
+
+class YtDlpBackend(Backend):
+    """yt-dlp后端（进程内执行，使用进度回调）"""
+
+    name = "yt-dlp"
+
+    def download(self, task):
+        ydl_opts = {
+            'format': task.format_id if task.format_id else 'best',
+            'outtmpl': '%(title)s.%(ext)s',
+            'paths': {'home': task.staging_dir},
+            'progress_hooks': [task.progress_hook] + task.hooks,
+            'post_hooks': [task.post_hook],
+            'concurrent_fragment_downloads': task.fragments,
+            # 已有的.part文件通过HTTP Range请求续传
+            'continuedl': True,
+        }
+
+        # 优先复用分析阶段缓存的视频信息，避免重复提取
+        info = cached_info(task.url)
+        # 相同格式的下载复用同一组YoutubeDL实例，保存路径和回调每次单独设置
+        with ydl_pool.acquire(ydl_opts) as ydl:
+            if info is not None:
+                ydl.process_ie_result(info, download=True)
+            else:
+                ydl.download([task.url])
+
+
+class YouGetBackend(Backend):
+    """you-get后端
+
+    在独立的子进程中运行，不修改本进程的sys.argv/sys.stdout，
+    并从子进程输出中实时解析进度和文件名。
+    """
+
+    name = "you-get"
+
+    PROGRESS_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+    FILENAME_RE = re.compile(r'(?:Downloading|Skipping) (.+?)(?: \.\.\.|: file already exists)')
+
+    def __init__(self, max_workers=YOU_GET_WORKERS):
+        self._slots = threading.BoundedSemaphore(max_workers)
+        # 启动时解析一次命令，避免每次下载都查找
+        executable = shutil.which("you-get")
+        if executable:
+            self.command = [executable]
+        elif importlib.util.find_spec("you_get") is not None:
+            self.command = [sys.executable, "-m", "you_get"]
+        else:
+            self.command = None
+
+    def available(self):
+        return self.command is not None
+
+    def supports(self, url):
+        return is_chinese_site(url)
+
+    def download(self, task):
+        cmd = self.command + ["--output-dir", task.staging_dir, task.url]
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+
+        with self._slots:
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, encoding="utf-8", errors="replace", env=env
+            )
+            tail = deque(maxlen=20)
+            filename = None
+            try:
+                # 文本模式下 \r 也会被当作换行，进度条的每次刷新都是一行
+                for line in proc.stdout:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    tail.append(line)
+
+                    match = self.FILENAME_RE.search(line)
+                    if match:
+                        filename = match.group(1)
+                    match = self.PROGRESS_RE.search(line)
+                    if match:
+                        report_progress(task, {
+                            'status': 'downloading',
+                            '_percent_str': match.group(0),
+                            'filename': filename or '',
+                        })
+                    elif task.cancel_requested:
+                        raise DownloadCancelled("任务已取消")
+                returncode = proc.wait()
+            except BaseException:
+                proc.kill()
+                proc.wait()
+                raise
+
+        if returncode != 0:
+            raise Exception(f"命令失败: {' '.join(tail)}")
+        # 暂存目录只属于这个任务，输出中没有文件名时由发布步骤选择其中的文件
+        if filename:
+            task.filepath = os.path.join(task.staging_dir, filename)
+            task.filename = filename
+        task.progress = 100
+
+
+class HttpBackend(Backend):
+    """直接下载媒体文件链接，支持断点续传"""
+
+    name = "http"
+
+    def __init__(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        # 所有下载线程共用一个会话，同一站点的请求复用keep-alive连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def supports(self, url):
+        path = urlparse(url).path.lower()
+        return path.endswith(DIRECT_MEDIA_EXTS)
+
+    def download(self, task):
+        filename = unquote(os.path.basename(urlparse(task.url).path))
+        filepath = os.path.join(task.staging_dir, filename)
+        part_path = filepath + ".part"
+        task.partial_file = part_path
+
+        downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={downloaded}-"} if downloaded else {}
+
+        with self.session.get(task.url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 416:
+                # 临时文件已经完整
+                response.close()
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    downloaded = 0
+                length = int(response.headers.get("Content-Length", 0))
+                total = length + downloaded if length else None
+                with open(part_path, "ab" if downloaded else "wb") as f:
+                    for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        report_progress(task, {
+                            'status': 'downloading',
+                            'downloaded_bytes': downloaded,
+                            'total_bytes': total,
+                            '_percent_str': f"{downloaded * 100 / total:.1f}%" if total else '',
+                            'filename': filepath,
+                            'tmpfilename': part_path,
+                        })
+
+        os.replace(part_path, filepath)
+        report_progress(task, {'status': 'finished', 'filename': filepath})
+        task.post_hook(filepath)
+
+
+def load_backends():
+    """启动时解析一次可用的下载后端，按尝试顺序返回"""
+    backends = []
+    for backend_cls in (HttpBackend, YtDlpBackend, YouGetBackend):
+        try:
+            backend = backend_cls()
+        except ImportError as e:
+            print(f"下载后端 {backend_cls.name} 不可用: {str(e)}")
+            continue
+        if backend.available():
+            backends.append(backend)
+        else:
+            print(f"下载后端 {backend.name} 未安装，已跳过")
+    return backends
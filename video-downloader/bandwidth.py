@@ -0,0 +1,332 @@
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+# 全局带宽上限（字节/秒），0表示不限制，支持K/M/G后缀，如 "10M"
+BANDWIDTH_LIMIT = os.environ.get("BANDWIDTH_LIMIT", "0")
+# 按站点限制带宽，格式: "bilibili.com=2M,youtube.com=5M"
+BANDWIDTH_HOST_LIMITS = os.environ.get("BANDWIDTH_HOST_LIMITS", "")
+# 按时段调整全局上限，格式: "09:00-18:00=2M,23:00-07:00=0"，未匹配的时段使用BANDWIDTH_LIMIT
+BANDWIDTH_SCHEDULE = os.environ.get("BANDWIDTH_SCHEDULE", "")
+# 运行时修改的限速配置，多个工作进程共用同一个文件
+BANDWIDTH_CONFIG_PATH = os.environ.get(
+    "BANDWIDTH_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bandwidth.json")
+)
+# 全局上限由几个进程平分（serve.py按工作进程数量设置）
+BANDWIDTH_SHARE = int(os.environ.get("BANDWIDTH_SHARE", 1))
+# 超过该时间（秒）没有数据的任务不再参与带宽分配
+IDLE_AFTER = 5
+# 检查配置文件是否被其他进程修改的间隔（秒）
+RELOAD_INTERVAL = 1
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?(?:/S)?$')
+TIME_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
+def parse_rate(value):
+    """解析带宽，如 "2M"、"512K"、1048576
+
+    Returns:
+        int: 字节/秒，0表示不限制
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value < 0:
+            raise ValueError(f"无效的带宽: {value}")
+        return int(value)
+    match = RATE_RE.match(str(value).strip().upper())
+    if not match:
+        raise ValueError(f"无效的带宽: {value}")
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+def parse_host_limits(spec):
+    """解析站点带宽配置，返回 域名 -> 字节/秒"""
+    limits = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item or "=" not in item:
+            continue
+        host, rate = item.split("=", 1)
+        limits[host.strip().lower()] = parse_rate(rate)
+    return limits
+
+
+def parse_schedule(spec):
+    """解析时段配置，返回 [{"start": "09:00", "end": "18:00", "limit": 字节/秒}]"""
+    schedule = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            period, rate = item.split("=", 1)
+            start, end = period.split("-", 1)
+        except ValueError:
+            raise ValueError(f"无效的时段配置: {item}")
+        item = {"start": start.strip(), "end": end.strip(), "limit": parse_rate(rate)}
+        # 时间在加载配置时检查，不能等到下载时限速才出错
+        _minutes(item["start"])
+        _minutes(item["end"])
+        schedule.append(item)
+    return schedule
+
+
+def _minutes(text):
+    """把 "HH:MM" 转换为当天的分钟数（00:00 到 24:00），格式无效时抛出ValueError"""
+    match = TIME_RE.match(text) if isinstance(text, str) else None
+    if not match:
+        raise ValueError(f"无效的时间: {text}")
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    value = hours * 60 + minutes
+    if minutes >= 60 or value > 24 * 60:
+        raise ValueError(f"无效的时间: {text}")
+    return value
+
+
+def match_host(url, domains):
+    """返回链接所属的域名（包括子域名），没有匹配时返回None"""
+    host = (urlparse(url).hostname or "").lower()
+    for domain in domains:
+        if host == domain or host.endswith("." + domain):
+            return domain
+    return None
+
+
+class TokenBucket:
+    """令牌桶
+
+    允许透支：每次预留数据量对应的令牌，返回需要等待的时间，
+    等待结束时令牌已经补足，下载线程不需要反复轮询。
+    """
+
+    def __init__(self, rate, burst=None):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数（字节），0表示不限制
+            burst: 桶容量，默认为一秒的令牌数
+        """
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+        self._tokens = self.burst
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate
+
+    def reserve(self, amount):
+        """预留amount个令牌，返回需要等待的时间（秒）"""
+        with self._lock:
+            now = time.monotonic()
+            if not self.rate:
+                self._last = now
+                return 0
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class BandwidthLimiter:
+    """下载带宽限制
+
+    所有下载任务共用一个全局令牌桶，另外按站点和任务各自限速。全局上限有效时，
+    正在传输的任务平分全局带宽：每个任务最多使用 全局上限/活动任务数，
+    大任务不会占满带宽，小任务可以很快完成，任务结束后份额分给剩下的任务。
+    """
+
+    def __init__(self, config_path=BANDWIDTH_CONFIG_PATH, share=BANDWIDTH_SHARE):
+        """初始化限速器
+
+        Args:
+            config_path: 运行时配置文件路径，为空时只使用环境变量配置
+            share: 全局上限由几个进程平分
+        """
+        self.config_path = config_path
+        self.share = max(1, share)
+        self.config = {
+            "limit": parse_rate(BANDWIDTH_LIMIT),
+            "hosts": parse_host_limits(BANDWIDTH_HOST_LIMITS),
+            "schedule": parse_schedule(BANDWIDTH_SCHEDULE),
+            "tasks": {},
+        }
+        self._global = TokenBucket(0)
+        self._hosts = {}  # 域名 -> TokenBucket
+        self._tasks = {}  # task_id -> [TokenBucket, 最近传输时间]
+        self._lock = threading.Lock()
+        self._config_mtime = None
+        self._last_reload = 0
+        self._reload()
+
+    # ---- 配置 ----
+
+    def configure(self, limit=None, hosts=None, schedule=None, tasks=None):
+        """修改限速配置并保存，其他工作进程会在一秒内生效
+
+        Args:
+            limit: 全局上限
+            hosts: 域名 -> 上限，会替换原有的站点配置
+            schedule: 时段配置（列表或 "09:00-18:00=2M" 形式的字符串），会替换原有配置
+            tasks: task_id -> 上限，合并到原有配置，上限为0或None时取消该任务的限制
+        """
+        with self._lock:
+            config = json.loads(json.dumps(self.config))
+        if limit is not None:
+            config["limit"] = parse_rate(limit)
+        if hosts is not None:
+            config["hosts"] = {host.strip().lower(): parse_rate(rate) for host, rate in hosts.items()}
+        if schedule is not None:
+            if isinstance(schedule, str):
+                schedule = parse_schedule(schedule)
+            config["schedule"] = [
+                {"start": item["start"], "end": item["end"], "limit": parse_rate(item.get("limit"))}
+                for item in schedule
+            ]
+        if tasks is not None:
+            for task_id, rate in tasks.items():
+                rate = parse_rate(rate)
+                if rate:
+                    config["tasks"][task_id] = rate
+                else:
+                    config["tasks"].pop(task_id, None)
+        for item in config["schedule"]:
+            _minutes(item["start"])
+            _minutes(item["end"])
+
+        self._apply(config)
+        self._save(config)
+
+    def remove_tasks(self, task_ids):
+        """删除已结束任务的限速配置"""
+        task_ids = set(task_ids)
+        with self._lock:
+            if not task_ids & set(self.config["tasks"]):
+                return
+        self.configure(tasks={task_id: 0 for task_id in task_ids})
+
+    def _apply(self, config):
+        with self._lock:
+            self.config = config
+            for domain in list(self._hosts):
+                if domain not in config["hosts"]:
+                    del self._hosts[domain]
+            for domain, rate in config["hosts"].items():
+                if domain in self._hosts:
+                    self._hosts[domain].set_rate(rate)
+                else:
+                    self._hosts[domain] = TokenBucket(rate)
+
+    def _save(self, config):
+        if not self.config_path:
+            return
+        tmp_path = f"{self.config_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.config_path)
+        self._config_mtime = os.path.getmtime(self.config_path)
+
+    def _reload(self):
+        """配置文件被其他进程修改时重新读取"""
+        self._last_reload = time.monotonic()
+        if not self.config_path:
+            self._apply(self.config)
+            return
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            if self._config_mtime is None:
+                self._apply(self.config)
+            return
+        if mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        try:
+            with open(self.config_path, encoding="utf-8") as f:
+                config = json.load(f)
+            # 手工编辑的配置文件中无效的时段不会生效，保留原来的配置
+            for item in config.get("schedule", []):
+                _minutes(item["start"])
+                _minutes(item["end"])
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"读取带宽配置失败: {str(e)}")
+            return
+        config.setdefault("tasks", {})
+        self._apply(config)
+
+    def global_limit(self, now=None):
+        """当前时段的全局上限（本进程的份额），0表示不限制"""
+        now = now or time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        limit = self.config["limit"]
+        for item in self.config["schedule"]:
+            start, end = _minutes(item["start"]), _minutes(item["end"])
+            # 结束时间早于开始时间表示跨越午夜，如 23:00-07:00
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                limit = item["limit"]
+                break
+        return limit // self.share
+
+    def status(self):
+        """返回当前配置和生效的上限"""
+        with self._lock:
+            active = sum(1 for _, seen in self._tasks.values() if time.monotonic() - seen < IDLE_AFTER)
+            return dict(self.config, current_limit=self.global_limit(), active_tasks=active)
+
+    # ---- 限速 ----
+
+    def reserve(self, task_id, url, amount, task_limit=0):
+        """登记任务传输了amount字节，返回需要等待的时间（秒）
+
+        Args:
+            task_id: 任务ID
+            url: 下载链接，用于匹配站点限制
+            amount: 本次传输的字节数
+            task_limit: 任务自己的上限（提交任务时指定），运行时配置优先
+        """
+        if time.monotonic() - self._last_reload > RELOAD_INTERVAL:
+            self._reload()
+
+        now = time.monotonic()
+        global_limit = self.global_limit()
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                entry = self._tasks[task_id] = [TokenBucket(0), now]
+            entry[1] = now
+            self._global.set_rate(global_limit)
+            active = 1
+            for other_id, (_, seen) in list(self._tasks.items()):
+                if now - seen > IDLE_AFTER:
+                    del self._tasks[other_id]
+                elif other_id != task_id:
+                    active += 1
+            host = match_host(url, self._hosts)
+            host_bucket = self._hosts.get(host)
+            task_limit = self.config["tasks"].get(task_id) or task_limit or 0
+
+        # 任务的上限取自身限制和公平份额中较小的一个
+        limits = [rate for rate in (task_limit, global_limit // active if global_limit else 0) if rate]
+        task_bucket = entry[0]
+        task_bucket.set_rate(min(limits) if limits else 0)
+
+        wait = max(self._global.reserve(amount), task_bucket.reserve(amount))
+        if host_bucket is not None:
+            wait = max(wait, host_bucket.reserve(amount))
+        return wait
+
+    def forget(self, task_id):
+        """任务结束后释放其令牌桶"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+
+# 所有下载任务（网页版和桌面版）共用的限速器
+limiter = BandwidthLimiter()
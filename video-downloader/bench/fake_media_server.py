@@ -0,0 +1,214 @@
+"""本地的假媒体服务器，用于离线压测
+
+    python bench/fake_media_server.py --port 8900 --latency 50 --bandwidth 5M
+
+提供两类资源，内容都是按需生成的字节（不是真正的视频，但下载流程不关心内容）：
+
+    /media/<名称>.mp4?size=<字节数>                         直接下载的文件，支持Range请求
+    /hls/<名称>/index.m3u8?segments=<数量>&size=<分片字节数>  HLS播放列表及其分片
+
+每个请求先等待latency毫秒再响应，每个连接的传输速度不超过bandwidth。
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bandwidth import parse_rate  # noqa: E402
+
+# 默认的文件大小
+DEFAULT_SIZE = 5 * 1024 * 1024
+# 每次写入的块大小
+CHUNK_SIZE = 64 * 1024
+# HLS分片时长（秒）
+SEGMENT_DURATION = 4
+
+CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mkv": "video/x-matroska",
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".ts": "video/mp2t",
+    ".m3u8": "application/vnd.apple.mpegurl",
+}
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# 重复使用的填充内容
+_PATTERN = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        path = parts.path
+
+        try:
+            if path.startswith("/media/"):
+                self._send_file(path, int(query.get("size", DEFAULT_SIZE)), send_body)
+            elif path.startswith("/hls/") and path.endswith(".m3u8"):
+                self._send_playlist(path, int(query.get("segments", 10)), int(query.get("size", 256 * 1024)),
+                                    send_body)
+            elif path.startswith("/hls/") and path.endswith(".ts"):
+                self._send_file(path, int(query.get("size", 256 * 1024)), send_body)
+            else:
+                self.send_error(404)
+        except ValueError:
+            self.send_error(400)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_playlist(self, path, segments, size, send_body):
+        base = path.rsplit("/", 1)[0]
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD"]
+        for i in range(segments):
+            lines.append(f"#EXTINF:{SEGMENT_DURATION}.0,")
+            lines.append(f"{base}/{i}.ts?size={size}")
+        lines.append("#EXT-X-ENDLIST")
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[".m3u8"])
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_file(self, path, size, send_body):
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header:
+            match = RANGE_RE.match(range_header.strip())
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else size - 1
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                end = min(end, size - 1)
+                status = 206
+
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream"))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body:
+            self._write_throttled(length)
+
+    def _write_throttled(self, length):
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        while sent < length:
+            chunk = _PATTERN[:min(CHUNK_SIZE, length - sent)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            self.server.add_bytes(len(chunk))
+            if bandwidth:
+                # 按已发送的字节数计算应该经过的时间
+                delay = sent / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class FakeMediaServer(ThreadingHTTPServer):
+    """在后台线程中运行的假媒体服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, bandwidth=0):
+        """初始化服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示随机选择
+            latency: 每个请求的延迟（秒）
+            bandwidth: 每个连接的带宽（字节/秒），0表示不限制
+        """
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def media_url(self, name, size=DEFAULT_SIZE, ext="mp4"):
+        return f"{self.base_url}/media/{name}.{ext}?size={size}"
+
+    def hls_url(self, name, segments=10, segment_size=256 * 1024):
+        return f"{self.base_url}/hls/{name}/index.m3u8?segments={segments}&size={segment_size}"
+
+    def add_bytes(self, amount):
+        with self._lock:
+            self.bytes_sent += amount
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-media-server")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地的假媒体服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的延迟（毫秒）")
+    parser.add_argument("--bandwidth", default="0", help="每个连接的带宽，如 5M，0表示不限制")
+    args = parser.parse_args()
+
+    server = FakeMediaServer(args.host, args.port, args.latency / 1000, parse_rate(args.bandwidth))
+    print(f"假媒体服务器已启动: {server.base_url}")
+    print(f"  文件: {server.media_url('sample')}")
+    print(f"  HLS:  {server.hls_url('sample')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
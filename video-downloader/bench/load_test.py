@@ -0,0 +1,477 @@
+"""网页版的压测脚本，不访问外网，可以在CI中运行
+
+    python bench/load_test.py --concurrency 8 --requests 50
+    python bench/load_test.py --output result.json
+    python bench/load_test.py --baseline result.json --tolerance 0.3
+
+启动本地的假媒体服务器，再用临时的下载目录和数据库启动 serve.py（也可以用 --target 压测已经运行的服务），
+按设定的并发调用 /analyze、/download 和 /status，报告各接口的延迟（p50/p99）、吞吐量、
+下载速度以及服务进程的内存和线程数。指定 --baseline 时与之前的结果比较，变差超过容差时返回非零退出码。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCH_DIR)
+from bandwidth import parse_rate  # noqa: E402
+from fake_media_server import FakeMediaServer  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SCENARIOS = ("analyze", "download", "status")
+# 任务的结束状态
+FINISHED = ("completed", "error", "cancelled", "interrupted")
+# 查询任务状态的间隔（秒）
+POLL_INTERVAL = 0.1
+# 资源采样间隔（秒）
+SAMPLE_INTERVAL = 0.2
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def request_json(url, payload=None, timeout=30):
+    """发送请求并解析JSON响应
+
+    Returns:
+        tuple: (状态码, 响应内容)
+    """
+    data = None
+    headers = {}
+    if payload is not None:
+        data = json.dumps(payload).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        try:
+            return e.code, json.loads(body)
+        except ValueError:
+            return e.code, None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ResourceSampler:
+    """在后台线程中定期采样服务进程（包括子进程）的内存和线程数"""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # (rss字节数, 线程数)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pids(self):
+        if psutil is not None:
+            try:
+                process = psutil.Process(self.pid)
+                return [self.pid] + [child.pid for child in process.children(recursive=True)]
+            except psutil.Error:
+                return []
+        # 没有psutil时读取/proc（仅Linux）
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            pending.extend(children.get(pid, []))
+        return pids
+
+    def _read(self, pid):
+        if psutil is not None:
+            try:
+                process = psutil.Process(pid)
+                return process.memory_info().rss, process.num_threads()
+            except psutil.Error:
+                return 0, 0
+        rss = threads = 0
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) * 1024
+                    elif line.startswith("Threads:"):
+                        threads = int(line.split()[1])
+        except OSError:
+            pass
+        return rss, threads
+
+    @property
+    def available(self):
+        return self.pid is not None and (psutil is not None or os.path.isdir("/proc"))
+
+    def sample(self):
+        rss = threads = 0
+        for pid in self._pids():
+            pid_rss, pid_threads = self._read(pid)
+            rss += pid_rss
+            threads += pid_threads
+        self.samples.append((rss, threads))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if not self.available:
+            return self
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.sample()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {
+            "rss_start_mb": round(self.samples[0][0] / 1024 / 1024, 1),
+            "rss_peak_mb": round(max(rss for rss, _ in self.samples) / 1024 / 1024, 1),
+            "rss_end_mb": round(self.samples[-1][0] / 1024 / 1024, 1),
+            "threads_start": self.samples[0][1],
+            "threads_peak": max(threads for _, threads in self.samples),
+            "threads_end": self.samples[-1][1],
+        }
+
+
+class ServerProcess:
+    """用临时目录启动 serve.py，压测结束后删除"""
+
+    def __init__(self, workers, threads, server="auto", port=None):
+        self.port = port or free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.threads = threads
+        self.server = server
+        self.work_dir = tempfile.mkdtemp(prefix="vd-bench-")
+        self.proc = None
+
+    def start(self, timeout=30):
+        env = dict(os.environ)
+        env.update({
+            "DOWNLOAD_DIR": os.path.join(self.work_dir, "downloads"),
+            "TASK_DB_PATH": os.path.join(self.work_dir, "tasks.db"),
+            "DEDUP_DB_PATH": os.path.join(self.work_dir, "dedup.db"),
+            "BANDWIDTH_CONFIG_PATH": os.path.join(self.work_dir, "bandwidth.json"),
+            "INFO_CACHE_DIR": "",
+            "PYTHONUNBUFFERED": "1",
+        })
+        cmd = [sys.executable, os.path.join(PROJECT_DIR, "serve.py"), "--bind", f"127.0.0.1:{self.port}",
+               "--workers", str(self.workers), "--threads", str(self.threads), "--drain-timeout", "5",
+               "--server", self.server]
+        self.log = open(os.path.join(self.work_dir, "server.log"), "w")
+        self.proc = subprocess.Popen(cmd, cwd=PROJECT_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"服务启动失败，退出码 {self.proc.returncode}:\n{self.read_log()}")
+            try:
+                with urllib.request.urlopen(self.base_url + "/", timeout=1):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"等待服务启动超时:\n{self.read_log()}")
+
+    def read_log(self):
+        self.log.flush()
+        with open(self.log.name, encoding="utf-8", errors="replace") as f:
+            return f.read()[-4000:]
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        if self.proc is not None:
+            self.log.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def run_concurrently(fn, count, concurrency):
+    """用concurrency个线程执行count次fn(i)
+
+    fn返回 (是否成功, 延迟秒数, 额外信息)
+
+    Returns:
+        dict: 延迟统计、错误数、吞吐量，以及每次调用的额外信息列表
+    """
+    latencies = []
+    errors = []
+    extras = []
+    lock = threading.Lock()
+
+    def call(i):
+        started = time.perf_counter()
+        try:
+            ok, latency, extra = fn(i)
+        except Exception as e:
+            ok, latency, extra = False, time.perf_counter() - started, str(e)
+        with lock:
+            if ok:
+                latencies.append(latency)
+                extras.append(extra)
+            else:
+                errors.append(extra)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(count)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": count,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed": round(elapsed, 3),
+        "throughput": round(count / elapsed, 2) if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": _ms(max(latencies)) if latencies else None,
+        "_extras": extras,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class LoadTest:
+    """按场景压测一个正在运行的网页版服务"""
+
+    def __init__(self, base_url, media, args):
+        self.base_url = base_url.rstrip("/")
+        self.media = media
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.task_ids = []
+
+    def media_url(self, i):
+        # 每个请求使用不同的链接，避免命中分析缓存和去重
+        name = f"bench-{self.run_id}-{i}"
+        if self.args.hls and i % 2:
+            return self.media.hls_url(name, self.args.hls, max(1, self.args.size // self.args.hls))
+        return self.media.media_url(name, self.args.size)
+
+    def analyze(self, i):
+        started = time.perf_counter()
+        status, body = request_json(self.base_url + "/analyze", {"url": self.media_url(i)}, self.args.timeout)
+        latency = time.perf_counter() - started
+        if status != 200 or not (body or {}).get("formats"):
+            return False, latency, f"HTTP {status}: {body}"
+        return True, latency, None
+
+    def download(self, i):
+        started = time.perf_counter()
+        status, body = request_json(self.base_url + "/download", {"url": self.media_url(i)}, self.args.timeout)
+        submit_latency = time.perf_counter() - started
+        if status != 200 or not (body or {}).get("task_id"):
+            return False, submit_latency, f"HTTP {status}: {body}"
+        task_id = body["task_id"]
+        self.task_ids.append(task_id)
+
+        deadline = started + self.args.timeout
+        while time.perf_counter() < deadline:
+            status, body = request_json(f"{self.base_url}/status/{task_id}", timeout=self.args.timeout)
+            if status == 200 and body.get("status") in FINISHED:
+                break
+            time.sleep(POLL_INTERVAL)
+        else:
+            return False, time.perf_counter() - started, f"{task_id}: 超时未完成"
+        total = time.perf_counter() - started
+        if body.get("status") != "completed":
+            return False, total, f"{task_id}: {body.get('status')} {body.get('error_message')}"
+        return True, total, submit_latency
+
+    def status(self, i):
+        task_id = self.task_ids[i % len(self.task_ids)] if self.task_ids else "missing"
+        started = time.perf_counter()
+        status, body = request_json(f"{self.base_url}/status/{task_id}", timeout=self.args.timeout)
+        latency = time.perf_counter() - started
+        # 没有执行下载场景时查询不存在的任务，404也算正常响应
+        if status not in (200, 404):
+            return False, latency, f"HTTP {status}: {body}"
+        return True, latency, None
+
+    def run(self, scenario):
+        count = self.args.requests * (self.args.status_multiplier if scenario == "status" else 1)
+        media_bytes = self.media.bytes_sent
+        result = run_concurrently(getattr(self, scenario), count, self.args.concurrency)
+        extras = result.pop("_extras")
+        if scenario == "download":
+            # 延迟是提交到完成的时间，另外单独统计提交接口的延迟
+            result["submit_p50_ms"] = _ms(percentile(extras, 50))
+            result["submit_p99_ms"] = _ms(percentile(extras, 99))
+            transferred = self.media.bytes_sent - media_bytes
+            result["bytes"] = transferred
+            result["mb_per_second"] = round(transferred / 1024 / 1024 / result["elapsed"], 2)
+        return result
+
+
+def compare(results, baseline, tolerance):
+    """与基准结果比较，返回变差的指标说明列表"""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if base.get(key) and current.get(key) and current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{scenario}.{key}: {base[key]} -> {current[key]}")
+        for key in ("throughput", "mb_per_second"):
+            if base.get(key) and current.get(key) is not None and current[key] < base[key] * (1 - tolerance):
+                regressions.append(f"{scenario}.{key}: {base[key]} -> {current[key]}")
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{scenario}.errors: {base.get('errors', 0)} -> {current['errors']}")
+    base_resources = baseline.get("resources") or {}
+    resources = results.get("resources") or {}
+    for key in ("rss_peak_mb", "threads_peak"):
+        if base_resources.get(key) and resources.get(key) and resources[key] > base_resources[key] * (1 + tolerance):
+            regressions.append(f"resources.{key}: {base_resources[key]} -> {resources[key]}")
+    return regressions
+
+
+def print_report(results):
+    print(f"\n并发 {results['concurrency']}，服务 {results['target']}")
+    print(f"{'场景':<10}{'请求':>8}{'错误':>6}{'p50(ms)':>10}{'p99(ms)':>10}{'平均(ms)':>10}{'请求/秒':>10}")
+    for scenario, result in results["scenarios"].items():
+        print(f"{scenario:<12}{result['requests']:>8}{result['errors']:>6}{result['p50_ms'] or '-':>10}"
+              f"{result['p99_ms'] or '-':>10}{result['mean_ms'] or '-':>10}{result['throughput'] or '-':>10}")
+        for sample in result["error_samples"]:
+            print(f"    错误: {sample}")
+    download = results["scenarios"].get("download")
+    if download:
+        print(f"下载: 提交 p50 {download['submit_p50_ms']} ms / p99 {download['submit_p99_ms']} ms，"
+              f"共 {download['bytes'] / 1024 / 1024:.1f} MB，{download['mb_per_second']} MB/s")
+    resources = results.get("resources")
+    if resources:
+        print(f"内存: {resources['rss_start_mb']} -> 峰值 {resources['rss_peak_mb']} -> {resources['rss_end_mb']} MB，"
+              f"线程: {resources['threads_start']} -> 峰值 {resources['threads_peak']} -> {resources['threads_end']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="视频下载器网页版压测")
+    parser.add_argument("--target", help="压测已经运行的服务（如 http://127.0.0.1:5000），默认启动临时服务")
+    parser.add_argument("--pid", type=int, help="使用 --target 时采样内存和线程数的服务进程ID")
+    parser.add_argument("--workers", type=int, default=1, help="临时服务的工作进程数量，默认 %(default)s")
+    parser.add_argument("--threads", type=int, default=16, help="临时服务每个进程的线程数，默认 %(default)s")
+    parser.add_argument("--server", choices=("auto", "gunicorn", "waitress"), default="auto")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="要执行的场景，默认 %(default)s")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数，默认 %(default)s")
+    parser.add_argument("--requests", type=int, default=40, help="每个场景的请求数，默认 %(default)s")
+    parser.add_argument("--status-multiplier", type=int, default=10, help="status场景的请求数倍数，默认 %(default)s")
+    parser.add_argument("--size", type=parse_rate, default="2M", help="每个媒体文件的大小，默认 2M")
+    parser.add_argument("--hls", type=int, default=0, help="一半的请求使用HLS，指定分片数量，默认不使用")
+    parser.add_argument("--latency", type=float, default=20, help="假媒体服务器的响应延迟（毫秒），默认 %(default)s")
+    parser.add_argument("--bandwidth", type=parse_rate, default="0", help="假媒体服务器每个连接的带宽，如 10M")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求或下载的超时时间（秒）")
+    parser.add_argument("--output", help="把结果保存为JSON文件")
+    parser.add_argument("--baseline", help="与之前保存的JSON结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许变差的比例，默认 %(default)s")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+
+    media = FakeMediaServer(latency=args.latency / 1000, bandwidth=args.bandwidth).start()
+    server = None
+    try:
+        if args.target:
+            base_url, pid = args.target, args.pid
+        else:
+            server = ServerProcess(args.workers, args.threads, args.server)
+            server.start()
+            base_url, pid = server.base_url, server.proc.pid
+        print(f"假媒体服务器: {media.base_url}，压测服务: {base_url}")
+
+        sampler = ResourceSampler(pid).start()
+        test = LoadTest(base_url, media, args)
+        results = {
+            "target": base_url,
+            "concurrency": args.concurrency,
+            "size": args.size,
+            "latency_ms": args.latency,
+            "bandwidth": args.bandwidth,
+            "scenarios": {},
+        }
+        try:
+            for scenario in scenarios:
+                print(f"执行 {scenario} ...")
+                results["scenarios"][scenario] = test.run(scenario)
+        finally:
+            sampler.stop()
+        results["resources"] = sampler.summary()
+    finally:
+        if server is not None:
+            server.stop()
+        media.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n性能变差:")
+            for item in regressions:
+                print(f"  {item}")
+            return 1
+        print("\n与基准相比没有超过容差的变差")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
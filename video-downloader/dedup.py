@@ -0,0 +1,138 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 去重索引数据库路径
+DEDUP_DB_PATH = os.environ.get(
+    "DEDUP_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedup.db")
+)
+# 是否计算文件内容哈希（相同内容的文件只保留一份）
+DEDUP_HASH = os.environ.get("DEDUP_HASH", "0") == "1"
+
+
+def dedup_key(info, format_id, output_dir):
+    """根据视频信息生成去重键: 提取器 + 视频ID + 格式 + 保存目录
+
+    Returns:
+        str: 去重键，信息不完整时返回None
+    """
+    extractor = info.get('extractor_key') or info.get('extractor')
+    video_id = info.get('id')
+    if not extractor or not video_id or info.get('_type') == 'playlist':
+        return None
+    return f"{extractor}:{video_id}:{format_id or 'best'}:{os.path.abspath(output_dir)}"
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """已下载文件的去重索引
+
+    记录去重键对应的文件；同时跟踪正在下载的键，重复提交的任务可以挂到
+    进行中的任务上而不必再下载一遍。
+    """
+
+    def __init__(self, path=DEDUP_DB_PATH, use_hash=DEDUP_HASH):
+        """初始化索引
+
+        Args:
+            path: SQLite数据库路径
+            use_hash: 是否计算文件内容哈希
+        """
+        self.path = path
+        self.use_hash = use_hash
+        self._inflight = {}  # key -> 正在下载的任务
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " key TEXT PRIMARY KEY,"
+            " filepath TEXT NOT NULL,"
+            " size INTEGER,"
+            " sha256 TEXT,"
+            " created_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)")
+        conn.commit()
+
+    def _conn(self):
+        """每个线程使用独立的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, key):
+        """返回已下载的文件路径，文件已被删除时清除记录并返回None"""
+        conn = self._conn()
+        row = conn.execute("SELECT filepath, size FROM files WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        filepath, size = row
+        try:
+            if os.path.getsize(filepath) == size:
+                return filepath
+        except OSError:
+            pass
+        conn.execute("DELETE FROM files WHERE key = ?", (key,))
+        conn.commit()
+        return None
+
+    def claim(self, key, task):
+        """登记正在下载的任务
+
+        Returns:
+            已在下载同一内容的任务；若返回None，则task成为该键的下载者
+        """
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is not None:
+                return leader
+            self._inflight[key] = task
+            return None
+
+    def release(self, key, task):
+        """下载结束后释放键"""
+        with self._lock:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def record(self, key, filepath):
+        """记录下载完成的文件
+
+        开启内容哈希时，如果已有相同内容的文件，会删除新文件并返回已有文件的路径。
+
+        Returns:
+            str: 最终使用的文件路径
+        """
+        sha256 = None
+        conn = self._conn()
+        if self.use_hash:
+            sha256 = file_hash(filepath)
+            rows = conn.execute("SELECT filepath FROM files WHERE sha256 = ?", (sha256,)).fetchall()
+            for (existing,) in rows:
+                # 只合并同一目录下的文件，避免把文件“移到”用户没有选择的目录
+                if (existing != filepath and os.path.dirname(existing) == os.path.dirname(filepath)
+                        and os.path.exists(existing)):
+                    os.remove(filepath)
+                    filepath = existing
+                    break
+        conn.execute(
+            "INSERT OR REPLACE INTO files (key, filepath, size, sha256, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, filepath, os.path.getsize(filepath), sha256, time.time()),
+        )
+        conn.commit()
+        return filepath
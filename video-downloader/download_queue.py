@@ -0,0 +1,358 @@
+import shutil
+import threading
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QAbstractTableModel, QModelIndex, QTimer, QRect,
+                          QEvent, pyqtSignal)
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionProgressBar, QStyleOptionButton
+
+from downloader import Transfer, PROGRESS_FPS
+from task_store import FINISHED_STATES
+
+# 表格列
+COLUMNS = ("名称", "状态", "进度", "速度", "剩余时间", "操作")
+NAME_COLUMN, STATUS_COLUMN, PROGRESS_COLUMN, SPEED_COLUMN, ETA_COLUMN, ACTIONS_COLUMN = range(len(COLUMNS))
+# 每一行的操作按钮
+ACTIONS = (("pause", "暂停"), ("resume", "继续"), ("cancel", "取消"))
+
+STATUS_TEXT = {
+    "pending": "等待中",
+    "queued": "排队中",
+    "downloading": "下载中",
+    "processing": "处理中",
+    "completed": "已完成",
+    "error": "失败",
+    "cancelled": "已取消",
+    "paused": "已暂停",
+    "interrupted": "已中断",
+}
+# 还没有结束的状态（processing是下载完成后的转码等后处理）
+ACTIVE_STATES = ("pending", "queued", "downloading", "processing")
+
+
+def format_size(size):
+    """格式化字节数，如 12.3 MB"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+
+def format_eta(seconds):
+    """格式化剩余时间，如 1:05:30 或 05:30"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class _JobSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class Job(QRunnable):
+    """在共享线程池中执行的阻塞调用（分析视频、展开播放列表等），结果通过信号返回界面线程"""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = _JobSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+class QueueItem:
+    """队列中的一行"""
+
+    def __init__(self, url):
+        self.url = url
+        self.task = None
+        self.transfer = Transfer()
+        self.paused = False  # 暂停的任务可以继续，取消的不可以
+        self.discarded = False  # 已取消，结束后删除暂存的文件
+        self.snapshot = None  # 上次刷新时的显示内容，用于判断是否需要刷新
+
+    @property
+    def status(self):
+        if self.task is None:
+            return "pending"
+        return self.task.status
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def can(self, action):
+        """该行当前是否可以执行操作"""
+        status = self.status
+        if action == "pause":
+            # 后处理无法从中途继续，只能取消
+            return status in ("pending", "queued", "downloading") and self.task is not None
+        if action == "resume":
+            return not self.discarded and status in ("cancelled", "error", "interrupted")
+        if action == "cancel":
+            # 包括正在后处理的任务
+            return not self.discarded and status != "completed" and self.task is not None
+        return False
+
+
+class DownloadQueueModel(QAbstractTableModel):
+    """下载队列的表格模型
+
+    下载线程只更新每一行的进度记录，界面线程的定时器按PROGRESS_FPS检查进行中的行，
+    只对显示内容变化的行发出dataChanged，队列中有几百个任务时界面依然流畅。
+    """
+
+    # 任务结束: 名称, 状态, 错误信息
+    task_finished = pyqtSignal(str, str, str)
+
+    def __init__(self, service, parent=None):
+        """初始化模型
+
+        Args:
+            service: 下载服务
+        """
+        super().__init__(parent)
+        self.service = service
+        self._items = []
+        self._rows = {}  # QueueItem -> 行号
+        self._active = set()  # 未结束或等待清理的行
+        self._lock = threading.Lock()  # 保护下载线程写入的进度记录
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, 1000 // PROGRESS_FPS))
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start()
+
+    # ---- Qt模型接口 ----
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._items)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self._items[index.row()]
+        column = index.column()
+        snapshot = item.snapshot or self._snapshot(item)
+        status, progress, name, speed, eta, error = snapshot
+
+        if role == Qt.DisplayRole:
+            if column == NAME_COLUMN:
+                return name
+            if column == STATUS_COLUMN:
+                return STATUS_TEXT.get(status, status)
+            if column == PROGRESS_COLUMN:
+                return f"{progress:.1f}%"
+            if column == SPEED_COLUMN:
+                return f"{format_size(speed)}/s" if speed and status == "downloading" else ""
+            if column == ETA_COLUMN:
+                return format_eta(eta) if eta is not None and status == "downloading" else ""
+        elif role == Qt.UserRole and column == PROGRESS_COLUMN:
+            return progress
+        elif role == Qt.ToolTipRole:
+            if column == STATUS_COLUMN and error:
+                return error
+            if column == NAME_COLUMN:
+                return item.url
+        return None
+
+    # ---- 队列操作 ----
+
+    def add(self, url, format_id=None, fragments=None, output_dir=None):
+        """提交下载并添加到队列末尾"""
+        self.add_many([url], format_id, fragments, output_dir)
+
+    def add_many(self, urls, format_id=None, fragments=None, output_dir=None):
+        """批量提交下载（已展开的链接），一次性插入所有行"""
+        if not urls:
+            return
+        items = [QueueItem(url) for url in urls]
+        first = len(self._items)
+        self.beginInsertRows(QModelIndex(), first, first + len(items) - 1)
+        for row, item in enumerate(items, first):
+            self._items.append(item)
+            self._rows[item] = row
+        self.endInsertRows()
+
+        for item in items:
+            item.task = self.service.run(self.service.submit(
+                item.url, format_id, output_dir=output_dir, hooks=[self._make_hook(item)],
+                fragments=fragments
+            ))
+            self._active.add(item)
+
+    def _make_hook(self, item):
+        def hook(d):
+            # 下载线程：只记录最新进度，由定时器刷新界面
+            if d['status'] == 'downloading':
+                with self._lock:
+                    item.transfer.update(d)
+        return hook
+
+    def item(self, row):
+        return self._items[row]
+
+    def pause(self, row):
+        """暂停下载，已下载的部分保留，可以继续"""
+        item = self._items[row]
+        if item.can("pause"):
+            item.paused = True
+            self.service.run(self.service.cancel(item.task.task_id))
+            self._touch(item)
+
+    def resume(self, row):
+        """从断点继续下载"""
+        item = self._items[row]
+        if not item.can("resume"):
+            return
+        item.paused = False
+        with self._lock:
+            item.transfer = Transfer()
+        if self.service.run(self.service.resume(item.task.task_id)) is not None:
+            self._active.add(item)
+        self._touch(item)
+
+    def cancel(self, row):
+        """取消下载并删除已下载的部分"""
+        item = self._items[row]
+        if not item.can("cancel"):
+            return
+        item.paused = False
+        item.discarded = True
+        if not item.finished:
+            self.service.run(self.service.cancel(item.task.task_id))
+        # 下载线程停止后由refresh删除暂存目录
+        self._active.add(item)
+        self._touch(item)
+
+    def trigger(self, row, action):
+        getattr(self, action)(row)
+
+    def remove_finished(self):
+        """从列表中移除已完成和已取消的行"""
+        keep = [item for item in self._items
+                if not (item.status == "completed" or (item.discarded and item.finished))]
+        if len(keep) == len(self._items):
+            return
+        self.beginResetModel()
+        self._items = keep
+        self._rows = {item: row for row, item in enumerate(keep)}
+        self._active &= set(keep)
+        self.endResetModel()
+
+    def counts(self):
+        """按状态统计行数"""
+        counts = {}
+        for item in self._items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    # ---- 刷新 ----
+
+    def _snapshot(self, item):
+        """当前的显示内容: (状态, 进度, 名称, 速度, 剩余时间, 错误信息)"""
+        task = item.task
+        status = item.status
+        if status == "cancelled" and item.paused:
+            status = "paused"
+        with self._lock:
+            speed, eta = item.transfer.speed, item.transfer.eta
+        if task is None:
+            return (status, 0.0, item.url, None, None, None)
+        name = task.filename or item.url
+        return (status, round(task.progress or 0, 1), name, speed and round(speed), eta and round(eta),
+                task.error_message)
+
+    def _touch(self, item):
+        item.snapshot = self._snapshot(item)
+        row = self._rows[item]
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMNS) - 1))
+
+    def refresh(self):
+        """检查进行中的行，只刷新显示内容有变化的行（界面线程的定时器）"""
+        changed = []
+        for item in list(self._active):
+            snapshot = self._snapshot(item)
+            if snapshot != item.snapshot:
+                finished_now = item.finished and (item.snapshot is None or item.snapshot[0] not in FINISHED_STATES)
+                item.snapshot = snapshot
+                changed.append(self._rows[item])
+                if finished_now and not item.paused and not item.discarded:
+                    self.task_finished.emit(snapshot[2], item.status, snapshot[5] or "")
+            if item.finished:
+                self._active.discard(item)
+                if item.discarded and item.task is not None:
+                    shutil.rmtree(item.task.staging_dir, ignore_errors=True)
+        if not changed:
+            return
+        # 相邻的行合并为一次dataChanged
+        changed.sort()
+        start = prev = changed[0]
+        for row in changed[1:] + [None]:
+            if row is not None and row == prev + 1:
+                prev = row
+                continue
+            self.dataChanged.emit(self.index(start, 0), self.index(prev, len(COLUMNS) - 1))
+            if row is not None:
+                start = prev = row
+
+
+class ProgressDelegate(QStyledItemDelegate):
+    """在进度列中绘制进度条"""
+
+    def paint(self, painter, option, index):
+        option_bar = QStyleOptionProgressBar()
+        option_bar.rect = option.rect.adjusted(2, 4, -2, -4)
+        option_bar.minimum = 0
+        option_bar.maximum = 100
+        option_bar.progress = int(index.data(Qt.UserRole) or 0)
+        option_bar.text = index.data(Qt.DisplayRole)
+        option_bar.textVisible = True
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, option_bar, painter)
+
+
+class ActionsDelegate(QStyledItemDelegate):
+    """在操作列中绘制每一行的暂停/继续/取消按钮，点击时调用模型的对应操作"""
+
+    def _button_rects(self, rect):
+        width = rect.width() // len(ACTIONS)
+        return [QRect(rect.x() + i * width + 2, rect.y() + 2, width - 4, rect.height() - 4)
+                for i in range(len(ACTIONS))]
+
+    def paint(self, painter, option, index):
+        item = index.model().item(index.row())
+        for (action, text), rect in zip(ACTIONS, self._button_rects(option.rect)):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.State_Enabled if item.can(action) else QStyle.State_None
+            QApplication.style().drawControl(QStyle.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            for (action, _), rect in zip(ACTIONS, self._button_rects(option.rect)):
+                if rect.contains(event.pos()):
+                    if model.item(index.row()).can(action):
+                        model.trigger(index.row(), action)
+                    return True
+        return super().editorEvent(event, model, option, index)
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        size.setWidth(60 * len(ACTIONS))
+        return size
@@ -1,63 +1,80 @@
 import os
-import yt_dlp
+import time
 from PyQt5.QtCore import QObject, pyqtSignal
 
+from service import DownloadService, progress_percent
+from task_store import MemoryTaskStore
+
+# 界面进度的最高刷新频率（次/秒），两次刷新之间的进度回调只保留最新的一次
+PROGRESS_FPS = int(os.environ.get("PROGRESS_FPS", 10))
+# 后端没有提供速度时，估算速度的最短采样间隔（秒）
+SPEED_SAMPLE_INTERVAL = 0.5
+
+
+class Transfer:
+    """一个文件的最新进度"""
+
+    def __init__(self):
+        self.filename = ''
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.percentage = None
+        self.speed = None
+        self.eta = None
+        self.updated_at = 0
+        self._sample = None  # (时间, 字节数)，用于估算速度
+
+    def update(self, d):
+        """根据进度回调更新，只使用数值字段"""
+        now = time.monotonic()
+        self.filename = os.path.basename(d.get('filename') or '')
+        self.downloaded_bytes = d.get('downloaded_bytes') or 0
+        self.total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+        self.percentage = progress_percent(d)
+        self.updated_at = now
+
+        speed = d.get('speed')
+        if speed is None and d.get('downloaded_bytes') is not None:
+            # HTTP后端等不提供速度，按字节数的变化估算并做平滑
+            if self._sample is None or self.downloaded_bytes < self._sample[1]:
+                self._sample = (now, self.downloaded_bytes)
+            elif now - self._sample[0] >= SPEED_SAMPLE_INTERVAL:
+                current = (self.downloaded_bytes - self._sample[1]) / (now - self._sample[0])
+                self.speed = current if self.speed is None else self.speed * 0.7 + current * 0.3
+                self._sample = (now, self.downloaded_bytes)
+            speed = self.speed
+        self.speed = speed
+
+        eta = d.get('eta')
+        if eta is None and speed and self.total_bytes:
+            eta = max(0, self.total_bytes - self.downloaded_bytes) / speed
+        self.eta = eta
+
+
 class VideoDownloader(QObject):
-    """视频下载器类，处理视频下载逻辑"""
+    """视频下载器类，基于DownloadService为Qt界面提供格式查询和下载服务
+
+    下载由DownloadQueueModel提交到服务并显示进度。
+    """
     
     # 定义信号
-    progress_signal = pyqtSignal(float, str)
-    complete_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
     
-    def __init__(self, output_path="downloads"):
+    def __init__(self, output_path="downloads", service=None):
         """初始化下载器
         
         Args:
             output_path: 视频保存路径
+            service: 下载服务，默认创建一个只在内存中保存任务的服务
         """
         super().__init__()
         self.output_path = output_path
+        self.fragments = None  # 分片并发数，None表示使用默认值
         
-        # 确保下载目录存在
+        # 确保下载目录存在（下载服务启动时会扫描该目录）
         if not os.path.exists(output_path):
             os.makedirs(output_path)
-            
-    def _progress_hook(self, d):
-        """下载进度回调函数"""
-        if d['status'] == 'downloading':
-            p = d.get('_percent_str', 'unknown')
-            p = p.replace('%', '').strip()
-            try:
-                percentage = float(p)
-                filename = d.get('filename', '').split('/')[-1]
-                self.progress_signal.emit(percentage, filename)
-            except (ValueError, TypeError):
-                pass
-        elif d['status'] == 'finished':
-            filename = d.get('filename', '').split('/')[-1]
-            self.complete_signal.emit(filename)
-            
-    def download_video(self, url, format_id=None):
-        """下载视频
-        
-        Args:
-            url: 视频链接
-            format_id: 视频格式ID，默认为None（最佳质量）
-        """
-        ydl_opts = {
-            'format': format_id if format_id else 'best',
-            'outtmpl': os.path.join(self.output_path, '%(title)s.%(ext)s'),
-            'progress_hooks': [self._progress_hook],
-        }
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            return True
-        except Exception as e:
-            self.error_signal.emit(f"下载错误: {str(e)}")
-            return False
+        self.service = service or DownloadService(output_path, task_store=MemoryTaskStore())
             
     def get_available_formats(self, url):
         """获取视频可用的格式
@@ -68,24 +85,9 @@ class VideoDownloader(QObject):
         Returns:
             list: 格式列表，每个元素为(format_id, description)
         """
-        ydl_opts = {
-            'listformats': True,
-            'quiet': True,
-        }
-        
-        formats = []
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if 'formats' in info:
-                    for f in info['formats']:
-                        format_note = f.get('format_note', '')
-                        resolution = f.get('resolution', 'unknown')
-                        format_id = f.get('format_id', '')
-                        ext = f.get('ext', 'unknown')
-                        desc = f"{format_note} ({resolution}, {ext})"
-                        formats.append((format_id, desc))
-            return formats
+            formats = self.service.run(self.service.analyze(url))
+            return [(f["format_id"], f["description"]) for f in formats]
         except Exception as e:
             self.error_signal.emit(f"获取格式错误: {str(e)}")
-            return [] 
\ No newline at end of file
+            return [] 
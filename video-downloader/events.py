@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# 每个任务每秒最多推送的进度更新次数
+PROGRESS_MAX_RATE = float(os.environ.get("PROGRESS_MAX_RATE", 4))
+
+
+class Subscription:
+    """一个订阅连接
+
+    只保留每个任务的最新状态，消费慢的连接不会积压消息。
+    """
+
+    def __init__(self, task_ids=None):
+        """初始化订阅
+
+        Args:
+            task_ids: 关注的任务ID集合，None表示关注所有任务
+        """
+        self.task_ids = set(task_ids) if task_ids is not None else None
+        self._latest = OrderedDict()
+        self._cond = threading.Condition()
+
+    def wants(self, task_id):
+        return self.task_ids is None or task_id in self.task_ids
+
+    def add(self, task_ids):
+        """增加关注的任务"""
+        with self._cond:
+            if self.task_ids is not None:
+                self.task_ids.update(task_ids)
+
+    def remove(self, task_ids):
+        """取消关注的任务"""
+        with self._cond:
+            if self.task_ids is not None:
+                self.task_ids.difference_update(task_ids)
+            for task_id in task_ids:
+                self._latest.pop(task_id, None)
+
+    def push(self, task_id, state):
+        with self._cond:
+            self._latest[task_id] = state
+            self._latest.move_to_end(task_id)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """等待并取出所有待发送的更新
+
+        Returns:
+            list: (task_id, state) 列表，超时返回空列表
+        """
+        with self._cond:
+            if not self._latest:
+                self._cond.wait(timeout)
+            events = list(self._latest.items())
+            self._latest.clear()
+            return events
+
+
+class ProgressBroker:
+    """任务进度的发布/订阅中心
+
+    状态没有变化的更新会被丢弃；同一任务的进度更新按PROGRESS_MAX_RATE限频，
+    状态切换（如 downloading -> completed）和任务的最终状态总是立即推送。
+    """
+
+    def __init__(self, max_rate=PROGRESS_MAX_RATE):
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0
+        self._subscriptions = set()
+        self._last = {}       # task_id -> (发送时间, 状态)
+        self._pending = {}    # task_id -> 被限频暂存的最新状态
+        self._lock = threading.Lock()
+
+    def publish(self, task_id, state, force=False):
+        """发布任务状态
+
+        Args:
+            task_id: 任务ID
+            state: 任务状态
+            force: 不限频，立即推送（任务结束时的最终状态，之后会调用forget清除暂存的更新）
+        """
+        now = time.time()
+        with self._lock:
+            last = self._last.get(task_id)
+            if last is not None:
+                if last[1] == state:
+                    self._pending.pop(task_id, None)
+                    return
+                status_changed = last[1].get("status") != state.get("status")
+                if not force and not status_changed and now - last[0] < self.min_interval:
+                    self._pending[task_id] = state
+                    return
+            self._emit(task_id, state, now)
+
+    def flush(self):
+        """推送已过限频间隔的暂存更新"""
+        now = time.time()
+        with self._lock:
+            for task_id, state in list(self._pending.items()):
+                if now - self._last[task_id][0] >= self.min_interval:
+                    self._emit(task_id, state, now)
+
+    def forget(self, task_id):
+        """任务结束后释放其限频记录"""
+        with self._lock:
+            self._last.pop(task_id, None)
+            self._pending.pop(task_id, None)
+
+    def _emit(self, task_id, state, now):
+        """调用方需持有锁"""
+        self._last[task_id] = (now, state)
+        self._pending.pop(task_id, None)
+        for sub in self._subscriptions:
+            if sub.wants(task_id):
+                sub.push(task_id, state)
+
+    def subscribe(self, task_ids=None):
+        """创建订阅，task_ids为None时订阅所有任务"""
+        return self.register(Subscription(task_ids))
+
+    def register(self, sub):
+        """登记一个已创建的订阅"""
+        with self._lock:
+            self._subscriptions.add(sub)
+        return sub
+
+    def has_pending(self):
+        """是否有被限频暂存的更新"""
+        return bool(self._pending)
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def listen(self, sub, timeout):
+        """等待订阅的下一批更新，期间顺带推送到期的暂存更新"""
+        events = sub.get(timeout=min(timeout, self.min_interval) if self.min_interval else timeout)
+        if not events and self.has_pending():
+            self.flush()
+            events = sub.get(timeout=0)
+        return events
@@ -0,0 +1,195 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from ydl_pool import ydl_pool
+from metrics import host_of, EXTRACT_SECONDS
+
+# 视频信息缓存有效期（秒）
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", 600))
+# 内存中最多缓存的视频信息条数
+INFO_CACHE_SIZE = int(os.environ.get("INFO_CACHE_SIZE", 256))
+# 磁盘缓存目录，为空时不启用
+INFO_CACHE_DIR = os.environ.get("INFO_CACHE_DIR", "")
+
+# 不影响视频内容的跟踪参数
+TRACKING_PARAMS = {"spm_id_from", "from", "share_source", "share_medium", "share_from",
+                   "vd_source", "si", "feature", "fbclid", "gclid"}
+
+
+def normalize_url(url):
+    """规范化URL作为缓存键：小写协议和域名、去掉锚点和跟踪参数、排序查询参数"""
+    parts = urlsplit(url.strip())
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith("utm_")
+    ]
+    query.sort()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+class _InFlight:
+    """正在进行的提取，用于合并并发请求"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.info = None
+        self.error = None
+
+
+class InfoCache:
+    """视频信息（yt-dlp info dict）缓存
+
+    内存层按LRU淘汰，可选的磁盘层在重启后依然有效；同一URL的并发提取
+    只会真正执行一次，其余调用等待结果。
+    """
+
+    def __init__(self, ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_SIZE, disk_dir=INFO_CACHE_DIR):
+        """初始化缓存
+
+        Args:
+            ttl: 缓存有效期（秒）
+            max_entries: 内存缓存容量
+            disk_dir: 磁盘缓存目录，为空时只使用内存
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (expires_at, info)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        if disk_dir and not os.path.exists(disk_dir):
+            os.makedirs(disk_dir)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _load_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            return None
+        return entry["expires_at"], entry["info"]
+
+    def _store_disk(self, key, expires_at, info):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "info": info}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"写入视频信息缓存失败: {str(e)}")
+
+    def get(self, url):
+        """获取缓存的视频信息，未命中或已过期时返回None"""
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] >= time.time():
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._entries.pop(key, None)
+
+        entry = self._load_disk(key)
+        if entry is None:
+            return None
+        with self._lock:
+            self._put_memory(key, entry)
+        return entry[1]
+
+    def put(self, url, info):
+        """写入视频信息"""
+        key = normalize_url(url)
+        entry = (time.time() + self.ttl, info)
+        with self._lock:
+            self._put_memory(key, entry)
+        self._store_disk(key, *entry)
+
+    def invalidate(self, url):
+        """删除某个URL的缓存"""
+        key = normalize_url(url)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _put_memory(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_extract(self, url, extract):
+        """获取视频信息，未命中时调用extract(url)提取；并发的相同请求只提取一次"""
+        info = self.get(url)
+        if info is not None:
+            return info
+
+        key = normalize_url(url)
+        with self._lock:
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = _InFlight()
+                self._inflight[key] = inflight
+
+        if not owner:
+            inflight.event.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.info
+
+        try:
+            inflight.info = extract(url)
+            self.put(url, inflight.info)
+            return inflight.info
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.event.set()
+
+
+def _extract(url):
+    """调用yt-dlp提取视频信息（不下载）"""
+    started = time.monotonic()
+    try:
+        with ydl_pool.acquire({'quiet': True}) as ydl:
+            info = ydl.extract_info(url, download=False)
+            return ydl.sanitize_info(info)
+    finally:
+        EXTRACT_SECONDS.observe(time.monotonic() - started, host=host_of(url))
+
+
+# 全局共享的视频信息缓存
+info_cache = InfoCache()
+
+
+def extract_info(url):
+    """获取视频信息，优先使用缓存"""
+    return info_cache.get_or_extract(url, _extract)
+
+
+def cached_info(url):
+    """返回可直接交给yt-dlp处理的缓存副本，未命中时返回None"""
+    info = info_cache.get(url)
+    return copy.deepcopy(info) if info is not None else None
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import queue
+import base64
+import heapq
+import shutil
+import threading
+import subprocess
+
+# 下载目录的重新扫描间隔（秒），用于发现外部添加或删除的文件
+LIBRARY_RESCAN_INTERVAL = int(os.environ.get("LIBRARY_RESCAN_INTERVAL", 300))
+# 每个任务的暂存目录位于 <下载目录>/.staging/<task_id>
+STAGING_DIRNAME = ".staging"
+# 用于读取时长和分辨率的ffprobe，未安装时只记录大小和修改时间
+FFPROBE = shutil.which("ffprobe")
+# 列表排序字段
+SORT_FIELDS = ("mtime", "size", "name")
+# 不分页列出文件时，每批输出的条目数量
+LIBRARY_SCAN_BATCH = 1000
+
+def is_partial_file(name):
+    """是否是下载过程中的临时文件"""
+    return name.endswith(('.part', '.ytdl')) or '.part-Frag' in name
+
+
+def staging_root(output_dir):
+    return os.path.join(output_dir, STAGING_DIRNAME)
+
+
+def _candidate_paths(path):
+    """目标文件名及追加序号的备选名，如 "视频 (1).mp4" """
+    yield path
+    base, ext = os.path.splitext(path)
+    i = 1
+    while True:
+        yield f"{base} ({i}){ext}"
+        i += 1
+
+
+def _publish_file(src, path):
+    """把文件移动到不与已有文件同名的路径，返回最终路径
+
+    多个工作进程可能同时发布同名文件，目标名通过原子操作占用（已存在时抛出FileExistsError），
+    而不是先检查再移动。暂存目录和下载目录在同一文件系统上。
+    """
+    for target in _candidate_paths(path):
+        try:
+            os.link(src, target)
+        except FileExistsError:
+            continue
+        except OSError:
+            # 不支持硬链接的文件系统：先创建空文件占用名字，再原子地替换
+            try:
+                open(target, "x").close()
+            except FileExistsError:
+                continue
+            os.replace(src, target)
+            return target
+        os.unlink(src)
+        return target
+
+
+def publish_staged(staging_dir, output_dir, main_file=None):
+    """把暂存目录中下载完成的文件移动到下载目录，并删除暂存目录
+
+    Args:
+        staging_dir: 任务的暂存目录
+        output_dir: 下载目录
+        main_file: 后端报告的主文件路径（位于暂存目录中）
+
+    Returns:
+        list: 移动后的文件路径，主文件排在第一位
+    """
+    entries = [
+        entry for entry in os.scandir(staging_dir)
+        if entry.is_file() and not is_partial_file(entry.name)
+    ]
+    if not entries:
+        raise Exception("下载似乎成功但找不到文件")
+
+    # 没有报告主文件时，取最大的文件（例如字幕、封面之外的视频文件）
+    main_name = os.path.basename(main_file) if main_file else None
+    if main_name not in [entry.name for entry in entries]:
+        main_name = max(entries, key=lambda entry: entry.stat().st_size).name
+    entries.sort(key=lambda entry: entry.name != main_name)
+
+    published = []
+    for entry in entries:
+        published.append(_publish_file(entry.path, os.path.join(output_dir, entry.name)))
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return published
+
+
+def probe_media(path):
+    """用ffprobe读取时长和分辨率
+
+    Returns:
+        dict: duration / width / height，无法读取的字段为None
+    """
+    meta = {"duration": None, "width": None, "height": None}
+    if FFPROBE is None:
+        return meta
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "format=duration:stream=width,height", "-of", "json", path],
+            capture_output=True, text=True, timeout=30
+        )
+        data = json.loads(result.stdout or "{}")
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return meta
+
+    duration = data.get("format", {}).get("duration")
+    if duration is not None:
+        try:
+            meta["duration"] = round(float(duration), 3)
+        except ValueError:
+            pass
+    streams = data.get("streams") or [{}]
+    meta["width"] = streams[0].get("width")
+    meta["height"] = streams[0].get("height")
+    return meta
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """解析分页游标，无效时抛出ValueError"""
+    try:
+        value, name = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("无效的分页游标")
+    return value, name
+
+
+class FileIndex:
+    """下载目录的文件索引
+
+    启动时和之后定期在后台扫描一次目录，下载完成的文件直接登记，
+    列出文件时不需要访问文件系统。时长和分辨率由后台线程用ffprobe补充。
+    """
+
+    def __init__(self, directory, rescan_interval=LIBRARY_RESCAN_INTERVAL):
+        """初始化索引
+
+        Args:
+            directory: 下载目录
+            rescan_interval: 重新扫描间隔（秒）
+        """
+        self.directory = os.path.abspath(directory)
+        self.rescan_interval = rescan_interval
+        self._files = {}  # 文件名 -> 条目（name/size/mtime/duration/width/height）
+        self._changes = {}  # 扫描期间登记的变化，文件名 -> 条目或None（已删除）
+        self._media = {}  # 文件名 -> (大小, 修改时间, 媒体信息)，文件未变化时不重复读取
+        self._scanning = False
+        self._lock = threading.Lock()
+        self._probe_queue = queue.Queue()
+
+        self._scanner = threading.Thread(target=self._scan_loop, name="library-scanner")
+        self._scanner.daemon = True
+        self._scanner.start()
+        if FFPROBE is not None:
+            self._prober = threading.Thread(target=self._probe_loop, name="library-prober")
+            self._prober.daemon = True
+            self._prober.start()
+
+    def names(self):
+        """返回所有文件名"""
+        with self._lock:
+            return list(self._files)
+
+    def query(self, sort="mtime", descending=True, prefix=None, exts=None, cursor=None, limit=100):
+        """按条件列出文件
+
+        Args:
+            sort: 排序字段，mtime / size / name
+            descending: 是否降序
+            prefix: 文件名前缀
+            exts: 扩展名集合（小写，不含点）
+            cursor: 上一页返回的游标
+            limit: 每页数量，0表示不分页
+
+        Returns:
+            tuple: (条目列表, 下一页游标)，没有下一页时游标为None
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        after = decode_cursor(cursor) if cursor else None
+
+        def sort_key(entry):
+            return [entry[sort], entry["name"]]
+
+        def matches(entry):
+            if prefix and not entry["name"].startswith(prefix):
+                return False
+            if exts and os.path.splitext(entry["name"])[1][1:].lower() not in exts:
+                return False
+            if after is not None:
+                key = sort_key(entry)
+                return key < list(after) if descending else key > list(after)
+            return True
+
+        with self._lock:
+            entries = [entry for entry in self._files.values() if matches(entry)]
+
+        if not limit:
+            entries.sort(key=sort_key, reverse=descending)
+            return entries, None
+        # 只取一页（多取一条判断是否还有下一页），不必对整个目录排序
+        select = heapq.nlargest if descending else heapq.nsmallest
+        page = select(limit + 1, entries, key=sort_key)
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, encode_cursor(sort_key(page[-1]))
+
+    def scan(self, sort="mtime", descending=True, prefix=None, exts=None, cursor=None, batch=LIBRARY_SCAN_BATCH):
+        """列出所有符合条件的文件，用于不分页的流式输出
+
+        条件和排序立即在索引的快照上完成，参数错误时直接抛出ValueError；
+        之后在迭代时每次取出batch条，调用方可以逐批输出。
+
+        Returns:
+            iterator: 每次一批条目的列表
+        """
+        entries, _ = self.query(sort, descending, prefix, exts, cursor, limit=0)
+        return (entries[i:i + batch] for i in range(0, len(entries), batch))
+
+    def add(self, path):
+        """登记下载目录中的新文件"""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.directory:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._set(os.path.basename(path), self._entry(os.path.basename(path), st))
+
+    def remove(self, name):
+        """登记被删除的文件"""
+        self._set(name, None)
+
+    def _entry(self, name, st):
+        """创建条目，文件未变化时沿用已读取的媒体信息"""
+        entry = {"name": name, "size": st.st_size, "mtime": st.st_mtime,
+                 "duration": None, "width": None, "height": None}
+        with self._lock:
+            media = self._media.get(name)
+        if media is not None and media[:2] == (st.st_size, st.st_mtime):
+            entry.update(media[2])
+        return entry
+
+    def _needs_probe(self, entry):
+        """调用方需持有锁"""
+        media = self._media.get(entry["name"])
+        return FFPROBE is not None and (media is None or media[:2] != (entry["size"], entry["mtime"]))
+
+    def _set(self, name, entry):
+        with self._lock:
+            if entry is None:
+                self._files.pop(name, None)
+                self._media.pop(name, None)
+            else:
+                self._files[name] = entry
+                if self._needs_probe(entry):
+                    self._probe_queue.put(name)
+            if self._scanning:
+                self._changes[name] = entry
+
+    def rescan(self):
+        """重新扫描下载目录"""
+        with self._lock:
+            self._scanning = True
+            self._changes = {}
+        files = {}
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith('.') or is_partial_file(entry.name):
+                    continue
+                try:
+                    if entry.is_file():
+                        files[entry.name] = self._entry(entry.name, entry.stat())
+                except OSError:
+                    continue
+        except OSError:
+            with self._lock:
+                self._scanning = False
+            raise
+
+        with self._lock:
+            # 扫描期间登记的变化比扫描结果更新
+            for name, entry in self._changes.items():
+                if entry is None:
+                    files.pop(name, None)
+                else:
+                    files[name] = entry
+            self._files = files
+            self._changes = {}
+            self._scanning = False
+            self._media = {name: media for name, media in self._media.items() if name in files}
+            for entry in files.values():
+                if self._needs_probe(entry):
+                    self._probe_queue.put(entry["name"])
+
+    def _scan_loop(self):
+        while True:
+            try:
+                self.rescan()
+            except OSError as e:
+                print(f"扫描下载目录失败: {str(e)}")
+            time.sleep(self.rescan_interval)
+
+    def _probe_loop(self):
+        """后台读取文件的时长和分辨率"""
+        while True:
+            name = self._probe_queue.get()
+            with self._lock:
+                entry = self._files.get(name)
+                if entry is None or not self._needs_probe(entry):
+                    continue
+            meta = probe_media(os.path.join(self.directory, name))
+            with self._lock:
+                # 读取期间文件可能已被替换或删除
+                current = self._files.get(name)
+                if current is not None and (current["size"], current["mtime"]) == (entry["size"], entry["mtime"]):
+                    self._media[name] = (entry["size"], entry["mtime"], meta)
+                    self._files[name] = dict(current, **meta)
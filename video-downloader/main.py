@@ -3,38 +3,14 @@ import sys
 import os
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLabel, QLineEdit, QPushButton, 
-                            QProgressBar, QComboBox, QFileDialog, QMessageBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+                            QComboBox, QFileDialog, QMessageBox, QTableView,
+                            QCheckBox, QPlainTextEdit, QSpinBox, QHeaderView)
+from PyQt5.QtCore import QThreadPool
 
 from downloader import VideoDownloader
-
-class DownloadThread(QThread):
-    """下载线程类"""
-    
-    def __init__(self, downloader, url, format_id=None):
-        super().__init__()
-        self.downloader = downloader
-        self.url = url
-        self.format_id = format_id
-        
-    def run(self):
-        """运行线程"""
-        self.downloader.download_video(self.url, self.format_id)
-
-class FormatThread(QThread):
-    """获取格式线程类"""
-    
-    formats_ready = pyqtSignal(list)
-    
-    def __init__(self, downloader, url):
-        super().__init__()
-        self.downloader = downloader
-        self.url = url
-        
-    def run(self):
-        """运行线程"""
-        formats = self.downloader.get_available_formats(self.url)
-        self.formats_ready.emit(formats)
+from download_queue import (DownloadQueueModel, ProgressDelegate, ActionsDelegate, Job,
+                            ACTIVE_STATES, NAME_COLUMN, PROGRESS_COLUMN, ACTIONS_COLUMN)
+from service import expand_urls
 
 class VideoDownloaderApp(QMainWindow):
     """视频下载器应用类"""
@@ -44,14 +20,17 @@ class VideoDownloaderApp(QMainWindow):
         
         # 设置窗口标题和尺寸
         self.setWindowTitle("视频下载器")
-        self.setMinimumSize(600, 400)
+        self.setMinimumSize(800, 500)
         
         # 创建下载器实例
         self.downloader = VideoDownloader()
-        self.downloader.progress_signal.connect(self.update_progress)
-        self.downloader.complete_signal.connect(self.download_complete)
         self.downloader.error_signal.connect(self.show_error)
         
+        # 分析视频和展开播放列表共用一个线程池，下载由下载服务的调度器执行
+        self.thread_pool = QThreadPool.globalInstance()
+        self.queue_model = DownloadQueueModel(self.downloader.service, self)
+        self.queue_model.task_finished.connect(self.task_finished)
+        
         # 创建主窗口部件
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -74,6 +53,16 @@ class VideoDownloaderApp(QMainWindow):
         
         main_layout.addLayout(url_layout)
         
+        # 批量模式：每行一个链接（或播放列表链接）
+        self.batch_check = QCheckBox("批量模式（每行一个链接，支持播放列表）")
+        self.batch_check.toggled.connect(self.toggle_batch_mode)
+        main_layout.addWidget(self.batch_check)
+        
+        self.batch_input = QPlainTextEdit()
+        self.batch_input.setPlaceholderText("每行输入一个视频或播放列表链接...")
+        self.batch_input.setVisible(False)
+        main_layout.addWidget(self.batch_input)
+        
         # 创建格式选择区域
         format_layout = QHBoxLayout()
         format_label = QLabel("格式:")
@@ -82,6 +71,23 @@ class VideoDownloaderApp(QMainWindow):
         format_layout.addWidget(format_label)
         format_layout.addWidget(self.format_combo)
         
+        # 分片并发数（HLS/DASH视频）
+        fragments_label = QLabel("分片并发:")
+        self.fragments_spin = QSpinBox()
+        self.fragments_spin.setRange(1, 32)
+        self.fragments_spin.setValue(4)
+        format_layout.addWidget(fragments_label)
+        format_layout.addWidget(self.fragments_spin)
+        
+        # 同时进行的下载数
+        workers_label = QLabel("同时下载:")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 16)
+        self.workers_spin.setValue(self.downloader.service.scheduler.max_workers)
+        self.workers_spin.valueChanged.connect(self.downloader.service.scheduler.set_max_workers)
+        format_layout.addWidget(workers_label)
+        format_layout.addWidget(self.workers_spin)
+        
         main_layout.addLayout(format_layout)
         
         # 创建输出目录选择区域
@@ -100,24 +106,48 @@ class VideoDownloaderApp(QMainWindow):
         
         main_layout.addLayout(output_layout)
         
-        # 创建进度条
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setValue(0)
-        main_layout.addWidget(self.progress_bar)
+        # 下载队列，每一行有自己的进度和暂停/继续/取消按钮
+        self.queue_view = QTableView()
+        self.queue_view.setModel(self.queue_model)
+        self.queue_view.setItemDelegateForColumn(PROGRESS_COLUMN, ProgressDelegate(self.queue_view))
+        self.queue_view.setItemDelegateForColumn(ACTIONS_COLUMN, ActionsDelegate(self.queue_view))
+        self.queue_view.setSelectionBehavior(QTableView.SelectRows)
+        self.queue_view.verticalHeader().setVisible(False)
+        header = self.queue_view.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setSectionResizeMode(NAME_COLUMN, QHeaderView.Stretch)
+        header.resizeSection(ACTIONS_COLUMN, 180)
+        main_layout.addWidget(self.queue_view)
         
         # 创建状态标签
         self.status_label = QLabel("准备就绪")
         main_layout.addWidget(self.status_label)
         
-        # 创建下载按钮
+        # 创建下载按钮（加入队列，下载进行中也可以继续添加）
         self.download_btn = QPushButton("下载")
         self.download_btn.setEnabled(False)
         self.download_btn.clicked.connect(self.start_download)
-        main_layout.addWidget(self.download_btn)
         
-        # 初始化线程
-        self.download_thread = None
-        self.format_thread = None
+        # 清除已完成和已取消的行
+        self.clear_btn = QPushButton("清除已完成")
+        self.clear_btn.clicked.connect(self.queue_model.remove_finished)
+        
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.download_btn)
+        button_layout.addWidget(self.clear_btn)
+        main_layout.addLayout(button_layout)
+    
+    def toggle_batch_mode(self, checked):
+        """切换单个/批量输入模式"""
+        self.url_input.setVisible(not checked)
+        self.analyze_btn.setVisible(not checked)
+        self.batch_input.setVisible(checked)
+        
+        # 批量模式不分析格式，直接使用最佳质量下载
+        self.format_combo.clear()
+        self.format_combo.setEnabled(False)
+        self.download_btn.setEnabled(checked)
+        self.status_label.setText("请输入链接后开始下载" if checked else "准备就绪")
     
     def analyze_url(self):
         """分析URL获取可用格式"""
@@ -133,10 +163,10 @@ class VideoDownloaderApp(QMainWindow):
         self.download_btn.setEnabled(False)
         self.status_label.setText("正在分析视频...")
         
-        # 创建并启动格式获取线程
-        self.format_thread = FormatThread(self.downloader, url)
-        self.format_thread.formats_ready.connect(self.update_formats)
-        self.format_thread.start()
+        # 在线程池中获取格式
+        job = Job(self.downloader.get_available_formats, url)
+        job.signals.finished.connect(self.update_formats)
+        self.thread_pool.start(job)
     
     def update_formats(self, formats):
         """更新格式下拉框"""
@@ -176,47 +206,57 @@ class VideoDownloaderApp(QMainWindow):
                 os.makedirs(directory)
     
     def start_download(self):
-        """开始下载视频"""
+        """把视频加入下载队列"""
         url = self.url_input.text().strip()
         format_id = self.format_combo.currentData()
+        self.downloader.fragments = self.fragments_spin.value()
         
-        # 更新UI状态
-        self.download_btn.setEnabled(False)
-        self.analyze_btn.setEnabled(False)
-        self.format_combo.setEnabled(False)
-        self.progress_bar.setValue(0)
-        self.status_label.setText("正在下载...")
+        if self.batch_check.isChecked():
+            self.start_batch_download()
+            return
         
-        # 创建并启动下载线程
-        self.download_thread = DownloadThread(self.downloader, url, format_id)
-        self.download_thread.start()
-    
-    def update_progress(self, percentage, filename):
-        """更新下载进度"""
-        self.progress_bar.setValue(int(percentage))
-        self.status_label.setText(f"正在下载: {filename} ({percentage:.1f}%)")
+        self.queue_model.add(url, format_id, self.downloader.fragments, self.downloader.output_path)
+        self.status_label.setText(f"已加入队列: {url}")
     
-    def download_complete(self, filename):
-        """下载完成处理"""
-        self.progress_bar.setValue(100)
-        self.status_label.setText(f"下载完成: {filename}")
+    def start_batch_download(self):
+        """展开播放列表后把所有链接加入下载队列"""
+        urls = [line.strip() for line in self.batch_input.toPlainText().splitlines() if line.strip()]
+        if not urls:
+            QMessageBox.warning(self, "错误", "请输入视频URL")
+            return
         
-        # 恢复UI状态
-        self.download_btn.setEnabled(True)
-        self.analyze_btn.setEnabled(True)
-        self.format_combo.setEnabled(True)
+        self.status_label.setText(f"正在展开 {len(urls)} 个链接...")
+        fragments = self.downloader.fragments
+        output_dir = self.downloader.output_path
         
-        # 显示完成消息
-        QMessageBox.information(self, "下载完成", f"视频 {filename} 已下载完成")
+        def expanded(expanded_urls):
+            self.queue_model.add_many(expanded_urls, None, fragments, output_dir)
+            self.status_label.setText(f"已加入队列: {len(expanded_urls)} 个视频")
+        
+        # 展开播放列表需要访问网络，在线程池中执行
+        job = Job(expand_urls, urls)
+        job.signals.finished.connect(expanded)
+        job.signals.failed.connect(self.show_error)
+        self.thread_pool.start(job)
+    
+    def task_finished(self, name, status, error_msg):
+        """队列中的任务结束"""
+        counts = self.queue_model.counts()
+        pending = sum(counts.get(s, 0) for s in ACTIVE_STATES)
+        if status == "completed":
+            text = f"下载完成: {name}"
+        elif status == "error":
+            text = f"下载失败: {name} ({error_msg})"
+        else:
+            text = f"{name}: {status}"
+        self.status_label.setText(f"{text}，剩余 {pending} 个任务")
     
     def show_error(self, error_msg):
         """显示错误消息"""
         self.status_label.setText(f"错误: {error_msg}")
         
         # 恢复UI状态
-        self.download_btn.setEnabled(True)
         self.analyze_btn.setEnabled(True)
-        self.format_combo.setEnabled(True)
         
         # 显示错误消息
         QMessageBox.critical(self, "错误", error_msg)
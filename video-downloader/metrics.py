@@ -0,0 +1,182 @@
+import re
+import threading
+from urllib.parse import urlparse
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def host_of(url):
+    """链接的站点，用作指标标签"""
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host or "unknown"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """指标基类，按标签值分别记录"""
+
+    type = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function):
+        """采集时调用function获取数值，用于已在别处统计的值（只用于没有标签的指标）"""
+        self._function = function
+
+    def samples(self):
+        """返回 (后缀, 标签值, 额外标签, 数值) 列表"""
+        if self._function is not None:
+            return [("", (), (), self._function())]
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append(("_bucket", key, (("le", _format_value(bound)),), bucket_count))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), count))
+        return samples
+
+
+class Registry:
+    """指标注册表，输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# 按关键字把错误信息归类为失败原因
+FAILURE_REASONS = (
+    ("no_backend", re.compile(r"没有可以处理")),
+    ("unsupported", re.compile(r"unsupported url|不支持", re.I)),
+    ("geo_restricted", re.compile(r"geo.?restrict|in your country|地区", re.I)),
+    ("login_required", re.compile(r"sign in|log in|login|cookies|会员|登录", re.I)),
+    ("http_error", re.compile(r"HTTP Error \d+|\d{3} (?:Client|Server) Error")),
+    ("network", re.compile(r"timed? ?out|connection|network|SSL|resolve", re.I)),
+    ("disk", re.compile(r"No space|Permission denied|Errno 28|Errno 13", re.I)),
+)
+
+
+def failure_reason(message):
+    """返回错误信息对应的失败原因"""
+    for reason, pattern in FAILURE_REASONS:
+        if message and pattern.search(message):
+            return reason
+    return "other"
+
+
+registry = Registry()
+
+QUEUE_DEPTH = registry.gauge("downloader_queue_depth", "排队等待执行的下载任务数")
+ACTIVE_TASKS = registry.gauge("downloader_active_tasks", "正在执行的下载任务数")
+TASKS_SUBMITTED = registry.counter("downloader_tasks_submitted_total", "提交的下载任务数")
+TASKS_FINISHED = registry.counter("downloader_tasks_finished_total", "结束的下载任务数", ("status",))
+FAILURES = registry.counter("downloader_failures_total", "失败的下载任务数（按原因）", ("reason",))
+DOWNLOADED_BYTES = registry.counter(
+    "downloader_downloaded_bytes_total", "下载的字节数，rate()即每个站点的下载速度", ("host",)
+)
+EXTRACT_SECONDS = registry.histogram("downloader_extract_seconds", "yt-dlp提取视频信息的耗时", ("host",))
+PHASE_SECONDS = registry.histogram("downloader_phase_seconds", "下载任务各阶段的耗时", ("phase", "host"))
+BACKEND_ATTEMPTS = registry.counter(
+    "downloader_backend_attempts_total", "下载后端的尝试次数", ("backend", "result")
+)
+FALLBACKS = registry.counter("downloader_fallbacks_total", "前一个后端失败后改用备选后端的次数", ("backend",))
+YDL_POOL_HITS = registry.counter("downloader_ydl_pool_hits_total", "yt-dlp实例池命中次数")
+YDL_POOL_MISSES = registry.counter("downloader_ydl_pool_misses_total", "yt-dlp实例池未命中（新建实例）次数")
+
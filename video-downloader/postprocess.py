@@ -0,0 +1,265 @@
+import os
+import re
+import shutil
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from library import probe_media, publish_staged
+
+# ffmpeg可执行文件，未安装时不能使用后处理
+FFMPEG = shutil.which("ffmpeg")
+# 同时运行的ffmpeg进程数量，默认为CPU核心数
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", 0)) or os.cpu_count() or 1
+
+# 提取音频的编码参数
+AUDIO_FORMATS = {
+    "m4a": ["-c:a", "aac", "-b:a", "192k"],
+    "mp3": ["-c:a", "libmp3lame", "-q:a", "2"],
+    "opus": ["-c:a", "libopus", "-b:a", "128k"],
+    "flac": ["-c:a", "flac"],
+}
+# 响度标准化时按容器选择音频编码（视频流直接复制）
+LOUDNORM_CODECS = {".webm": "libopus", ".ogg": "libopus", ".opus": "libopus", ".mp3": "libmp3lame",
+                   ".flac": "flac"}
+# 可以直接封装的容器
+REMUX_FORMATS = ("mp4", "mkv", "webm", "mov")
+
+OUT_TIME_RE = re.compile(r'^out_time_(?:us|ms)=(\d+)$')
+
+
+class PostProcessCancelled(Exception):
+    """后处理被取消"""
+
+
+def run_ffmpeg(args, duration, progress, cancelled):
+    """运行ffmpeg并从 -progress 输出中解析进度
+
+    Args:
+        args: input之后的ffmpeg参数（包括输出文件）
+        duration: 输入时长（秒），未知时不报告中间进度
+        progress: 进度回调，参数为0~1
+        cancelled: 返回是否已取消的函数
+    """
+    cmd = [FFMPEG, "-hide_banner", "-nostdin", "-y", "-loglevel", "error", "-progress", "pipe:1"] + args
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            encoding="utf-8", errors="replace")
+    errors = deque(maxlen=20)
+    # stderr单独读取，避免管道写满阻塞ffmpeg
+    reader = threading.Thread(target=lambda: errors.extend(proc.stderr), daemon=True)
+    reader.start()
+    try:
+        for line in proc.stdout:
+            if cancelled():
+                raise PostProcessCancelled("后处理已取消")
+            match = OUT_TIME_RE.match(line.strip())
+            if match and duration:
+                # out_time_ms实际上也是微秒
+                progress(min(1.0, int(match.group(1)) / 1e6 / duration))
+        returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(5)
+    if returncode != 0:
+        raise Exception(f"ffmpeg失败: {' '.join(line.strip() for line in errors)}")
+    progress(1.0)
+
+
+def _output_path(work_dir, source, suffix):
+    """输出文件路径，与输入相同时（如连续两个替换原文件的步骤）先写入临时文件名"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    path = os.path.join(work_dir, stem + suffix)
+    if path == source:
+        path = os.path.join(work_dir, stem + ".tmp" + suffix)
+    return path
+
+
+def remux(source, work_dir, options, progress, cancelled):
+    """更换容器，不重新编码"""
+    fmt = options.get("format", "mp4")
+    output = _output_path(work_dir, source, "." + fmt)
+    args = ["-i", source, "-map", "0", "-c", "copy"]
+    if fmt in ("mp4", "mov"):
+        # 元数据移到文件开头，浏览器可以边下边播
+        args += ["-movflags", "+faststart"]
+    run_ffmpeg(args + [output], probe_media(source)["duration"], progress, cancelled)
+    return output
+
+
+def extract_audio(source, work_dir, options, progress, cancelled):
+    """提取音轨"""
+    fmt = options.get("format", "m4a")
+    output = _output_path(work_dir, source, "." + fmt)
+    args = ["-i", source, "-vn"] + AUDIO_FORMATS[fmt] + [output]
+    run_ffmpeg(args, probe_media(source)["duration"], progress, cancelled)
+    return output
+
+
+def thumbnail(source, work_dir, options, progress, cancelled):
+    """截取一帧作为封面，默认取时长的10%处"""
+    duration = probe_media(source)["duration"] or 0
+    at = options.get("at", duration * 0.1)
+    output = _output_path(work_dir, source, ".thumb.jpg")
+    args = ["-ss", str(at), "-i", source, "-frames:v", "1", "-q:v", "2", output]
+    run_ffmpeg(args, None, progress, cancelled)
+    return output
+
+
+def sprite(source, work_dir, options, progress, cancelled):
+    """生成预览拼图：均匀截取 columns x rows 帧拼成一张图"""
+    columns = int(options.get("columns", 5))
+    rows = int(options.get("rows", 5))
+    width = int(options.get("width", 160))
+    duration = probe_media(source)["duration"] or 0
+    interval = max(duration / (columns * rows), 0.1)
+    output = _output_path(work_dir, source, ".sprite.jpg")
+    args = ["-i", source, "-vf", f"fps=1/{interval:.3f},scale={width}:-2,tile={columns}x{rows}",
+            "-frames:v", "1", "-q:v", "3", output]
+    run_ffmpeg(args, duration, progress, cancelled)
+    return output
+
+
+def loudnorm(source, work_dir, options, progress, cancelled):
+    """按EBU R128标准化响度（单遍），视频流直接复制"""
+    ext = os.path.splitext(source)[1].lower()
+    target = options.get("i", -16)
+    output = _output_path(work_dir, source, ext)
+    args = ["-i", source, "-map", "0", "-c", "copy", "-af", f"loudnorm=I={target}:TP=-1.5:LRA=11",
+            "-c:a", LOUDNORM_CODECS.get(ext, "aac")]
+    run_ffmpeg(args + [output], probe_media(source)["duration"], progress, cancelled)
+    return output
+
+
+# 名称 -> (处理函数, 输出是否替换原文件)
+PROCESSORS = {
+    "remux": (remux, True),
+    "audio": (extract_audio, False),
+    "thumbnail": (thumbnail, False),
+    "sprite": (sprite, False),
+    "loudnorm": (loudnorm, True),
+}
+
+
+def parse_steps(spec):
+    """解析后处理步骤，如 ["remux", {"name": "audio", "format": "mp3"}]
+
+    Returns:
+        list: [{"name": ..., 其他选项}]，无效时抛出ValueError
+    """
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        spec = [item.strip() for item in spec.split(",") if item.strip()]
+    if not isinstance(spec, list):
+        raise ValueError("postprocess必须是列表")
+    steps = []
+    for item in spec:
+        step = {"name": item} if isinstance(item, str) else dict(item) if isinstance(item, dict) else None
+        if step is None or step.get("name") not in PROCESSORS:
+            raise ValueError(f"不支持的后处理: {item}")
+        if step["name"] == "remux" and step.get("format", "mp4") not in REMUX_FORMATS:
+            raise ValueError(f"不支持的封装格式: {step['format']}")
+        if step["name"] == "audio" and step.get("format", "m4a") not in AUDIO_FORMATS:
+            raise ValueError(f"不支持的音频格式: {step['format']}")
+        steps.append(step)
+    if steps and FFMPEG is None:
+        raise ValueError("后处理需要安装ffmpeg")
+    return steps
+
+
+class PostProcessor:
+    """下载完成后的后处理（更换容器、提取音频、截图、响度标准化）
+
+    每个步骤由独立的ffmpeg进程执行，同时运行的进程数量不超过CPU核心数；
+    调度线程只负责等待ffmpeg和解析进度，不会占用下载工作线程。
+    """
+
+    def __init__(self, max_workers=POSTPROCESS_WORKERS):
+        """初始化后处理器
+
+        Args:
+            max_workers: 同时运行的ffmpeg进程数量
+        """
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="postprocess")
+
+    def submit(self, task, done):
+        """提交任务的后处理，结束后在后处理线程中调用done(task, replaced)
+
+        replaced为被替换的原文件路径（已从下载目录删除），没有替换时为None。
+        """
+        return self._executor.submit(self._run, task, done)
+
+    def _run(self, task, done):
+        replaced = None
+        try:
+            replaced = self.process(task)
+        except PostProcessCancelled as e:
+            task.status = "cancelled"
+            task.error_message = str(e)
+        except Exception as e:
+            task.status = "error"
+            task.error_message = f"后处理失败: {str(e)}"
+        finally:
+            task.postprocess_step = None
+            done(task, replaced)
+
+    def process(self, task):
+        """按顺序执行任务的后处理步骤，输出文件先写入暂存目录，全部成功后再移到下载目录
+
+        Returns:
+            str: 被替换的原文件路径，没有替换时为None
+        """
+        work_dir = task.staging_dir
+        os.makedirs(work_dir, exist_ok=True)
+        original = current = task.filepath
+        steps = task.postprocess
+        try:
+            for i, step in enumerate(steps):
+                processor, replaces = PROCESSORS[step["name"]]
+                task.postprocess_step = step["name"]
+                task.enter_phase("postprocess", processor=step["name"])
+
+                def progress(fraction, i=i):
+                    task.postprocess_progress = round((i + fraction) * 100 / len(steps), 1)
+                    task.notify()
+
+                options = {key: value for key, value in step.items() if key != "name"}
+                output = processor(current, work_dir, options, progress, lambda: task.cancel_requested)
+                if replaces:
+                    if current != original:
+                        os.remove(current)
+                        name = os.path.join(work_dir, os.path.splitext(os.path.basename(current))[0]
+                                            + os.path.splitext(output)[1])
+                        if name != output:
+                            os.replace(output, name)
+                            output = name
+                    current = output
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+        if current != original and os.path.basename(current) == os.path.basename(original):
+            # 同名的输出（如响度标准化）直接原子替换原文件
+            os.replace(current, original)
+            current = original
+        if not os.listdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+            task.outputs = []
+            return None
+
+        published = publish_staged(work_dir, task.output_dir, current if current != original else None)
+        if current != original:
+            task.filepath = published[0]
+            task.filename = os.path.basename(task.filepath)
+            published = published[1:]
+            os.remove(original)
+        task.outputs = [os.path.basename(path) for path in published]
+        return original if current != original else None
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,192 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from urllib.parse import urlparse
+
+# 工作线程数量（同时进行的下载数）
+MAX_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))
+# 按站点限制并发，格式: "bilibili.com=2,youku.com=1"
+HOST_LIMITS = os.environ.get("DOWNLOAD_HOST_LIMITS", "bilibili.com=2")
+
+
+def parse_host_limits(spec):
+    """解析站点并发限制配置
+
+    Args:
+        spec: 形如 "bilibili.com=2,youku.com=1" 的字符串
+
+    Returns:
+        dict: 域名 -> 最大并发数
+    """
+    limits = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item or "=" not in item:
+            continue
+        host, limit = item.split("=", 1)
+        try:
+            limits[host.strip().lower()] = int(limit)
+        except ValueError:
+            print(f"忽略无效的站点并发配置: {item}")
+    return limits
+
+
+class DownloadScheduler:
+    """下载调度器
+
+    使用固定数量（可在运行时调整）的工作线程处理下载任务，任务按优先级排队（数值越大越优先，
+    同优先级先进先出），并对配置了上限的站点限制同时下载的任务数。
+    """
+
+    def __init__(self, handler, max_workers=MAX_WORKERS, host_limits=None):
+        """初始化调度器
+
+        Args:
+            handler: 执行单个任务的函数，参数为DownloadTask
+            max_workers: 工作线程数量
+            host_limits: 域名 -> 最大并发数，默认读取环境变量配置
+        """
+        self.handler = handler
+        self.max_workers = max(1, max_workers)
+        self.host_limits = host_limits if host_limits is not None else parse_host_limits(HOST_LIMITS)
+
+        self._queue = []  # (-priority, seq, task)
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._host_active = {}
+        self._active = 0
+        self._workers = []
+        self._worker_ids = itertools.count()
+        self._running = False
+
+    def start(self):
+        """启动工作线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._spawn_workers()
+
+    def set_max_workers(self, max_workers):
+        """调整同时进行的下载数，减少时正在进行的下载不受影响，结束后不再开始新的下载"""
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self._cond.notify_all()
+            running = self._running
+        if running:
+            self._spawn_workers()
+
+    def _spawn_workers(self):
+        """补足工作线程（减少并发时多余的线程保持空闲）"""
+        with self._cond:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            missing = self.max_workers - len(self._workers)
+            for _ in range(missing):
+                worker = threading.Thread(target=self._worker, name=f"download-worker-{next(self._worker_ids)}")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def shutdown(self, wait=True, timeout=None):
+        """停止调度器，排队中的任务不再执行
+
+        Args:
+            wait: 是否等待正在执行的任务结束
+            timeout: 等待的最长时间（秒），None表示一直等待
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if wait:
+            deadline = time.time() + timeout if timeout is not None else None
+            for worker in self._workers:
+                worker.join(None if deadline is None else max(0, deadline - time.time()))
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+
+    def submit(self, task, priority=0):
+        """提交下载任务，任务进入queued状态等待调度"""
+        task.status = "queued"
+        with self._cond:
+            heapq.heappush(self._queue, (-priority, next(self._counter), task))
+            self._cond.notify()
+
+    def cancel(self, task_id):
+        """从队列中移除尚未开始的任务，返回是否移除成功"""
+        with self._cond:
+            for i, entry in enumerate(self._queue):
+                if entry[2].task_id == task_id:
+                    self._queue[i] = self._queue[-1]
+                    self._queue.pop()
+                    heapq.heapify(self._queue)
+                    return True
+        return False
+
+    def queue_size(self):
+        """排队中的任务数量"""
+        with self._cond:
+            return len(self._queue)
+
+    def active_count(self):
+        """正在执行的任务数量"""
+        with self._cond:
+            return self._active
+
+    def host_key(self, url):
+        """返回任务所属的受限站点，未配置限制时返回None"""
+        host = (urlparse(url).hostname or "").lower()
+        for domain in self.host_limits:
+            if host == domain or host.endswith("." + domain):
+                return domain
+        return None
+
+    def _has_capacity(self, host):
+        if host is None:
+            return True
+        return self._host_active.get(host, 0) < self.host_limits[host]
+
+    def _take_next(self):
+        """取出优先级最高且站点未超限的任务，调用方需持有锁"""
+        skipped = []
+        found = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            host = self.host_key(entry[2].url)
+            if self._has_capacity(host):
+                found = (entry[2], host)
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return found
+
+    def _worker(self):
+        """工作线程主循环"""
+        while True:
+            with self._cond:
+                found = None
+                while self._running:
+                    found = self._take_next() if self._active < self.max_workers else None
+                    if found:
+                        break
+                    self._cond.wait()
+                if not found:
+                    return
+                task, host = found
+                self._active += 1
+                if host is not None:
+                    self._host_active[host] = self._host_active.get(host, 0) + 1
+
+            try:
+                self.handler(task)
+            except Exception as e:
+                task.status = "error"
+                task.error_message = str(e)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if host is not None:
+                        self._host_active[host] -= 1
+                    # 站点名额释放后，之前被跳过的任务可能可以执行了
+                    self._cond.notify_all()
@@ -0,0 +1,112 @@
+"""生产环境启动入口
+
+    python serve.py --bind 0.0.0.0:5000 --workers 4 --threads 8
+
+优先使用gunicorn（多进程，gthread工作模式）；未安装gunicorn（如Windows）时使用waitress（单进程多线程）。
+多个工作进程通过SQLite任务数据库共享任务状态；进程退出时会等待进行中的下载结束，
+超时未完成的下载交给其他工作进程或下次启动时续传。
+"""
+import os
+import sys
+import signal
+import argparse
+import importlib.util
+
+# 主进程不导入service、task_store等模块：它们在导入时会创建全局对象，
+# fork出的工作进程会继承这些对象（如任务归属的进程标识），应当由每个工作进程各自导入
+
+# 监听地址
+SERVE_BIND = os.environ.get("SERVE_BIND", "127.0.0.1:5000")
+# 工作进程数量（每个进程各自运行DOWNLOAD_WORKERS个下载线程）
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", 2))
+# 每个工作进程处理请求的线程数（SSE长连接各占一个线程）
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", 16))
+# 退出时等待进行中下载的默认时间（秒），与service.DRAIN_TIMEOUT相同
+DRAIN_TIMEOUT = int(os.environ.get("DRAIN_TIMEOUT", 300))
+# 任务存储类型，与task_store.TASK_STORE相同
+TASK_STORE = os.environ.get("TASK_STORE", "sqlite")
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    def post_worker_init(worker):
+        # 收到退出信号时先结束SSE等长连接，否则工作进程要等到graceful_timeout才能退出
+        from app import service
+        handle_exit = worker.handle_exit
+
+        def on_exit(sig, frame):
+            service.draining = True
+            handle_exit(sig, frame)
+
+        signal.signal(signal.SIGTERM, on_exit)
+
+    def worker_exit(server, worker):
+        from app import service
+        service.shutdown(args.drain_timeout)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", args.bind)
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("worker_class", "gthread")
+            # 下载服务的线程不能跨fork，每个工作进程导入应用时各自创建
+            self.cfg.set("preload_app", False)
+            # 主进程等待工作进程退出的时间，要覆盖下载的等待时间
+            self.cfg.set("graceful_timeout", args.drain_timeout + 60)
+            self.cfg.set("post_worker_init", post_worker_init)
+            self.cfg.set("worker_exit", worker_exit)
+
+        def load(self):
+            from app import app
+            return app
+
+    # 全局带宽上限由各工作进程平分（工作进程导入bandwidth时读取这个环境变量）
+    os.environ.setdefault("BANDWIDTH_SHARE", str(max(1, args.workers)))
+    Application().run()
+
+
+def run_waitress(args):
+    from waitress import serve
+    from app import app, service
+
+    if args.workers > 1:
+        print("waitress只支持单进程，忽略 --workers 参数")
+
+    def on_exit(sig, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_exit)
+    try:
+        serve(app, listen=args.bind, threads=args.threads)
+    finally:
+        service.shutdown(args.drain_timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以生产模式运行视频下载器网页版")
+    parser.add_argument("--bind", default=SERVE_BIND, help="监听地址，默认 %(default)s")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="工作进程数量，默认 %(default)s")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="每个工作进程的线程数，默认 %(default)s")
+    parser.add_argument("--drain-timeout", type=int, default=DRAIN_TIMEOUT,
+                        help="退出时等待进行中下载的最长时间（秒），默认 %(default)s")
+    parser.add_argument("--server", choices=("auto", "gunicorn", "waitress"), default="auto",
+                        help="使用的服务器，默认优先gunicorn")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and TASK_STORE == "memory":
+        print("警告: TASK_STORE=memory 时任务状态不会在工作进程之间共享")
+
+    server = args.server
+    if server == "auto":
+        server = "gunicorn" if importlib.util.find_spec("gunicorn") is not None else "waitress"
+
+    if server == "gunicorn":
+        run_gunicorn(args)
+    else:
+        run_waitress(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
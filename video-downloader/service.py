@@ -0,0 +1,902 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from yt_dlp.utils import DownloadCancelled
+
+from scheduler import DownloadScheduler
+from task_store import create_task_store, FINISHED_STATES, TASK_TTL
+from info_cache import extract_info, info_cache
+from ydl_pool import ydl_pool
+from events import ProgressBroker, Subscription
+from dedup import DedupIndex, dedup_key
+from backends import load_backends, is_chinese_site
+from library import FileIndex, publish_staged, staging_root, is_partial_file
+from bandwidth import limiter, parse_rate
+from postprocess import PostProcessor, parse_steps
+from metrics import (
+    host_of, failure_reason, QUEUE_DEPTH, ACTIVE_TASKS, TASKS_SUBMITTED, TASKS_FINISHED, FAILURES,
+    DOWNLOADED_BYTES, PHASE_SECONDS, BACKEND_ATTEMPTS, FALLBACKS, YDL_POOL_HITS, YDL_POOL_MISSES,
+)
+
+# 同时进行的视频分析数量
+ANALYZE_WORKERS = int(os.environ.get("ANALYZE_WORKERS", 8))
+# HLS/DASH分片的默认并发下载数
+CONCURRENT_FRAGMENTS = int(os.environ.get("CONCURRENT_FRAGMENTS", 4))
+# 内存中保留的批量任务数量
+BATCH_HISTORY = int(os.environ.get("BATCH_HISTORY", 1000))
+# 启动时是否自动恢复上次被中断的任务
+RESUME_ON_START = os.environ.get("RESUME_ON_START", "1") != "0"
+# 超过该时间且不属于任何进行中任务的临时文件会被清理（秒），与任务保留时间一致
+PARTIAL_MAX_AGE = int(os.environ.get("PARTIAL_MAX_AGE", TASK_TTL))
+# 临时文件清理间隔（秒）
+SWEEP_INTERVAL = int(os.environ.get("SWEEP_INTERVAL", 600))
+# 可以恢复的任务状态
+RESUMABLE_STATES = ("cancelled", "error", "interrupted")
+# 服务退出时等待进行中下载结束的最长时间（秒），超时的下载会中止并在下次启动或由其他工作进程续传
+DRAIN_TIMEOUT = int(os.environ.get("DRAIN_TIMEOUT", 300))
+# 检查并接手被中断任务的间隔（秒）
+RECOVER_INTERVAL = 5
+
+
+def progress_percent(d):
+    """根据进度回调中的字节数计算百分比
+
+    没有字节数时（如you-get）解析 _percent_str，无法计算时返回None。
+    """
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    downloaded = d.get('downloaded_bytes')
+    if total and downloaded is not None:
+        return min(100.0, downloaded * 100 / total)
+    try:
+        return float(d.get('_percent_str', '').replace('%', '').strip())
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class DownloadTask:
+    def __init__(self, url, format_id=None, priority=0, output_dir=None, fragments=None, parent_id=None,
+                 rate_limit=None, postprocess=None):
+        self.task_id = str(uuid.uuid4())
+        self.url = url
+        self.format_id = format_id
+        self.priority = priority
+        self.output_dir = output_dir
+        self.fragments = fragments or CONCURRENT_FRAGMENTS  # 分片并发数
+        self.parent_id = parent_id  # 所属批量任务
+        self.rate_limit = parse_rate(rate_limit)  # 任务的带宽上限（字节/秒），0表示不限制
+        self.postprocess = parse_steps(postprocess)  # 下载完成后的后处理步骤
+        self.progress = 0
+        # pending, queued, downloading, processing, completed, error, cancelled, interrupted
+        self.status = "pending"
+        self.filename = None
+        self.filepath = None  # 下载完成的文件完整路径
+        self.partial_file = None  # 正在写入的临时文件（.part），用于断点续传和清理
+        self.outputs = []  # 后处理生成的其他文件（如音频、封面）
+        self.postprocess_step = None  # 正在执行的后处理步骤
+        self.postprocess_progress = 0  # 后处理的总进度
+        self.duplicate_of = None  # 重复提交时，实际执行下载的任务ID
+        self.error_message = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # 阶段时间线，每项为 {"phase", "start", "end"}，下载相关阶段还带有 "backend"
+        self.phases = []
+        # 以下属性只在运行期间有效，不会持久化
+        self.hooks = []  # 额外的yt-dlp进度回调
+        self.on_update = None  # 状态变化时的通知函数
+        self.cancel_requested = False
+        self.dedup_key = None  # 作为下载者登记的去重键
+        self._downloaded_bytes = None  # 上次进度回调时已下载的字节数，用于计算限速
+    
+    def to_dict(self):
+        """转换为可持久化的字典"""
+        return {
+            "task_id": self.task_id,
+            "url": self.url,
+            "format_id": self.format_id,
+            "priority": self.priority,
+            "output_dir": self.output_dir,
+            "fragments": self.fragments,
+            "parent_id": self.parent_id,
+            "rate_limit": self.rate_limit,
+            "postprocess": self.postprocess,
+            "outputs": self.outputs,
+            "progress": self.progress,
+            "status": self.status,
+            "filename": self.filename,
+            "filepath": self.filepath,
+            "partial_file": self.partial_file,
+            "duplicate_of": self.duplicate_of,
+            "error_message": self.error_message,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "phases": self.phases,
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """从字典还原任务"""
+        task = cls(data["url"], data.get("format_id"), data.get("priority", 0), data.get("output_dir"))
+        for key, value in data.items():
+            setattr(task, key, value)
+        return task
+    
+    def to_status(self):
+        """返回对外暴露的任务状态"""
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "progress": self.progress,
+            "priority": self.priority,
+            "parent_id": self.parent_id,
+            "duplicate_of": self.duplicate_of,
+            "filename": self.filename,
+            "outputs": self.outputs,
+            "postprocess_step": self.postprocess_step,
+            "postprocess_progress": self.postprocess_progress,
+            "error_message": self.error_message
+        }
+    
+    def enter_phase(self, phase, **details):
+        """结束当前阶段并进入新阶段，如 queued -> extract -> prepare -> download -> postprocess -> publish"""
+        now = time.time()
+        self.end_phase(now)
+        entry = {"phase": phase, "start": now, "end": None}
+        entry.update(details)
+        self.phases.append(entry)
+
+    def end_phase(self, now=None):
+        """结束当前阶段并记录耗时"""
+        if self.phases and self.phases[-1]["end"] is None:
+            current = self.phases[-1]
+            current["end"] = now or time.time()
+            PHASE_SECONDS.observe(current["end"] - current["start"], phase=current["phase"], host=host_of(self.url))
+
+    @property
+    def phase(self):
+        """当前阶段，没有进行中的阶段时返回None"""
+        if self.phases and self.phases[-1]["end"] is None:
+            return self.phases[-1]["phase"]
+        return None
+
+    def notify(self):
+        """向订阅者推送当前状态（未变化时不会推送）"""
+        if self.on_update is not None:
+            self.on_update(self)
+        
+    def progress_hook(self, d):
+        """下载进度回调函数"""
+        if self.cancel_requested:
+            raise DownloadCancelled("任务已取消")
+        if d['status'] == 'downloading':
+            if self.phase != "download":
+                self.enter_phase("download", backend=self.phases[-1].get("backend") if self.phases else None)
+            percent = progress_percent(d)
+            if percent is not None:
+                self.progress = percent
+                self.filename = os.path.basename(d.get('filename') or '')
+            self.partial_file = d.get('tmpfilename')
+        elif d['status'] == 'finished':
+            # 文件下载完成，之后是合并音视频等后处理（分开下载的音频会再次进入download阶段）。
+            # 文件还在暂存目录中（合并格式时只是其中一个分段），任务保持downloading，
+            # 发布到下载目录后才由download_video标记为完成
+            self.enter_phase("postprocess", backend=self.phases[-1].get("backend") if self.phases else None)
+            self.progress = 100
+            self.partial_file = None
+        self.notify()
+        if d['status'] == 'downloading':
+            amount = self._transferred(d.get('downloaded_bytes'))
+            if amount:
+                DOWNLOADED_BYTES.inc(amount, host=host_of(self.url))
+                self.throttle(amount)
+
+    def _transferred(self, downloaded_bytes):
+        """返回距上次进度回调新下载的字节数"""
+        if downloaded_bytes is None:
+            return 0
+        # 第一次回调或开始下载新文件（如分开下载的音频）时只记录起点，
+        # 续传时已有的部分不计入
+        last, self._downloaded_bytes = self._downloaded_bytes, downloaded_bytes
+        if last is None or downloaded_bytes <= last:
+            return 0
+        return downloaded_bytes - last
+    
+    def throttle(self, amount):
+        """本次传输了amount字节，按带宽限制阻塞下载线程，等待期间可以被取消"""
+        deadline = time.monotonic() + limiter.reserve(self.task_id, self.url, amount, self.rate_limit)
+        while not self.cancel_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.2))
+    
+    @property
+    def staging_dir(self):
+        """任务的暂存目录，下载完成后文件才会被移动到output_dir"""
+        return os.path.join(staging_root(self.output_dir), self.task_id)
+    
+    def post_hook(self, filepath):
+        """yt-dlp后处理（如合并音视频）完成后的回调，记录最终文件路径"""
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+
+
+def download_video(task, backends):
+    """下载视频的函数（在调度器的工作线程中执行）
+
+    按顺序尝试支持该链接的下载后端，前一个失败时使用下一个作为备选。
+    """
+    task.status = "downloading"
+    task.notify()
+    os.makedirs(task.staging_dir, exist_ok=True)
+    
+    errors = []
+    for backend in backends:
+        if not backend.supports(task.url):
+            continue
+        if errors:
+            FALLBACKS.inc(backend=backend.name)
+        task.enter_phase("prepare", backend=backend.name)
+        try:
+            backend.download(task)
+        except DownloadCancelled:
+            BACKEND_ATTEMPTS.inc(backend=backend.name, result="cancelled")
+            task.status = "cancelled"
+            return
+        except Exception as e:
+            BACKEND_ATTEMPTS.inc(backend=backend.name, result="error")
+            errors.append(str(e))
+            task.error_message = f"{backend.name}失败，尝试备选方法: {str(e)}"
+            task.notify()
+            continue
+        BACKEND_ATTEMPTS.inc(backend=backend.name, result="success")
+
+        # 下载成功，把文件从暂存目录移到下载目录；移动失败不是后端的问题，不再用备选后端重新下载
+        task.enter_phase("publish")
+        try:
+            published = publish_staged(task.staging_dir, task.output_dir, task.filepath)
+        except Exception as e:
+            task.status = "error"
+            task.error_message = f"保存文件失败: {str(e)}"
+            return
+        task.filepath = published[0]
+        task.filename = os.path.basename(task.filepath)
+        # 文件已经在下载目录中，这时才标记为完成
+        task.status = "completed"
+        task.error_message = None
+        return
+    
+    task.status = "error"
+    if not errors:
+        task.error_message = "没有可以处理该链接的下载后端"
+    elif len(errors) == 1:
+        task.error_message = errors[0]
+    else:
+        # 备选方法也失败，告知用户使用录屏方法
+        task.error_message = f"备选下载失败: {errors[-1]}。请尝试使用浏览器录屏功能或OBS录制此视频。"
+
+
+def get_available_formats(url):
+    """获取视频可用的格式
+
+    Returns:
+        list: 格式列表，每个元素为 {"format_id": ..., "description": ...}
+    """
+    # 对于中国视频网站，提供简化选项
+    if is_chinese_site(url):
+        return [
+            {"format_id": "best", "description": "最佳质量 (自动)"},
+            {"format_id": "worst", "description": "最低质量 (更快)"}
+        ]
+    
+    # 对于其他网站使用原有的格式获取方法（结果会被缓存）
+    formats = []
+    info = extract_info(url)
+    if 'formats' in info:
+        for f in info['formats']:
+            format_note = f.get('format_note', '')
+            resolution = f.get('resolution', 'unknown')
+            format_id = f.get('format_id', '')
+            ext = f.get('ext', 'unknown')
+            desc = f"{format_note} ({resolution}, {ext})"
+            formats.append({"format_id": format_id, "description": desc})
+    return formats
+
+
+class BatchJob:
+    """批量下载任务，汇总多个子任务的进度"""
+
+    def __init__(self, urls, job_id=None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.urls = urls
+        self.tasks = []
+        self.created_at = time.time()
+
+    @property
+    def finished(self):
+        return all(task.status in FINISHED_STATES for task in self.tasks)
+
+    @property
+    def progress(self):
+        if not self.tasks:
+            return 0
+        return sum(task.progress for task in self.tasks) / len(self.tasks)
+
+    @property
+    def status(self):
+        statuses = [task.status for task in self.tasks]
+        if not statuses:
+            return "completed"
+        if not self.finished:
+            return "downloading" if any(s != "queued" for s in statuses) else "queued"
+        if all(s == "completed" for s in statuses):
+            return "completed"
+        if all(s == "cancelled" for s in statuses):
+            return "cancelled"
+        return "error"
+
+    def to_status(self):
+        """返回对外暴露的批量任务状态"""
+        counts = {}
+        for task in self.tasks:
+            counts[task.status] = counts.get(task.status, 0) + 1
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "progress": self.progress,
+            "total": len(self.tasks),
+            "counts": counts,
+            "tasks": [task.to_status() for task in self.tasks]
+        }
+
+
+def expand_urls(urls):
+    """展开链接列表中的播放列表
+
+    普通视频链接在展开时已经完整提取过，结果直接写入视频信息缓存供下载复用。
+
+    Returns:
+        list: 展开后的视频链接
+    """
+    expanded = []
+    with ydl_pool.acquire({'quiet': True, 'extract_flat': 'in_playlist'}) as ydl:
+        for url in urls:
+            try:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+            except Exception as e:
+                # 提取失败时保留原链接，由下载阶段报告错误（或走备选方法）
+                print(f"展开链接失败 {url}: {str(e)}")
+                expanded.append(url)
+                continue
+            if info.get('_type') == 'playlist':
+                for entry in info.get('entries') or []:
+                    entry_url = entry.get('webpage_url') or entry.get('url')
+                    if entry_url:
+                        expanded.append(entry_url)
+            else:
+                info_cache.put(url, info)
+                expanded.append(url)
+    return expanded
+
+
+class _AsyncSubscription(Subscription):
+    """在事件循环中消费的订阅"""
+
+    def __init__(self, loop, task_ids=None):
+        super().__init__(task_ids)
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def push(self, task_id, state):
+        super().push(task_id, state)
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        return self.get(timeout=0)
+
+
+class DownloadService:
+    """下载服务核心，网页版和桌面版共用
+
+    对外提供异步接口；阻塞的yt-dlp调用在有界的线程池中执行：
+    下载由调度器的工作线程执行，视频分析使用单独的线程池。
+    同步代码（Flask路由、Qt线程）可以通过run()调用这些接口。
+    """
+
+    def __init__(self, download_dir, task_store=None, scheduler=None, analyze_workers=ANALYZE_WORKERS,
+                 dedup=None, backends=None, postprocessor=None):
+        """初始化服务
+
+        Args:
+            download_dir: 默认下载目录
+            task_store: 任务存储，默认根据配置创建
+            scheduler: 下载调度器，默认使用环境变量配置
+            analyze_workers: 同时进行的视频分析数量
+            dedup: 去重索引，默认根据配置创建
+            backends: 下载后端列表，默认在启动时解析可用的后端
+            postprocessor: 后处理器，默认按CPU核心数创建
+        """
+        self.download_dir = download_dir
+        self.task_store = task_store if task_store is not None else create_task_store(DownloadTask.from_dict)
+        self.broker = ProgressBroker()
+        self.scheduler = scheduler if scheduler is not None else DownloadScheduler(self._run_task)
+        self.scheduler.handler = self._run_task
+        self._analyze_executor = ThreadPoolExecutor(max_workers=analyze_workers, thread_name_prefix="analyze")
+        self._waiters = {}  # task_id -> [(loop, future)]
+        self._jobs = OrderedDict()  # job_id -> BatchJob
+        self.dedup = dedup if dedup is not None else DedupIndex()
+        self.backends = backends if backends is not None else load_backends()
+        self.library = FileIndex(download_dir)
+        self.postprocessor = postprocessor if postprocessor is not None else PostProcessor()
+        self._processing = set()  # 正在后处理的task_id
+        self._followers = {}  # 下载者task_id -> 挂在其上的重复任务
+        self._interrupting = set()  # 服务退出时被中止的任务，稍后释放而不是结束
+        self.draining = False  # 是否正在退出，不再开始新的下载
+        self._lock = threading.Lock()
+        self._loop = None
+        self.scheduler.start()
+        QUEUE_DEPTH.set_function(self.scheduler.queue_size)
+        ACTIVE_TASKS.set_function(self.scheduler.active_count)
+        YDL_POOL_HITS.set_function(lambda: ydl_pool.hits)
+        YDL_POOL_MISSES.set_function(lambda: ydl_pool.misses)
+
+        # 多个工作进程共用任务存储时，同步其他进程的任务变化和取消请求
+        self.task_store.on_remote_update = self._on_remote_update
+        self.task_store.on_cancel_requested = self._on_cancel_requested
+
+        # 恢复上次运行时被中断的任务，之后定期接手已退出的工作进程留下的任务
+        self._recover_interrupted()
+        self._recoverer = threading.Thread(target=self._recover_loop, name="task-recovery")
+        self._recoverer.daemon = True
+        self._recoverer.start()
+
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="partial-file-sweeper")
+        self._sweeper.daemon = True
+        self._sweeper.start()
+
+    # ---- 同步桥接 ----
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="download-service-loop")
+                thread.daemon = True
+                thread.start()
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """在服务自己的事件循环中执行协程并等待结果（供同步代码调用）"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return future.result(timeout)
+
+    # ---- 异步接口 ----
+
+    async def analyze(self, url):
+        """获取视频可用的格式"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._analyze_executor, get_available_formats, url)
+
+    async def submit(self, url, format_id=None, priority=0, output_dir=None, hooks=None, fragments=None,
+                     rate_limit=None, postprocess=None):
+        """提交下载任务，立即返回DownloadTask"""
+        task = DownloadTask(url, format_id, priority, output_dir or self.download_dir, fragments,
+                            rate_limit=rate_limit, postprocess=postprocess)
+        task.hooks = list(hooks or [])
+        self.submit_task(task)
+        return task
+
+    async def submit_batch(self, urls, format_id=None, priority=0, output_dir=None, hooks=None,
+                           fragments=None, expand_playlists=True, rate_limit=None, postprocess=None):
+        """提交批量下载，播放列表会被展开为多个子任务
+
+        Returns:
+            BatchJob: 批量任务
+        """
+        job = BatchJob(list(urls))
+        postprocess = parse_steps(postprocess)
+        if expand_playlists:
+            loop = asyncio.get_running_loop()
+            urls = await loop.run_in_executor(self._analyze_executor, expand_urls, job.urls)
+
+        for url in urls:
+            task = DownloadTask(url, format_id, priority, output_dir or self.download_dir, fragments, job.job_id,
+                                rate_limit, postprocess)
+            task.hooks = list(hooks or [])
+            job.tasks.append(task)
+        # 先登记再提交，保证子任务的回调能看到完整的批量任务
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim_jobs()
+        for task in job.tasks:
+            self.submit_task(task)
+        return job
+
+    async def wait_batch(self, job_id):
+        """等待批量任务的所有子任务结束"""
+        job = self.get_job(job_id)
+        if job is not None:
+            await asyncio.gather(*[self.wait(task.task_id) for task in job.tasks])
+        return job
+
+    async def cancel(self, task_id):
+        """取消任务，返回是否成功"""
+        task = self.task_store.get(task_id)
+        if task is None or task.status in FINISHED_STATES:
+            return False
+        if not self.task_store.owns(task_id):
+            # 任务由其他工作进程执行，由它在下一次同步时取消
+            return self.task_store.request_cancel(task_id)
+        self._cancel_task(task)
+        return True
+
+    async def resume(self, task_id):
+        """重新提交已取消、失败或被中断的任务，已下载的部分会被续传
+
+        Returns:
+            DownloadTask: 恢复的任务，无法恢复时返回None
+        """
+        task = self.task_store.get(task_id)
+        if task is None or task.status not in RESUMABLE_STATES:
+            return None
+        task.cancel_requested = False
+        task.error_message = None
+        task.finished_at = None
+        task.duplicate_of = None
+        self.submit_task(task, resubmit=True)
+        return task
+
+    async def wait(self, task_id):
+        """等待任务结束并返回任务"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self.task_store.get(task_id)
+            if task is None or task.status in FINISHED_STATES:
+                return task
+            future = loop.create_future()
+            self._waiters.setdefault(task_id, []).append((loop, future))
+        return await future
+
+    async def progress(self, task_ids=None):
+        """异步迭代任务状态更新，task_ids为None时关注所有任务"""
+        sub = _AsyncSubscription(asyncio.get_running_loop(), task_ids)
+        self.broker.register(sub)
+        try:
+            while True:
+                updates = await sub.wait(self.broker.min_interval or None)
+                if not updates and self.broker.has_pending():
+                    self.broker.flush()
+                    updates = sub.get(timeout=0)
+                for _, state in updates:
+                    yield state
+        finally:
+            self.broker.unsubscribe(sub)
+
+    def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """停止服务：不再开始新的下载，等待进行中的下载结束
+
+        超时仍未结束的下载会被中止；所有未结束的任务（包括排队中的）被释放，
+        由其他工作进程或下次启动时续传。
+        """
+        self.draining = True
+        self.scheduler.shutdown(wait=False)
+        deadline = time.time() + timeout
+        while (self.scheduler.active_count() or self._processing) and time.time() < deadline:
+            time.sleep(0.5)
+
+        running = [task for task in self.task_store.active() if task.status in ("downloading", "processing")]
+        with self._lock:
+            self._interrupting.update(task.task_id for task in running)
+        for task in running:
+            task.cancel_requested = True
+        # 等待下载线程停止写入暂存目录后再释放，避免和接手的进程同时写入
+        self.scheduler.shutdown(wait=True, timeout=30)
+        self.postprocessor.shutdown(wait=True)
+        self.task_store.release(self.task_store.active())
+
+    # ---- 内部实现 ----
+
+    def get_task(self, task_id):
+        return self.task_store.get(task_id)
+
+    def get_job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            # 由其他工作进程提交的批量任务，从任务存储中还原
+            tasks = self.task_store.children(job_id)
+            if tasks:
+                job = BatchJob([task.url for task in tasks], job_id)
+                job.tasks = tasks
+        return job
+
+    def _cancel_task(self, task):
+        """取消本进程的任务"""
+        with self._lock:
+            followers = self._followers.get(task.duplicate_of, [])
+            detached = task in followers
+            if detached:
+                followers.remove(task)
+        # 被中断且没有自动恢复（RESUME_ON_START=0）的任务不在调度器中，直接结束
+        if detached or task.status == "interrupted" or self.scheduler.cancel(task.task_id):
+            task.status = "cancelled"
+            self._finish(task)
+        else:
+            # 正在下载的任务在下一次进度回调时中止
+            task.cancel_requested = True
+
+    def _trim_jobs(self):
+        """超过保留数量时丢弃最早的已结束批量任务，调用方需持有锁"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= BATCH_HISTORY:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+
+    def submit_task(self, task, resubmit=False):
+        """登记任务并交给调度器
+
+        Args:
+            task: 下载任务
+            resubmit: 是否是恢复的已有任务（不再计入提交数）
+        """
+        task.output_dir = task.output_dir or self.download_dir
+        task.on_update = self._publish
+        task.enter_phase("queued")
+        if not resubmit:
+            TASKS_SUBMITTED.inc()
+        self.task_store.add(task)
+
+        # 已分析过的链接可以在入队前直接去重（需要后处理的任务输出不同，不复用）
+        info = info_cache.get(task.url) if not task.postprocess else None
+        if info is not None and self._dedupe(task, info):
+            return
+        self.scheduler.submit(task, task.priority)
+        task.notify()
+
+    def _publish(self, task, force=False):
+        self.broker.publish(task.task_id, task.to_status(), force)
+        # 挂在该任务上的重复任务同步显示进度
+        for follower in list(self._followers.get(task.task_id, ())):
+            follower.progress = task.progress
+            follower.filename = task.filename
+            self.broker.publish(follower.task_id, follower.to_status(), force)
+
+    def _dedupe(self, task, info):
+        """尝试复用已下载或正在下载的相同视频
+
+        Returns:
+            bool: True表示任务已直接完成或已挂到进行中的任务上，无需再下载；
+                  否则task可能已登记为该视频的下载者（task.dedup_key）
+        """
+        key = dedup_key(info, task.format_id, task.output_dir)
+        if key is None:
+            return False
+
+        with self._lock:
+            filepath = self.dedup.lookup(key)
+            if filepath is None:
+                leader = self.dedup.claim(key, task)
+                if leader is None:
+                    task.dedup_key = key
+                    return False
+                task.duplicate_of = leader.task_id
+                task.status = "downloading"
+                task.progress = leader.progress
+                self._followers.setdefault(leader.task_id, []).append(task)
+        if filepath is None:
+            task.enter_phase("duplicate")
+            task.notify()
+            return True
+
+        # 已有相同的文件，直接完成
+        task.filepath = filepath
+        task.filename = os.path.basename(filepath)
+        task.progress = 100
+        task.status = "completed"
+        self._finish(task)
+        return True
+
+    def _run_task(self, task):
+        """执行下载任务并保存最终状态（调度器工作线程）"""
+        handled = False
+        try:
+            # 需要后处理的任务不复用其他任务的文件（输出不同）
+            if task.dedup_key is None and not task.postprocess:
+                task.enter_phase("extract")
+                try:
+                    info = extract_info(task.url)
+                except Exception:
+                    # 提取失败时交给下载流程处理（可能走备选方法）
+                    info = None
+                # 已直接完成或挂到了其他任务上时，由对应的流程负责结束任务
+                handled = info is not None and self._dedupe(task, info)
+            if not handled:
+                download_video(task, self.backends)
+        except Exception as e:
+            task.status = "error"
+            task.error_message = str(e)
+        finally:
+            # 服务退出时中止的下载不结束任务，由shutdown释放给其他工作进程续传
+            if not handled and task.task_id not in self._interrupting:
+                if task.status == "completed" and task.postprocess:
+                    self._start_postprocess(task)
+                else:
+                    self._finish(task)
+
+    def _start_postprocess(self, task):
+        """把下载完成的文件交给后处理器，不占用下载工作线程"""
+        task.status = "processing"
+        task.postprocess_progress = 0
+        with self._lock:
+            self._processing.add(task.task_id)
+        task.notify()
+        self.postprocessor.submit(task, self._postprocess_done)
+
+    def _postprocess_done(self, task, replaced):
+        """后处理结束（后处理线程），失败或取消时任务为error / cancelled，保留下载的原文件"""
+        with self._lock:
+            self._processing.discard(task.task_id)
+        if task.task_id in self._interrupting:
+            return
+        if replaced is not None:
+            self.library.remove(os.path.basename(replaced))
+        for name in task.outputs:
+            self.library.add(os.path.join(task.output_dir, name))
+        if task.status == "processing":
+            task.status = "completed"
+        elif task.filepath:
+            # 失败或取消时下载的原文件仍在下载目录中
+            self.library.add(task.filepath)
+        self._finish(task)
+
+    def _recover_interrupted(self):
+        """接手被中断的任务"""
+        for task in self.task_store.take_interrupted():
+            if RESUME_ON_START:
+                task.error_message = None
+                self.submit_task(task, resubmit=True)
+            else:
+                task.on_update = self._publish
+
+    def _recover_loop(self):
+        while not self.draining:
+            time.sleep(RECOVER_INTERVAL)
+            if self.draining:
+                break
+            try:
+                self._recover_interrupted()
+            except Exception as e:
+                print(f"恢复中断的任务失败: {str(e)}")
+
+    def _on_remote_update(self, task):
+        """其他工作进程的任务发生变化（任务存储的同步线程）"""
+        finished = task.status in FINISHED_STATES
+        self.broker.publish(task.task_id, task.to_status(), force=finished)
+        if not finished:
+            return
+        if task.status == "completed" and task.filepath:
+            self.library.add(task.filepath)
+        self.broker.forget(task.task_id)
+        with self._lock:
+            waiters = self._waiters.pop(task.task_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, task)
+
+    def _on_cancel_requested(self, task_id):
+        """其他工作进程请求取消本进程的任务"""
+        task = self.task_store.get(task_id)
+        if task is not None and task.status not in FINISHED_STATES:
+            self._cancel_task(task)
+
+    def sweep_partial_files(self):
+        """清理孤立的暂存目录和临时文件（不属于任何进行中的任务且已超过保留时间）
+
+        Returns:
+            int: 删除的暂存目录和文件数量
+        """
+        active_ids = set()
+        directories = {self.download_dir}
+        for task in self.task_store.active():
+            active_ids.add(task.task_id)
+            if task.output_dir:
+                directories.add(task.output_dir)
+
+        deadline = time.time() - PARTIAL_MAX_AGE
+        removed = 0
+        for directory in directories:
+            # 每个任务的暂存目录以task_id命名
+            try:
+                entries = list(os.scandir(staging_root(directory)))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.name in active_ids:
+                    continue
+                try:
+                    if entry.stat().st_mtime < deadline:
+                        shutil.rmtree(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+
+            # 旧版本直接写在下载目录中的临时文件
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not is_partial_file(entry.name):
+                    continue
+                try:
+                    if entry.stat().st_mtime < deadline:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                removed = self.sweep_partial_files()
+                if removed:
+                    print(f"已清理 {removed} 个孤立的临时文件")
+            except Exception as e:
+                print(f"清理临时文件失败: {str(e)}")
+
+    def _finish(self, task):
+        task.end_phase()
+        TASKS_FINISHED.inc(status=task.status)
+        # 重复任务的结果来自下载者，失败原因只统计一次
+        if task.status == "error" and task.duplicate_of is None:
+            FAILURES.inc(reason=failure_reason(task.error_message))
+        if task.dedup_key is not None:
+            self._finish_leader(task)
+        if task.status == "completed" and task.filepath:
+            self.library.add(task.filepath)
+        self.task_store.save(task)
+        # 最终状态不能被限频暂存，否则会随forget一起丢弃
+        self._publish(task, force=True)
+        self.broker.forget(task.task_id)
+        limiter.forget(task.task_id)
+        with self._lock:
+            waiters = self._waiters.pop(task.task_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, task)
+
+    def _finish_leader(self, task):
+        """登记下载结果并结束挂在该任务上的重复任务"""
+        key, task.dedup_key = task.dedup_key, None
+        if task.status == "completed" and task.filepath and os.path.exists(task.filepath):
+            try:
+                task.filepath = self.dedup.record(key, task.filepath)
+                task.filename = os.path.basename(task.filepath)
+            except (OSError, sqlite3.Error) as e:
+                print(f"登记去重索引失败: {str(e)}")
+        with self._lock:
+            self.dedup.release(key, task)
+            followers = self._followers.pop(task.task_id, [])
+        for follower in followers:
+            follower.status = task.status
+            follower.progress = task.progress
+            follower.filename = task.filename
+            follower.filepath = task.filepath
+            follower.error_message = task.error_message
+            self._finish(follower)
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
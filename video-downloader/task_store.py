@@ -0,0 +1,453 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# 任务存储后端: sqlite 或 memory
+TASK_STORE = os.environ.get("TASK_STORE", "sqlite")
+# SQLite数据库路径
+TASK_DB_PATH = os.environ.get(
+    "TASK_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks.db")
+)
+# 已结束任务的保留时间（秒）
+TASK_TTL = int(os.environ.get("TASK_TTL", 24 * 3600))
+# 内存中缓存的已结束任务数量
+TASK_CACHE_SIZE = int(os.environ.get("TASK_CACHE_SIZE", 1024))
+# 过期清理间隔（秒）
+EVICT_INTERVAL = 60
+# 进行中任务的进度写入数据库并同步其他工作进程变化的间隔（秒）
+TASK_SYNC_INTERVAL = float(os.environ.get("TASK_SYNC_INTERVAL", 1))
+# 工作进程超过该时间（秒）没有更新其任务时，任务被视为中断，由其他工作进程接手
+TASK_LEASE = int(os.environ.get("TASK_LEASE", 30))
+
+# 已结束的任务状态
+FINISHED_STATES = ("completed", "error", "cancelled")
+
+
+def instance_id():
+    """当前进程的标识，多个工作进程共用一个数据库时用于区分任务归属
+
+    在创建存储时生成而不是在导入时，fork出的工作进程不会继承主进程的标识。
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class TaskStore:
+    """任务存储接口
+
+    正在进行的任务以对象形式常驻内存（进度回调直接修改它），
+    任务结束后由存储负责持久化和过期清理。
+    """
+
+    # 其他工作进程的任务发生变化时的回调，参数为任务的副本
+    on_remote_update = None
+    # 其他工作进程请求取消本进程的任务时的回调，参数为task_id
+    on_cancel_requested = None
+
+    def add(self, task):
+        """登记新任务"""
+        raise NotImplementedError
+
+    def get(self, task_id):
+        """按ID获取任务，不存在时返回None"""
+        raise NotImplementedError
+
+    def save(self, task):
+        """保存任务的最新状态"""
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """清理超过保留时间的已结束任务，返回清理数量"""
+        raise NotImplementedError
+
+    def active(self):
+        """返回所有未结束的任务"""
+        raise NotImplementedError
+
+    def take_interrupted(self):
+        """认领被中断的任务（上次运行或已退出的工作进程留下的），不支持持久化的存储返回空列表"""
+        return []
+
+    def children(self, parent_id):
+        """返回批量任务的所有子任务"""
+        raise NotImplementedError
+
+    def owns(self, task_id):
+        """任务是否由本进程执行"""
+        return True
+
+    def request_cancel(self, task_id):
+        """请求执行该任务的其他工作进程取消任务，返回是否成功"""
+        return False
+
+    def release(self, tasks):
+        """进程退出前释放未结束的任务，由其他工作进程或下次启动时接手"""
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+
+class MemoryTaskStore(TaskStore):
+    """纯内存存储，重启后任务丢失，已结束的任务按TTL清理"""
+
+    def __init__(self, ttl=TASK_TTL):
+        self.ttl = ttl
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+
+    def add(self, task):
+        with self._lock:
+            self._tasks[task.task_id] = task
+
+    def get(self, task_id):
+        self._maybe_evict()
+        return self._tasks.get(task_id)
+
+    def save(self, task):
+        if task.status in FINISHED_STATES and not task.finished_at:
+            task.finished_at = time.time()
+        self.add(task)
+
+    def evict_expired(self):
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                task_id for task_id, task in self._tasks.items()
+                if task.finished_at and task.finished_at < deadline
+            ]
+            for task_id in expired:
+                del self._tasks[task_id]
+        return len(expired)
+
+    def active(self):
+        with self._lock:
+            return [task for task in self._tasks.values() if task.status not in FINISHED_STATES]
+
+    def children(self, parent_id):
+        with self._lock:
+            return [task for task in self._tasks.values() if task.parent_id == parent_id]
+
+    def _maybe_evict(self):
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            self._last_evict = time.time()
+            self.evict_expired()
+
+
+class SQLiteTaskStore(TaskStore):
+    """SQLite存储（WAL模式），可由多个工作进程共用
+
+    进行中的任务保存在内存字典中，进度每隔TASK_SYNC_INTERVAL秒写入数据库；
+    已结束的任务写入数据库，并在内存中保留一个固定大小的LRU缓存用于高频状态查询。
+    每个任务记录执行它的进程（owner），其他进程读取数据库中的副本，
+    通过cancel_requested标记请求取消；进程退出或超过TASK_LEASE没有更新时，
+    任务由其他进程认领并续传。
+    """
+
+    def __init__(self, task_factory, path=TASK_DB_PATH, ttl=TASK_TTL, cache_size=TASK_CACHE_SIZE,
+                 sync_interval=TASK_SYNC_INTERVAL, lease=TASK_LEASE):
+        """初始化存储
+
+        Args:
+            task_factory: 从字典还原任务对象的函数
+            path: 数据库文件路径
+            ttl: 已结束任务的保留时间（秒）
+            cache_size: LRU缓存容量
+            sync_interval: 进度写入和同步间隔（秒）
+            lease: 任务归属的有效期（秒）
+        """
+        self.task_factory = task_factory
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.sync_interval = sync_interval
+        self.lease = lease
+        self.instance_id = instance_id()
+
+        self._active = {}
+        self._persisted = {}  # task_id -> 最近写入的数据，未变化时不重复写入
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # 同一任务的进度写入和结束写入不能交错，否则旧状态可能覆盖最终状态
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._last_poll = time.time()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " finished_at REAL,"
+            " data TEXT NOT NULL)"
+        )
+        # 旧版本的数据库没有以下字段
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+        for column, definition in (("parent_id", "TEXT"), ("owner", "TEXT"), ("updated_at", "REAL"),
+                                   ("cancel_requested", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_finished ON tasks (finished_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks (parent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at)")
+        conn.commit()
+
+        self._evictor = threading.Thread(target=self._evict_loop, name="task-store-evictor")
+        self._evictor.daemon = True
+        self._evictor.start()
+        self._syncer = threading.Thread(target=self._sync_loop, name="task-store-sync")
+        self._syncer.daemon = True
+        self._syncer.start()
+
+    def _conn(self):
+        """每个线程使用独立的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take_interrupted(self):
+        """认领上次运行时或已退出的工作进程留下的未结束任务，任务被标记为interrupted"""
+        now = time.time()
+        conn = self._conn()
+        placeholders = ", ".join("?" * len(FINISHED_STATES))
+        rows = conn.execute(
+            f"SELECT owner, updated_at, cancel_requested, data FROM tasks WHERE status NOT IN ({placeholders})"
+            " AND (owner IS NULL OR (owner != ? AND (updated_at IS NULL OR updated_at < ?)))",
+            FINISHED_STATES + (self.instance_id, now - self.lease),
+        ).fetchall()
+
+        tasks = []
+        for owner, updated_at, cancel_requested, data in rows:
+            task = self.task_factory(json.loads(data))
+            if cancel_requested:
+                # 中断前已被请求取消
+                task.status = "cancelled"
+                task.finished_at = now
+            else:
+                task.status = "interrupted"
+                task.error_message = "服务重启，任务已中断"
+            data = json.dumps(task.to_dict(), ensure_ascii=False)
+            # 只有归属没有变化时才认领成功，避免多个进程认领同一个任务
+            cursor = conn.execute(
+                "UPDATE tasks SET owner = ?, status = ?, finished_at = ?, updated_at = ?, cancel_requested = 0,"
+                " data = ? WHERE task_id = ? AND owner IS ? AND updated_at IS ?",
+                (self.instance_id, task.status, task.finished_at, now, data, task.task_id, owner, updated_at),
+            )
+            conn.commit()
+            if cursor.rowcount and not cancel_requested:
+                with self._lock:
+                    self._active[task.task_id] = task
+                    self._persisted[task.task_id] = data
+                tasks.append(task)
+        return tasks
+
+    def _write(self, task, claim=False, changed_only=False):
+        """写入任务
+
+        Args:
+            claim: 是否由本进程接手任务；否则只在任务仍归本进程时更新
+            changed_only: 与上次写入的数据相同时跳过
+        """
+        with self._write_lock:
+            if task.status in FINISHED_STATES and not task.finished_at:
+                task.finished_at = time.time()
+            data = json.dumps(task.to_dict(), ensure_ascii=False)
+            if changed_only and self._persisted.get(task.task_id) == data:
+                return
+            values = (task.task_id, task.status, task.parent_id, task.finished_at, self.instance_id, time.time(),
+                      data)
+            conn = self._conn()
+            if claim:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tasks (task_id, status, parent_id, finished_at, owner, updated_at, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", values
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO tasks (task_id, status, parent_id, finished_at, owner, updated_at, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (task_id) DO UPDATE SET status = excluded.status,"
+                    " finished_at = excluded.finished_at, updated_at = excluded.updated_at, data = excluded.data"
+                    " WHERE tasks.owner IS excluded.owner",
+                    values
+                )
+            conn.commit()
+            with self._lock:
+                if task.status in FINISHED_STATES:
+                    self._persisted.pop(task.task_id, None)
+                elif claim or task.task_id in self._active:
+                    self._persisted[task.task_id] = data
+
+    def _cache_put(self, task):
+        self._cache[task.task_id] = task
+        self._cache.move_to_end(task.task_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def add(self, task):
+        # 先写入再登记，同步线程看到的任务一定已在数据库中
+        self._write(task, claim=True)
+        with self._lock:
+            self._active[task.task_id] = task
+            self._cache.pop(task.task_id, None)
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._active.get(task_id)
+            if task is not None:
+                return task
+            task = self._cache.get(task_id)
+            if task is not None:
+                self._cache.move_to_end(task_id)
+                return task
+
+        row = self._conn().execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        task = self.task_factory(json.loads(row[0]))
+        # 其他进程中进行中的任务还会变化，只缓存已结束的任务
+        if task.status in FINISHED_STATES:
+            with self._lock:
+                self._cache_put(task)
+        return task
+
+    def save(self, task):
+        self._write(task)
+        if task.status in FINISHED_STATES:
+            with self._lock:
+                self._active.pop(task.task_id, None)
+                self._cache_put(task)
+
+    def active(self):
+        with self._lock:
+            return list(self._active.values())
+
+    def children(self, parent_id):
+        rows = self._conn().execute(
+            "SELECT task_id FROM tasks WHERE parent_id = ? ORDER BY rowid", (parent_id,)
+        ).fetchall()
+        tasks = [self.get(task_id) for (task_id,) in rows]
+        return [task for task in tasks if task is not None]
+
+    def owns(self, task_id):
+        with self._lock:
+            return task_id in self._active
+
+    def request_cancel(self, task_id):
+        conn = self._conn()
+        placeholders = ", ".join("?" * len(FINISHED_STATES))
+        cursor = conn.execute(
+            f"UPDATE tasks SET cancel_requested = 1 WHERE task_id = ? AND status NOT IN ({placeholders})",
+            (task_id,) + FINISHED_STATES,
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def release(self, tasks):
+        conn = self._conn()
+        with self._write_lock:
+            for task in tasks:
+                task.status = "interrupted"
+                task.error_message = "服务重启，任务已中断"
+                with self._lock:
+                    self._active.pop(task.task_id, None)
+                    self._persisted.pop(task.task_id, None)
+                # 清除归属，其他进程可以立即认领
+                conn.execute(
+                    "UPDATE tasks SET owner = NULL, status = ?, updated_at = ?, data = ?"
+                    " WHERE task_id = ? AND owner = ?",
+                    (task.status, time.time(), json.dumps(task.to_dict(), ensure_ascii=False),
+                     task.task_id, self.instance_id),
+                )
+            conn.commit()
+
+    def sync(self):
+        """写入进行中任务的最新进度，并处理其他工作进程的取消请求和任务变化"""
+        now = time.time()
+        conn = self._conn()
+        with self._lock:
+            active = list(self._active.values())
+        for task in active:
+            self._write(task, changed_only=True)
+        # 心跳：刷新本进程所有任务的更新时间，避免被其他进程认领
+        placeholders = ", ".join("?" * len(FINISHED_STATES))
+        conn.execute(
+            f"UPDATE tasks SET updated_at = ? WHERE owner = ? AND status NOT IN ({placeholders})",
+            (now, self.instance_id) + FINISHED_STATES,
+        )
+        conn.commit()
+
+        rows = conn.execute(
+            "SELECT task_id FROM tasks WHERE owner = ? AND cancel_requested = 1", (self.instance_id,)
+        ).fetchall()
+        for (task_id,) in rows:
+            conn.execute("UPDATE tasks SET cancel_requested = 0 WHERE task_id = ?", (task_id,))
+            conn.commit()
+            if self.on_cancel_requested is not None:
+                self.on_cancel_requested(task_id)
+
+        # 写入时间和提交之间有间隔，多回看一个周期，重复的状态由订阅方丢弃
+        rows = conn.execute(
+            "SELECT data FROM tasks WHERE updated_at > ? AND (owner IS NULL OR owner != ?)",
+            (self._last_poll - self.sync_interval, self.instance_id),
+        ).fetchall()
+        self._last_poll = now
+        for (data,) in rows:
+            task = self.task_factory(json.loads(data))
+            with self._lock:
+                self._cache.pop(task.task_id, None)
+            if self.on_remote_update is not None:
+                self.on_remote_update(task)
+
+    def evict_expired(self):
+        deadline = time.time() - self.ttl
+        conn = self._conn()
+        cursor = conn.execute(
+            "DELETE FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (deadline,)
+        )
+        conn.commit()
+        with self._lock:
+            expired = [
+                task_id for task_id, task in self._cache.items()
+                if task.finished_at and task.finished_at < deadline
+            ]
+            for task_id in expired:
+                del self._cache[task_id]
+        return cursor.rowcount
+
+    def _evict_loop(self):
+        while True:
+            time.sleep(EVICT_INTERVAL)
+            try:
+                self.evict_expired()
+            except sqlite3.Error as e:
+                print(f"清理过期任务失败: {str(e)}")
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                print(f"同步任务状态失败: {str(e)}")
+
+
+def create_task_store(task_factory):
+    """根据配置创建任务存储
+
+    Args:
+        task_factory: 从字典还原任务对象的函数
+    """
+    if TASK_STORE == "memory":
+        return MemoryTaskStore()
+    return SQLiteTaskStore(task_factory)
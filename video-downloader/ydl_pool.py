@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import yt_dlp
+
+# 每组选项最多保留的空闲YoutubeDL实例数量
+YDL_POOL_SIZE = int(os.environ.get("YDL_POOL_SIZE", 4))
+# 实例使用多少次后重建，避免长期运行时累积状态和内存
+YDL_MAX_USES = int(os.environ.get("YDL_MAX_USES", 100))
+# 空闲实例的保留时间（秒）
+YDL_IDLE_TIMEOUT = int(os.environ.get("YDL_IDLE_TIMEOUT", 300))
+
+# 每次使用时单独设置的选项，不参与实例分组（yt-dlp在下载时才读取这些选项）
+RUNTIME_OPTIONS = ("paths", "concurrent_fragment_downloads", "continuedl")
+# 回调选项，使用时挂到实例上，归还时移除
+HOOK_OPTIONS = ("progress_hooks", "post_hooks")
+
+
+def options_key(opts):
+    """选项的分组键，相同选项的实例可以复用"""
+    static = {key: value for key, value in opts.items() if key not in RUNTIME_OPTIONS + HOOK_OPTIONS}
+    return json.dumps(static, sort_keys=True, default=repr)
+
+
+class _PooledYDL:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.uses = 0
+        self.idle_since = time.time()
+
+
+class YoutubeDLPool:
+    """按选项分组的YoutubeDL实例池
+
+    YoutubeDL创建时要初始化提取器、Cookie和网络连接，复用实例可以省去这些开销，
+    同一站点的后续请求也能复用已建立的keep-alive连接。YoutubeDL不是线程安全的，
+    每个实例同一时间只借给一个线程；使用中出错的实例直接关闭，不再放回池中。
+    """
+
+    def __init__(self, max_idle=YDL_POOL_SIZE, max_uses=YDL_MAX_USES, idle_timeout=YDL_IDLE_TIMEOUT):
+        """初始化实例池
+
+        Args:
+            max_idle: 每组选项最多保留的空闲实例数量
+            max_uses: 实例最多使用次数
+            idle_timeout: 空闲实例的保留时间（秒）
+        """
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # 选项键 -> [_PooledYDL]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def acquire(self, opts):
+        """借出一个按opts配置的YoutubeDL实例
+
+        Args:
+            opts: yt-dlp选项；RUNTIME_OPTIONS和回调每次使用时单独设置
+        """
+        key = options_key(opts)
+        pooled = self._take(key)
+        if pooled is None:
+            static = {k: v for k, v in opts.items() if k not in RUNTIME_OPTIONS + HOOK_OPTIONS}
+            pooled = _PooledYDL(yt_dlp.YoutubeDL(static))
+
+        ydl = pooled.ydl
+        for option in RUNTIME_OPTIONS:
+            if option in opts:
+                ydl.params[option] = opts[option]
+            else:
+                ydl.params.pop(option, None)
+        progress_hooks = list(opts.get("progress_hooks") or [])
+        post_hooks = list(opts.get("post_hooks") or [])
+        for hook in progress_hooks:
+            ydl.add_progress_hook(hook)
+        for hook in post_hooks:
+            ydl.add_post_hook(hook)
+
+        try:
+            yield ydl
+        except BaseException:
+            ydl.close()
+            raise
+        else:
+            # 移除本次使用的回调，实例才能借给其他任务
+            try:
+                for hook in progress_hooks:
+                    ydl._progress_hooks.remove(hook)
+                for hook in post_hooks:
+                    ydl._post_hooks.remove(hook)
+            except (AttributeError, ValueError):
+                ydl.close()
+                return
+            pooled.uses += 1
+            self._put(key, pooled)
+
+    def _take(self, key):
+        with self._lock:
+            expired = self._evict_idle()
+            idle = self._idle.get(key)
+            if idle:
+                self.hits += 1
+                pooled = idle.pop()
+            else:
+                self.misses += 1
+                pooled = None
+        for item in expired:
+            item.ydl.close()
+        return pooled
+
+    def _put(self, key, pooled):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if pooled.uses < self.max_uses and len(idle) < self.max_idle:
+                pooled.idle_since = time.time()
+                idle.append(pooled)
+                return
+        pooled.ydl.close()
+
+    def _evict_idle(self):
+        """取出超过保留时间的空闲实例（由调用方在锁外关闭），调用方需持有锁"""
+        deadline = time.time() - self.idle_timeout
+        expired = []
+        for key in list(self._idle):
+            idle = self._idle[key]
+            kept = [pooled for pooled in idle if pooled.idle_since >= deadline]
+            expired.extend(pooled for pooled in idle if pooled.idle_since < deadline)
+            if kept:
+                self._idle[key] = kept
+            else:
+                del self._idle[key]
+        return expired
+
+    def idle_count(self):
+        """空闲实例数量"""
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def close(self):
+        """关闭所有空闲实例"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for pooled_list in idle.values():
+            for pooled in pooled_list:
+                pooled.ydl.close()
+
+
+# 分析和下载共用的实例池
+ydl_pool = YoutubeDLPool()